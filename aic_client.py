@@ -0,0 +1,264 @@
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import Histogram
+
+# The client that every call to the Art Institute of Chicago's API goes through.
+# It keeps a pool of keep-alive connections, puts a time limit on connecting and on reading,
+# retries rate-limited (429) and server error (5xx) responses with jittered exponential backoff,
+# and stops calling the API for a while once it keeps failing (a circuit breaker), so that requests fail fast instead of piling up.
+# Given a FairScheduler, every request also waits for its turn under the API's rate limit (see FairScheduler below).
+
+# responses worth trying again; anything else (for example the 403 returned past page 100) is returned to the caller as is
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+upstream_latency = Histogram('aic_upstream_request_seconds', "Time spent on each request to the Art Institute's API, including retries.", ['endpoint'])
+scheduler_wait = Histogram('aic_scheduler_wait_seconds', "Time each request to the Art Institute waited for its turn under the rate limit.", ['scheduler', 'priority', 'outcome'])
+
+# the order in which queued requests are let through: a page a user is waiting on goes before background work such as prefetches
+PRIORITIES = ('interactive', 'background')
+
+
+class UpstreamError(Exception):
+    # the API could not give us what we asked for; app.py renders these as an error page
+    status_code = 502
+    message = "There was an error retrieving that page"
+
+    def __init__(self, message=None):
+        super().__init__(message or self.message)
+        self.message = message or self.message
+
+
+class UpstreamUnavailable(UpstreamError):
+    # the API is not responding or keeps failing, or the circuit breaker is open
+    status_code = 503
+    message = "The Art Institute of Chicago's collection is not responding right now. Please try again in a minute."
+
+
+class UpstreamThrottled(UpstreamUnavailable):
+    # the request waited longer than it may for its turn under the rate limit, so it was dropped before reaching the API
+    # callers treat it like any other outage and fall back to what is cached or stored locally
+    message = "The Art Institute of Chicago's collection is busy right now. Please try again in a minute."
+
+
+class CircuitBreaker:
+    # after failure_threshold failures in a row the circuit opens and calls are refused without touching the network
+    # once reset_seconds have passed, one trial call is let through: if it succeeds the circuit closes again, otherwise it stays open
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial_in_progress:
+                self.trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_progress or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_progress = False
+
+    def release_trial(self):
+        # the call that was let through never reached the API, so it says nothing either way; the next call may be the trial instead
+        with self.lock:
+            self.trial_in_progress = False
+
+
+class Waiter:
+    def __init__(self, user):
+        self.user = user
+        self.granted = False
+        self.event = threading.Event()
+
+
+class FairScheduler:
+    # a token bucket shared by every thread in the process: requests_per_second tokens are added every second, up to burst,
+    # and each request to the API takes one, so short bursts go straight through while the sustained rate stays under the API's limit
+    # when the bucket is empty, requests queue by priority, and within a priority each user's requests take turns with every other user's,
+    # so one user paging quickly (or a pile of their prefetches) cannot hold everyone else up
+    # a request that would wait longer than max_wait_seconds for its priority is shed with UpstreamThrottled
+    # get_caller() returns the (user, priority) that a request is queued under when the caller does not say; requests_per_second=0 turns the limit off
+    def __init__(self, name, requests_per_second, burst, max_wait_seconds, get_caller=None):
+        self.name = name
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_wait_seconds = max_wait_seconds
+        self.get_caller = get_caller
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        # for each priority, the queued requests of each user; the user at the front of the queue is served next and then moves to the back
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def acquire(self, priority=None):
+        # wait for a token; raises UpstreamThrottled if it takes longer than the priority's max wait
+        if not self.requests_per_second:
+            return
+
+        user, caller_priority = self.get_caller() if self.get_caller is not None else (None, 'interactive')
+        priority = priority or caller_priority
+        start = time.monotonic()
+        with self.lock:
+            self.refill(start)
+            if self.tokens >= 1 and not any(self.queues.values()):
+                self.tokens -= 1
+                scheduler_wait.observe(0, self.name, priority, 'immediate')
+                return
+            waiter = Waiter(user)
+            self.queues[priority].setdefault(user, deque()).append(waiter)
+
+        deadline = start + self.max_wait_seconds[priority]
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.dispatch(now)
+                if waiter.granted:
+                    scheduler_wait.observe(now - start, self.name, priority, 'granted')
+                    return
+                if now >= deadline:
+                    self.remove(priority, waiter)
+                    self.stats[f'{priority}_shed'] += 1
+                    scheduler_wait.observe(now - start, self.name, priority, 'shed')
+                    raise UpstreamThrottled()
+                # sleep until the next token is due, or until the deadline if that comes first; a dispatch by another thread wakes this one early
+                next_token_in = (1 - self.tokens) / self.requests_per_second
+            waiter.event.wait(min(next_token_in, deadline - now))
+
+    def refill(self, now):
+        # call with the lock held
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.requests_per_second)
+        self.updated_at = now
+
+    def dispatch(self, now):
+        # hand the tokens there are to the queued requests, in order of priority and taking turns between users; call with the lock held
+        self.refill(now)
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            while self.tokens >= 1 and queue:
+                user, waiters = queue.popitem(last=False)
+                waiter = waiters.popleft()
+                if waiters:
+                    queue[user] = waiters
+                self.tokens -= 1
+                waiter.granted = True
+                waiter.event.set()
+
+    def remove(self, priority, waiter):
+        # call with the lock held
+        waiters = self.queues[priority].get(waiter.user)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[priority][waiter.user]
+
+    def back_off(self, seconds):
+        # the API said it is rate limiting us, so empty the bucket and let nothing else through for a while
+        with self.lock:
+            self.refill(time.monotonic())
+            self.tokens = min(self.tokens, 0) - seconds * self.requests_per_second
+            self.stats['backed_off'] += 1
+
+    def queue_depths(self):
+        # how many requests are waiting right now, for each priority
+        with self.lock:
+            return {priority: sum(len(waiters) for waiters in self.queues[priority].values()) for priority in PRIORITIES}
+
+
+class AICClient:
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=10, max_retries=2, backoff_seconds=0.25, pool_size=20, breaker=None, on_request=None, scheduler=None, transport=None):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.scheduler = scheduler
+        # called with the endpoint and the seconds taken after every request, including failed ones
+        self.on_request = on_request
+
+        # one session shares its connections between threads, so repeat requests skip the TCP and TLS handshakes
+        # a transport from cassettes.py can be given instead, to record the API's responses or to replay them without the network
+        self.session = requests.Session()
+        adapter = transport or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # requests reads the proxy settings from the environment again for every request, which a transport that never opens a connection has no use for
+        self.session.trust_env = getattr(adapter, 'uses_network', True)
+        # the API asks clients to identify themselves with this header
+        self.session.headers['AIC-User-Agent'] = 'aic-collections-app'
+
+    def get(self, path, params=None, endpoint=None, stream=False, priority=None):
+        # GET base_url + path and return the response; with stream set, the body is read by the caller as it arrives instead of all at once
+        # priority is 'interactive' or 'background'; by default the scheduler decides from who is calling
+        # raises UpstreamUnavailable if the circuit is open, the API cannot be reached, or it is still failing after the retries,
+        # and UpstreamThrottled if the request, or one of its retries, waited too long for its turn under the rate limit
+        endpoint = endpoint or path
+        # the breaker is asked first, so a request that it refuses does not take a turn under the rate limit from one that could be sent
+        if not self.breaker.allow_request():
+            raise UpstreamUnavailable()
+        if self.scheduler is not None:
+            self.wait_for_turn(priority)
+
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt and self.scheduler is not None:
+                    # every retry is another request against the rate limit
+                    self.wait_for_turn(priority)
+
+                try:
+                    response = self.session.get(self.base_url + path, params=params, timeout=self.timeout, stream=stream)
+                except requests.RequestException:
+                    response = None
+
+                if response is not None and response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+
+                if response is not None and response.status_code == 429 and self.scheduler is not None:
+                    self.scheduler.back_off(self.get_backoff(attempt, response))
+
+                if attempt < self.max_retries:
+                    time.sleep(self.get_backoff(attempt, response))
+
+            self.breaker.record_failure()
+            raise UpstreamUnavailable()
+        finally:
+            elapsed = time.perf_counter() - start
+            upstream_latency.observe(elapsed, endpoint)
+            if self.on_request is not None:
+                self.on_request(endpoint, elapsed)
+
+    def wait_for_turn(self, priority):
+        # a request that waited too long for its turn was never sent, so it is not counted as a failure of the API by the circuit breaker
+        try:
+            self.scheduler.acquire(priority)
+        except UpstreamThrottled:
+            self.breaker.release_trial()
+            raise
+
+    def get_backoff(self, attempt, response):
+        # full jitter: a random wait of up to backoff_seconds * 2^attempt, so that retries from many requests do not line up
+        # a rate-limited response may say how long to wait in Retry-After, which is honoured up to a few seconds
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(int(response.headers['Retry-After']), 5)
+        return random.uniform(0, self.backoff_seconds * 2 ** attempt)
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# A cache of responses from the Art Institute's API that is shared by every user.
+# It has two tiers: a small in-process LRU that avoids touching the database for the most popular requests,
+# and a table in SQLite (api_responses) that survives restarts and is shared by every worker process.
+# Entries in both tiers expire after ttl_seconds.
+
+
+def normalize_search_term(search_term):
+    # "Monet ", "monet" and "MONET" are the same search
+    return ' '.join(search_term.lower().split())
+
+
+def normalize_search_key(search_term, page_number):
+    # searches that normalize to the same term share a cache entry
+    return f"search:{normalize_search_term(search_term)}:{int(page_number)}"
+
+
+class ResponseCache:
+    def __init__(self, get_connection, ttl_seconds=3600, max_memory_entries=500, max_stored_entries=20000):
+        # get_connection returns the database connection to use for the persistent tier
+        self.get_connection = get_connection
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_stored_entries = max_stored_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes_since_trim = 0
+        self.stats = {'memory_hits': 0, 'stored_hits': 0, 'misses': 0, 'expirations': 0, 'evictions': 0}
+
+    def get(self, key):
+        # return the cached payload for key, or None if there is no fresh entry in either tier
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                payload, fetched_at = entry
+                if now - fetched_at < self.ttl_seconds:
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return payload
+                del self.memory[key]
+                self.stats['expirations'] += 1
+
+        row = self.get_connection().execute("SELECT payload, fetched_at FROM api_responses WHERE key = ?", [key]).fetchone()
+        if row is not None and now - row['fetched_at'] < self.ttl_seconds:
+            payload = json.loads(row['payload'])
+            self.remember(key, payload, row['fetched_at'])
+            with self.lock:
+                self.stats['stored_hits'] += 1
+            return payload
+
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def get_stale(self, key):
+        # return the cached payload for key even if it has expired, or None if there is none
+        # used when the API is unavailable, since an old page of results is better than an error
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                return entry[0]
+
+        row = self.get_connection().execute("SELECT payload FROM api_responses WHERE key = ?", [key]).fetchone()
+        if row is not None:
+            return json.loads(row['payload'])
+        return None
+
+    def set(self, key, payload):
+        # store a payload in both tiers; the caller commits, so the write can share a transaction with other work
+        fetched_at = time.time()
+        self.remember(key, payload, fetched_at)
+
+        conn = self.get_connection()
+        conn.execute(
+            "INSERT INTO api_responses (key, payload, fetched_at) VALUES(?, ?, ?) ON CONFLICT (key) DO UPDATE SET payload = excluded.payload, fetched_at = excluded.fetched_at",
+            [key, json.dumps(payload), fetched_at]
+        )
+
+        # every so often, drop the expired rows and the oldest rows beyond max_stored_entries
+        self.writes_since_trim += 1
+        if self.writes_since_trim >= 100:
+            self.writes_since_trim = 0
+            self.trim(conn, fetched_at)
+
+    def warm(self, limit=None):
+        # fill the in-process tier with the most recently fetched entries that have not expired, up to limit; returns how many were loaded
+        rows = self.get_connection().execute(
+            "SELECT key, payload, fetched_at FROM api_responses WHERE fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?",
+            [time.time() - self.ttl_seconds, min(limit or self.max_memory_entries, self.max_memory_entries)]
+        ).fetchall()
+        # oldest first, so the most recent end up as the most recently used
+        for row in reversed(rows):
+            self.remember(row['key'], json.loads(row['payload']), row['fetched_at'])
+        return len(rows)
+
+    def remember(self, key, payload, fetched_at):
+        # put an entry in the in-process tier, evicting the least recently used entries once it is full
+        with self.lock:
+            self.memory[key] = (payload, fetched_at)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def trim(self, conn, now):
+        expired = conn.execute("DELETE FROM api_responses WHERE fetched_at < ?", [now - self.ttl_seconds]).rowcount
+        evicted = conn.execute(
+            "DELETE FROM api_responses WHERE fetched_at < (SELECT fetched_at FROM api_responses ORDER BY fetched_at DESC LIMIT 1 OFFSET ?)",
+            [self.max_stored_entries - 1]
+        ).rowcount
+        with self.lock:
+            self.stats['expirations'] += expired
+            self.stats['evictions'] += evicted
@@ -1,37 +1,65 @@
+import time
+# how long importing the app and everything it uses takes, reported by /metrics along with the rest of startup
+import_started = time.perf_counter()
 import sqlite3
-import os
-from flask import Flask, redirect, render_template, request, session
-from flask_session import Session
-from werkzeug.security import check_password_hash, generate_password_hash
-from helper_methods import get_items, get_image_url, clear_search, get_artwork_for_search, get_db_connection
-from dotenv import load_dotenv
-
-load_dotenv()
-db_path = os.getenv('DB_PATH')
+from flask import Blueprint, Flask, Response, abort, current_app, redirect, render_template, request, send_file, session, stream_with_context
+from aic_client import UpstreamError, scheduler_wait, upstream_latency
+from helper_methods import get_items, get_image_url, get_artwork_image, get_image_rendition_url, image_widths, image_cache, search_cache, hydrate_artworks, get_artwork_for_search, get_collection_page, get_user_collection, find_or_create_collection, add_artworks_to_collection, add_search_page_to_collection, copy_collection, remove_artworks_from_collection, delete_user_collection, artwork_fragments, start_search, get_search, get_recent_searches, use_search, search_prefetcher, artwork_prefetcher, prefetch_adjacent_pages, single_flight, aic_scheduler, image_scheduler, api_transport, image_transport, password_hasher, get_db_connection, close_db_connection, init_services, start_orphan_sweep
+from catalog_import import import_catalog_command
+from config import load_config
+from collection_transfer import CollectionImportError, export_csv, export_jsonl, export_zip, import_collection_records, iter_export_records, iter_import_records
+from instrumentation import init_instrumentation, request_histograms
+from metrics import render_metrics
+from page_cache import cacheable, make_etag, not_modified
+from passwords import PasswordHasherBusy
+from migrations import MIGRATIONS, ROUTE_QUERIES, db_cli, get_schema_version, upgrade_database
+from search_index import search_collections
+from sessions import configure_sessions, sessions_cli
+from startup import compile_templates, prepare_statements, start_in_each_process, timed
+import_seconds = time.perf_counter() - import_started
 
 # I built this application on the heels of completing the HarvardX CS50x's Finance Problem Set.
 # I followed the prececent there for registration and login. That is where I learned to use flask_session, werkzeug.security's check_password_hash, etc.
 # In general, the use of flask, jinja, etc. is influenced by that problem set, and I followed the format for rendering templates, etc. from that lab.
 
 
-# set up the code to reference and interact with the session and database
-app = Flask(__name__)
-
-# This is the schema for the database
-# CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, username TEXT NOT NULL, hash TEXT NOT NULL);
-# CREATE TABLE sqlite_sequence(name,seq);
-# CREATE TABLE searches (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER, name TEXT UNIQUE NOT NULL, page_limit INTEGER);
-# CREATE TABLE artwork_searches (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, artwork_id INTEGER, search_id INTEGER, current_page INTEGER);
-# CREATE TABLE collected_works (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER, artwork_id INTEGER, collection_id INTEGER);
-# CREATE TABLE collections (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER NOT NULL, title NOT NULL);
-# CREATE TABLE artworks (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, title TEXT, alt_text TEXT, artwork_id INTEGER NOT NULL, art_institute_url TEXT, display_url TEXT, artist_info TEXT, date_info TEXT);
-
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+# the routes are registered on an app made by create_app, at the bottom of this file
+# the settings, including .env, are read by create_app (see config.py)
+routes = Blueprint('routes', __name__)
+
+@routes.app_errorhandler(UpstreamError)
+def upstream_error(error):
+    # the Art Institute's API failed or is unavailable and there was nothing cached to show instead
+    return render_template("error_message.html", message=error.message), error.status_code
+
+@routes.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    # too many logins are waiting to have their passwords checked
+    return render_template("error_message.html", message=error.message), error.status_code
+
+@routes.route("/metrics")
+def metrics():
+    # the request, upstream, scheduler, cache and prefetch metrics in Prometheus' text format, for this process only
+    return Response(render_metrics(
+        request_histograms + [upstream_latency, scheduler_wait],
+        [('search_cache_events_total', "Lookups and evictions in the cache of search results from the API.", 'event', search_cache.stats),
+         ('search_prefetch_events_total', "Background prefetches of pages of search results.", 'event', search_prefetcher.stats),
+         ('artwork_prefetch_events_total', "Background fetches of the details of imported artworks.", 'event', artwork_prefetcher.stats),
+         ('image_cache_events_total', "Lookups and evictions in the cache of artwork images.", 'event', image_cache.stats),
+         ('artwork_fragment_cache_events_total', "Lookups and evictions in the cache of rendered artwork details.", 'event', artwork_fragments.stats),
+         ('single_flight_events_total', "Work that concurrent requests shared instead of each doing it.", 'event', single_flight.stats),
+         ('aic_scheduler_events_total', "Requests to the Art Institute's API that were shed, and times it told us to back off.", 'event', aic_scheduler.stats),
+         ('iiif_scheduler_events_total', "Requests to the Art Institute's image server that were shed, and times it told us to back off.", 'event', image_scheduler.stats)]
+        # with AIC_TRANSPORT=record or replay, how many responses were recorded, or replayed, missing from the store or failed on purpose
+        + ([('aic_transport_events_total', f"Requests to the Art Institute's API handled by the {current_app.config['AIC_TRANSPORT']} transport.", 'event', api_transport.stats),
+            ('iiif_transport_events_total', f"Requests to the Art Institute's image server handled by the {current_app.config['AIC_TRANSPORT']} transport.", 'event', image_transport.stats)] if current_app.config['AIC_TRANSPORT'] != 'live' else []),
+        [('aic_scheduler_queue_depth', "Requests to the Art Institute's API waiting for their turn, by priority.", 'priority', aic_scheduler.queue_depths()),
+         ('iiif_scheduler_queue_depth', "Requests to the Art Institute's image server waiting for their turn, by priority.", 'priority', image_scheduler.queue_depths()),
+         ('app_startup_seconds', "Time taken by each step of starting the app, in the process that created it.", 'phase', current_app.extensions['startup_seconds'])]
+    ), mimetype='text/plain; version=0.0.4')
 
 # the registration route, where users sign up for an account and are automatically logged in upon succesful creation of one
-@app.route("/register", methods=["GET", "POST"])
+@routes.route("/register", methods=["GET", "POST"])
 def register():
     session.clear()
 
@@ -59,7 +87,8 @@ def register():
 
         username = request.form.get("username")
         # for security reasons, hash the password so we are not storing a string literal in the database
-        hash = generate_password_hash(request.form.get("password"))
+        # the hashing runs in one of password_hasher's worker processes, so it does not hold up the other requests
+        hash = password_hasher.hash(request.form.get("password"))
 
         # check whether the user is already in the database
         # if the user is not in the database, go ahead and create the user
@@ -70,13 +99,9 @@ def register():
                 "INSERT INTO users (username, hash) VALUES(?, ?)", [username, hash]
             ).fetchall()
             conn.commit()
-            conn.close()
 
             # automatically log the user in if all is successful
-            conn = get_db_connection()
             user_rows = conn.execute("SELECT * FROM users WHERE username = ?", [username]).fetchall()
-            conn.commit()
-            conn.close()
             session["user_id"] = user_rows[0]["id"]
             return redirect("/")
 
@@ -84,7 +109,7 @@ def register():
         return render_template("error_message.html", message="Registration Unsuccessful.")
 
 
-@app.route("/login", methods=["GET", "POST"])
+@routes.route("/login", methods=["GET", "POST"])
 def login():
     # clear any session that is open and render the form to log in
     session.clear()
@@ -109,14 +134,16 @@ def login():
         'SELECT * FROM users WHERE username = ?', [request.form.get("username")]
     ).fetchall()
 
-    conn.commit()
-    conn.close()
-
-    if len(user_rows) != 1 or not check_password_hash(
+    if len(user_rows) != 1 or not password_hasher.check(
         user_rows[0]["hash"], request.form.get("password")
     ):
         return render_template("error_message.html", message="invalid username and/or password")
 
+    # if the password was hashed with an older method or work factor, hash it again the current way now that we have it
+    if password_hasher.needs_rehash(user_rows[0]["hash"]):
+        conn.execute("UPDATE users SET hash = ? WHERE id = ?", [password_hasher.hash(request.form.get("password")), user_rows[0]["id"]])
+        conn.commit()
+
     # if the username and password are correct, store the user id in the session to give the user access and redirect to the home page
     session["user_id"] = user_rows[0]["id"]
 
@@ -124,104 +151,83 @@ def login():
     return redirect("/")
 
 
-@app.route("/logout")
+@routes.route("/logout")
 def logout():
-    # clear any open searches, clear the session, and redirect to the home page, which should take the user to the login page
-    clear_search()
+    # stop prefetching pages of the user's searches, clear the session, and redirect to the home page, which should take the user to the login page
+    # the searches themselves are kept until they expire, so they are still there if the user logs back in
+    search_prefetcher.cancel(session["user_id"])
     session.clear()
     return redirect("/")
 
 
-@app.route("/", methods=["GET", "POST"])
+@routes.route("/", methods=["GET", "POST"])
 def index():
     if not session or not session["user_id"]:
         return redirect("/login")
 
-    # clear the search when a user navigates away from the search results
-    clear_search()
     return render_template("index.html")
 
-@app.route("/search", methods=["GET", "POST"])
+@routes.route("/search", methods=["GET", "POST"])
 def search():
     if not session or not session["user_id"]:
         return redirect("/")
 
     if request.method == "GET":
-        # clear the last search when a user has navigated away from the search results and is starting a new search, and display the search input form
-        clear_search()
-        return render_template("search.html")
+        # display the search input form, along with the user's recent searches so they can go back to one without fetching it again
+        conn = get_db_connection()
+        return render_template("search.html", searches=get_recent_searches(conn, session["user_id"]))
 
     elif request.method == "POST":
         # when the user has submitted a search term, make the fetch to get the first set of matches from the Art Institute of Chicago API
+        # if the user has already searched for the same term, their existing search is reused
+        # either way, redirect to the search's first page, which has a url that can be bookmarked or opened in another tab
         if request.form.get('search'):
-            search_term = request.form.get('search')
-            page_number = 1
-            artwork_rows = get_items(search_term, page_number)
-            conn = get_db_connection()
-   
-            search_rows = conn.execute("SELECT * FROM searches WHERE user_id = ?", [session["user_id"]]).fetchall()
+            search = start_search(request.form.get('search'))
+            return redirect(f"/search_results?search_id={search['id']}&page_number=1")
 
-            conn.commit()
-            conn.close()
+        return redirect("/search")
 
-            return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=search_rows[0]['page_limit'], search_term=search_term)
 
-
-@app.route("/search_results", methods=["GET", "POST"])
+@routes.route("/search_results", methods=["GET"])
 def search_results():
     if not session or not session["user_id"]:
         return redirect("/")
 
-    if request.method == "POST":
-        page_number = request.form.get('page_number')
-        # there should always only be one search in the database per user; get the information for this search
-        conn = get_db_connection()
-        search_rows = conn.execute("SELECT * from searches WHERE user_id = ?", [session["user_id"]]).fetchall()
-        conn.commit()
-        conn.close()
-        page_limit = search_rows[0]['page_limit']
-        search_term = search_rows[0]['name']
-
-        # reset the page number that the user is requesting based on which arrow was pressed in the search results in order to navigate forwards or backwards
-        if request.form.get('page_number_plus'):
-            if int(request.form.get('page_number_plus')) < page_limit:
-                # request the next page number (either from the API or from the database if it has already been fetched) if the forward arrow was pressed and the user is not already on the last page
-                page_number = int(request.form.get('page_number_plus')) + 1
-            else:
-                # stay on the same page if the user is on the last page
-                artwork_rows = get_artwork_for_search(page_number)
-                return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
-
-        elif request.form.get('page_number_minus'):
-            if int(request.form.get('page_number_minus')) > 1:
-                # request the prior page number (either from the API or from the database if it has already been fetched) when the user presses the back arrow and is not on the first results page
-                page_number = int(request.form.get('page_number_minus')) - 1
-            else:
-                # stay on the same page if the user is on the first results page
-                artwork_rows = get_artwork_for_search(page_number)
-                return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
-
-        elif request.form.get('page_number_end'):
-                if int(request.form.get('page_number')) < page_limit:
-                    # request the very last page of results (either from the API or from the database if it has already been fetched) when the user presses the double forward arrow if the user is not already on the last page
-                    page_number=int(request.form.get('page_number_end'))
-                else:
-                    artwork_rows = get_artwork_for_search(page_number)
-                    return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
-
-        elif request.form.get('page_number_beginning'):
-                # get the first page of results from the database when the user presses the double backwards arrow if the user is not already on the first page
-                if int(request.form.get('page_number')) > 1:
-                    page_number = 1
-                else:
-                    artwork_rows = get_artwork_for_search(page_number)
-                    return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
-
-        artwork_rows = get_items(search_term, page_number)
-        return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
-
-
-@app.route("/artwork_showpage", methods=["GET", "POST"])
+    # the search and the page of it to display are in the url; a user can have several searches open in different tabs
+    conn = get_db_connection()
+    search = get_search(conn, session["user_id"], request.args.get('search_id'))
+    if search is None:
+        return render_template("error_message.html", message="That search has expired. Please search again.")
+
+    # the navigation arrows link to the first, previous, next and last pages, so the requested page only needs to be kept within the search's pages
+    page_number = max(min(request.args.get('page_number', 1, type=int), search['page_limit']), 1)
+
+    # get the requested page (either from the API or from the database if it has already been fetched)
+    artwork_rows = get_items(search['name'], page_number)
+    # the page limit can change once a page is fetched, if the search started from the local search index
+    search = get_search(conn, session["user_id"], search['id'])
+    use_search(conn, search)
+
+    prefetch_adjacent_pages(search['name'], page_number, search['page_limit'])
+
+    # the user's collections, which the artworks on the page can be added to
+    all_collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
+
+    # a page of a search does not change once it is stored, apart from the details of the artworks on it
+    etag = make_etag(
+        'search', session["user_id"], search['id'], page_number, search['page_limit'], [(artwork['artwork_id'], artwork['version'], artwork['updated_at']) for artwork in artwork_rows],
+        [(collection['id'], collection['title']) for collection in all_collections]
+    )
+    last_modified = max([artwork['updated_at'] or 0 for artwork in artwork_rows] + [collection['updated_at'] or 0 for collection in all_collections], default=None)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    return cacheable(render_template(
+        "search_results.html", items=artwork_rows, page_number=page_number, page_limit=search['page_limit'], search_term=search['name'], search_id=search['id'], collections=all_collections
+    ), etag, last_modified)
+
+
+@routes.route("/artwork_showpage", methods=["GET", "POST"])
 def artwork_showpage():
     if not session or not session["user_id"]:
         return redirect("/")
@@ -229,114 +235,157 @@ def artwork_showpage():
     if request.method == 'POST':
         # if the user clicked on the button to add an artwork to a collection
         if request.form.get('add_to_collection'):
-            artwork_id = request.form.get('add_to_collection')
-            search_term = request.form.get('search_term')
-            page_number = request.form.get('page_number')
-            collection_select_id = request.form.get('collection-select')
+            artwork_id = request.form.get('add_to_collection', type=int)
+            page_number = request.form.get('page_number', type=int)
 
             conn = get_db_connection()
-            search_rows = conn.execute("SELECT * FROM searches WHERE name = ? AND user_id = ?", [search_term, session["user_id"]]).fetchall()
-            conn.commit()
-            conn.close()
-            search_id = search_rows[0]['id']
-            page_limit = search_rows[0]['page_limit']
+            search = get_search(conn, session["user_id"], request.form.get('search_id'))
+            if search is None:
+                return render_template("error_message.html", message="That search has expired. Please search again.")
 
-            conn = get_db_connection()
-            artwork_rows = conn.execute("SELECT * FROM artworks JOIN artwork_searches on artwork_searches.artwork_id = artworks.artwork_id WHERE artwork_searches.search_id = ? AND artwork_searches.current_page = ?", [search_id, page_number]).fetchall()
-            conn.commit()
-            conn.close()
-        
-            conn = get_db_connection()
-            collection_rows = conn.execute("SELECT * FROM collections WHERE id = ? OR title = ? AND user_id = ?", [collection_select_id, search_term, session["user_id"]]).fetchall()
+            # add the work to the selected collection, or to the one named after the search, which is created if needed; it is skipped if it is already there
+            collection_id = get_selected_collection_id(conn, search, request.form.get('collection-select'))
+            add_artworks_to_collection(conn, session["user_id"], collection_id, [artwork_id])
             conn.commit()
-            conn.close()
-        
-            if len(collection_rows):
-                # if the collection the user is trying to add the artwork to already exists, add the work to that collection if it is not already in it
-                collection_id = collection_rows[0]['id']
-                conn = get_db_connection()           
-                collected_works_rows = conn.execute("SELECT * FROM collected_works WHERE user_id = ? AND artwork_id = ? AND collection_id = ?", [session["user_id"], artwork_id, collection_id]).fetchall()
-                conn.commit()
-                conn.close()
-        
-                if not collected_works_rows:
-                    conn = get_db_connection() 
-                    conn.execute("INSERT INTO collected_works (collection_id, user_id, artwork_id) VALUES(?, ?, ?)", [collection_id, session["user_id"], artwork_id]).fetchall()
-                    conn.commit()
-                    conn.close()
-                return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
 
-            else:
-                # if a collection needs to be created from the current search term, first create the collection, then add the artwork to the new collection
-                conn = get_db_connection()
-                conn.execute("INSERT INTO collections (title, user_id) VALUES(?, ?)", [search_term, session["user_id"]]).fetchall()
-                conn.commit()
-                conn.close()
-
-                conn = get_db_connection()
-                collection_rows = conn.execute("SELECT * FROM collections WHERE title = ? AND user_id = ?", [search_term, session["user_id"]]).fetchall()
-                conn.commit()
-                conn.close()
-                collection_id = collection_rows[0]['id']
-                
-                conn = get_db_connection()
-                collected_works_rows = conn.execute("SELECT * FROM collected_works WHERE user_id = ? AND artwork_id = ?", [session["user_id"], artwork_id]).fetchall()
-                conn.execute("INSERT INTO collected_works (collection_id, user_id, artwork_id) VALUES(?, ?, ?)", [collection_id, session["user_id"], artwork_id]).fetchall()
-                conn.commit()
-                conn.close()
-                return render_template("search_results.html", items=artwork_rows, page_number=page_number, page_limit=page_limit, search_term=search_term)
+            # go back to the page of search results, by its url so that reloading it does not add the artwork again
+            return redirect(f"/search_results?search_id={search['id']}&page_number={page_number}")
 
         if request.form.get('artwork_id'):
-            # if the user clicked on the search term to expand the artwork, display the showpage for that artwork
-            artwork_id = request.form.get('artwork_id')
+            # the showpage used to be reached by a form post; it now has its own url
+            return redirect(f"/artworks/{request.form.get('artwork_id', type=int)}?search_id={request.form.get('search_id', '')}&page_number={request.form.get('page_number', '')}")
 
-            # at this point, get the image url and other details for the artwork to display on the showpage
-            # it requires a separate fetch to the API, so I am only making this fetch if the user would like to see the showpage or stores an artwork in a collection
-            get_image_url(artwork_id)
+    return redirect("/search")
 
-            conn = get_db_connection()
-            artwork_rows = conn.execute("SELECT * FROM artworks WHERE artwork_id = ?", [artwork_id]).fetchall()
-            conn.commit()
-            conn.close()
-            title = artwork_rows[0]['title']
-            image_url = artwork_rows[0]['art_institute_url']
-            full_url = artwork_rows[0]['display_url']
-            artist_info = artwork_rows[0]['artist_info']
-            date_info = artwork_rows[0]['date_info']
-            alt_text = artwork_rows[0]['alt_text']
-
-            # Pass along information about the current search to keep the user oriented and to help with navigation between pages
-            search_term = request.form.get('search_term')
-            conn = get_db_connection()
-            current_search = conn.execute("SELECT * FROM searches WHERE user_id = ?", [session["user_id"]]).fetchall()
-            conn.commit()
-            conn.close()
-            search_id = current_search[0]["id"]
-            page_number = request.form.get('page_number')
 
-            # pass along information about the user's collections in case they want to add the artwork to a collection when the showpage renders
-            conn = get_db_connection()
-            all_collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
-            conn.commit()
-            conn.close()
+def get_selected_collection_id(conn, search, collection_select_id):
+    # the collection chosen on a page of search results or an artwork's showpage: the user's collection with the selected id,
+    # or, when none is selected, the one named after the search, which is created if the user does not have it yet; the caller commits
+    collection = get_user_collection(conn, session["user_id"], collection_select_id) if collection_select_id else None
+    if collection is not None:
+        return collection['id']
+    return find_or_create_collection(conn, session["user_id"], search['name'])
+
+
+@routes.route("/add_to_collection", methods=["POST"])
+def add_to_collection():
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # add the artworks ticked on a page of search results, or the whole page, to a collection in one transaction
+    conn = get_db_connection()
+    search = get_search(conn, session["user_id"], request.form.get('search_id'))
+    if search is None:
+        return render_template("error_message.html", message="That search has expired. Please search again.")
+    page_number = request.form.get('page_number', 1, type=int)
+    artwork_ids = request.form.getlist('artwork_ids', type=int)
+    if not artwork_ids and not request.form.get('whole-page'):
+        return render_template("error_message.html", message="You did not select any artworks to add.")
+
+    collection_id = get_selected_collection_id(conn, search, request.form.get('collection-select'))
+    if request.form.get('whole-page'):
+        artwork_ids = [artwork['artwork_id'] for artwork in get_artwork_for_search(search['id'], page_number)]
+        add_search_page_to_collection(conn, session["user_id"], collection_id, search['id'], page_number)
+    else:
+        add_artworks_to_collection(conn, session["user_id"], collection_id, artwork_ids)
+    conn.commit()
+
+    # artworks from search results may not have their image urls and other details yet; they are fetched now, in batches, rather than one by one as each is viewed
+    hydrate_artworks(artwork_ids)
+
+    return redirect(f"/search_results?search_id={search['id']}&page_number={page_number}")
+
 
-            return render_template("artwork_showpage.html", artwork_id=artwork_id, url=full_url, alt_text=alt_text,
-                                   artist_info=artist_info, date_info=date_info, search_term=search_term, page_number=page_number,
-                                   title=title, image_url=image_url, collections=all_collections, search_id = search_id)
+def render_artwork_details(artwork):
+    # the part of an artwork's showpages that is the same for every user, rendered once for each version of the artwork
+    return artwork_fragments.get(artwork['artwork_id'], (artwork['version'], artwork['updated_at']), lambda: render_template("artwork_details.html", artwork=artwork))
 
 
-@app.route("/collections", methods=["GET", "POST"])
+def warm_artwork_fragments(conn, limit):
+    # render the details of the most recently collected artworks, which are the ones collection pages link to; returns how many were rendered
+    artworks = conn.execute("SELECT * FROM artworks WHERE artwork_id IN (SELECT artwork_id FROM collected_works ORDER BY id DESC LIMIT ?)", [limit]).fetchall()
+    for artwork in artworks:
+        render_artwork_details(artwork)
+    return len(artworks)
+
+
+@routes.route("/artworks/<int:artwork_id>")
+def artwork_page(artwork_id):
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # at this point, get the image url and other details for the artwork to display on the showpage
+    # it requires a separate fetch to the API, so I am only making this fetch if the user would like to see the showpage or stores an artwork in a collection
+    get_image_url(artwork_id)
+
+    conn = get_db_connection()
+    artwork = conn.execute("SELECT * FROM artworks WHERE artwork_id = ?", [artwork_id]).fetchone()
+    if artwork is None:
+        return render_template("error_message.html", message="That artwork is not available"), 404
+
+    # the search the artwork was opened from, to keep the user oriented and to help with navigation between pages
+    search = get_search(conn, session["user_id"], request.args.get('search_id'))
+    page_number = request.args.get('page_number', 1, type=int)
+
+    # pass along information about the user's collections in case they want to add the artwork to a collection when the showpage renders
+    all_collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
+
+    etag = make_etag(
+        'artwork', session["user_id"], artwork_id, artwork['version'], artwork['updated_at'], search['id'] if search else None, page_number,
+        [(collection['id'], collection['title']) for collection in all_collections]
+    )
+    last_modified = max([artwork['updated_at'] or 0] + [collection['updated_at'] or 0 for collection in all_collections])
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    return cacheable(render_template(
+        "artwork_showpage.html", artwork_id=artwork_id, artwork_details=render_artwork_details(artwork), collections=all_collections,
+        search_id=search['id'] if search else None, search_term=search['name'] if search else None, page_number=page_number
+    ), etag, last_modified)
+
+
+@routes.route("/images/<int:artwork_id>/<rendition>")
+def artwork_image(artwork_id, rendition):
+    # serve an artwork's image from the image cache instead of having the browser download it from the Art Institute every time
+    # rendition is 'thumbnail' for the tiles on collection pages or 'full' for showpages
+    if rendition not in image_widths:
+        abort(404)
+
+    conn = get_db_connection()
+    artwork_rows = conn.execute("SELECT display_url FROM artworks WHERE artwork_id = ?", [artwork_id]).fetchall()
+    if not len(artwork_rows) or not artwork_rows[0]['display_url']:
+        abort(404)
+
+    # another request can evict the image from the cache between it being looked up and send_file opening it, in which case it is downloaded again
+    # once send_file has opened the file, deleting it does not stop it being sent
+    for attempt in range(2):
+        image = get_artwork_image(artwork_rows[0]['display_url'], rendition)
+        if image is None:
+            # if the image could not be fetched, let the browser try the Art Institute itself
+            return redirect(get_image_rendition_url(artwork_rows[0]['display_url'], rendition))
+
+        path, etag = image
+        try:
+            # send_file answers a request whose If-None-Match matches the etag with a 304 and no body
+            response = send_file(path, mimetype='image/jpeg', etag=etag, max_age=current_app.config['IMAGE_MAX_AGE'], conditional=True)
+            break
+        except FileNotFoundError:
+            if attempt:
+                raise
+    response.cache_control.public = True
+    return response
+
+
+@routes.route("/collections", methods=["GET", "POST"])
 def collections():
     if not session or not session["user_id"]:
         return redirect("/")
 
     if request.method == "GET":
-        # if a user goes to the collections tab, clear the most recent search and get the user's collections from the database to display
-        clear_search()
+        # if a user goes to the collections tab, get the user's collections from the database to display
         conn = get_db_connection()
         collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
-        conn.commit()
-        conn.close()
         return render_template("collections.html", collections=collections)
 
     if request.method == "POST":
@@ -345,30 +394,73 @@ def collections():
             new_collection_title = request.form.get('create-new-collection')
             conn = get_db_connection()
             collections = conn.execute("SELECT * FROM collections WHERE user_id = ? AND title = ?", [session["user_id"], new_collection_title]).fetchall()
-            conn.commit()
-            conn.close()
             if len(collections):
                 # render an error message if the user already has a collection with that title
                 return render_template("error_message.html", message="That collection title already exists")
 
             else:
                 # if the user does not already have a collection with the title submitted, create that collection
-                conn = get_db_connection()
                 conn.execute("INSERT into collections (title, user_id) VALUES(?, ?)", [new_collection_title, session["user_id"]]).fetchall()
                 conn.commit()
-                conn.close()
 
-                conn = get_db_connection()
                 collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
-                conn.commit()
-                conn.close()
                 return render_template("collections.html", collections=collections)
 
         # if no title was submitted, render an error message
         return render_template("error_message.html", message="You did not enter a collection title.")
 
 
-@app.route("/delete_collection", methods=["GET", "POST"])
+@routes.route("/collections/export")
+def export_collections():
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # download the user's collections, or one of them with collection_id, as JSON Lines, CSV, or a ZIP of the JSON Lines and the cached images
+    # the file is streamed as it is read from the database (see collection_transfer.py), so a large library is never held in memory
+    export_format = request.args.get('format', 'jsonl')
+    collection_id = request.args.get('collection_id', type=int)
+    conn = get_db_connection()
+    filename = 'collections'
+    if collection_id is not None:
+        collection = get_user_collection(conn, session["user_id"], collection_id)
+        if collection is None:
+            return render_template("error_message.html", message="That collection does not exist"), 404
+        filename = f'collection-{collection_id}'
+
+    if export_format == 'csv':
+        body, mimetype = export_csv(iter_export_records(session["user_id"], collection_id)), 'text/csv'
+    elif export_format == 'zip':
+        body, mimetype = export_zip(session["user_id"], collection_id), 'application/zip'
+    elif export_format == 'jsonl':
+        body, mimetype = export_jsonl(iter_export_records(session["user_id"], collection_id)), 'application/x-ndjson'
+    else:
+        return render_template("error_message.html", message="Collections can be exported as jsonl, csv or zip"), 400
+
+    # the file is read from the database as it is sent, in the request's context, which is pushed again for as long as that takes
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{export_format}'
+    return response
+
+
+@routes.route("/collections/import", methods=["POST"])
+def import_collections():
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # add the collections in an exported file to the user's collections, in batches that are each one transaction (see collection_transfer.py)
+    upload = request.files.get('collections-file')
+    if upload is None or not upload.filename:
+        return render_template("error_message.html", message="You did not choose a file to import.")
+
+    conn = get_db_connection()
+    try:
+        import_collection_records(conn, session["user_id"], iter_import_records(upload.stream, upload.filename))
+    except CollectionImportError as error:
+        return render_template("error_message.html", message=str(error)), 400
+    return redirect("/collections")
+
+
+@routes.route("/delete_collection", methods=["GET", "POST"])
 def delete_collection():
     if not session or not session["user_id"]:
         return redirect("/")
@@ -379,61 +471,157 @@ def delete_collection():
             collection_delete_id = request.form.get('collection-delete-select')
 
             conn = get_db_connection()
-            conn.execute("DELETE FROM collected_works WHERE collection_id = ?", [collection_delete_id]).fetchall()
-            conn.commit()
-            conn.close()
-            
-            conn = get_db_connection()
-            conn.execute("DELETE FROM collections WHERE id = ?", [collection_delete_id]).fetchall()
+            # the artworks from the collection that are not associated with a search or with another collection are deleted with it
+            delete_user_collection(conn, session["user_id"], collection_delete_id)
             conn.commit()
-            conn.close()
 
-            conn = get_db_connection()
-            conn.execute("DELETE FROM artworks WHERE artwork_id NOT IN (SELECT artwork_id FROM artwork_searches) AND artwork_id NOT IN (SELECT artwork_id FROM collected_works)").fetchall()
-            conn.commit()
-            conn.close()
-
-            conn = get_db_connection()
             collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
-            conn.commit()
-            conn.close()
             return render_template("collections.html", collections=collections)
 
         # if the user did not select a collection, render an error message
         return render_template("error_message.html", message="You did not select a collection to delete")
 
 
-@app.route("/collection_showpage", methods=["GET", "POST"])
+@routes.route("/collection_showpage", methods=["GET", "POST"])
 def collection_showpage():
     if not session or not session["user_id"]:
         return redirect("/")
     if request.method == "POST":
         if request.form.get('collection_id'):
-            # render the display page for the collection of artwork that the user requested
-            collection_id = request.form.get('collection_id')
-            conn = get_db_connection()
-            collection_title = conn.execute("SELECT title FROM collections WHERE id = ?", [collection_id]).fetchall()[0]['title']
-            conn.commit()
-            conn.close()
-
-            conn = get_db_connection()
-            artworks = conn.execute("SELECT * FROM artworks JOIN collected_works on artworks.artwork_id = collected_works.artwork_id WHERE collected_works.user_id = ? AND collected_works.collection_id = ?", [session["user_id"], collection_id]).fetchall()
-            conn.commit()
-            conn.close()
-            return render_template("collection_showpage.html", artworks=artworks, collection_title=collection_title, collection_id=collection_id)
+            # collection pages used to be reached by a form post; they now have their own urls
+            return redirect(f"/collections/{request.form.get('collection_id', type=int)}")
 
         # if the user did not select a particular collection, render an error message
         return render_template("error_message.html", message="You did not select a particular collection to view")
 
+    return redirect("/collections")
+
+
+@routes.route("/collections/<int:collection_id>")
+def collection_page(collection_id):
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # render one page of the user's collection, starting from the first page unless the user is paging through it
+    # after and before are the collected_works ids that the page follows or precedes (see get_collection_page)
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    conn = get_db_connection()
+    collection = get_collection_page(conn, session["user_id"], collection_id, after, before)
+    if collection is None:
+        return render_template("error_message.html", message="That collection does not exist"), 404
+
+    # artworks added to a collection straight from the search results may not have their image urls yet, so fetch any on this page that are missing in one batch
+    if any(artwork['details_fetched_at'] is None for artwork in collection['artworks']):
+        hydrate_artworks([artwork['artwork_id'] for artwork in collection['artworks']])
+        collection = get_collection_page(conn, session["user_id"], collection_id, after, before)
+
+    artworks = collection['artworks']
+    # the user's other collections, which artworks can be copied or moved to
+    other_collections = conn.execute("SELECT * FROM collections WHERE user_id = ?", [session["user_id"]]).fetchall()
+    other_collections = [other for other in other_collections if other['id'] != collection_id]
+    etag = make_etag(
+        'collection', session["user_id"], collection_id, collection['version'], collection['updated_at'], after, before,
+        [(artwork['collected_work_id'], artwork['artwork_id'], artwork['version'], artwork['updated_at']) for artwork in artworks],
+        [(other['id'], other['title']) for other in other_collections]
+    )
+    # the other collections are in the copy and move menus, so a page with If-Modified-Since but no If-None-Match is sent again when one of them is renamed or created
+    last_modified = max([collection['updated_at'] or 0] + [artwork['updated_at'] or 0 for artwork in artworks] + [other['updated_at'] or 0 for other in other_collections])
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    return cacheable(render_template(
+        "collection_showpage.html", artworks=artworks, collection_title=collection['title'], collection_id=collection_id,
+        artwork_count=collection['artwork_count'], has_previous=collection['has_previous'], has_next=collection['has_next'],
+        other_collections=other_collections, after=after
+    ), etag, last_modified)
+
+
+@routes.route("/edit_collection", methods=["POST"])
+def edit_collection():
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # change many artworks in one of the user's collections at once, each change in one transaction:
+    #   remove: remove the ticked artworks from the collection
+    #   copy and move: add the ticked artworks to the target collection, and for a move, remove them from this one
+    #   copy-all and merge: add every artwork in the collection to the target collection, and for a merge, delete this one afterwards
+    conn = get_db_connection()
+    collection = get_user_collection(conn, session["user_id"], request.form.get('collection_id', type=int))
+    if collection is None:
+        return render_template("error_message.html", message="That collection does not exist"), 404
+    action = request.form.get('action')
+    artwork_ids = request.form.getlist('artwork_ids', type=int)
+    after = request.form.get('after', type=int)
+
+    if action in ('remove', 'copy', 'move') and not artwork_ids:
+        return render_template("error_message.html", message="You did not select any artworks.")
+
+    target = None
+    if action in ('copy', 'move', 'copy-all', 'merge'):
+        target = get_user_collection(conn, session["user_id"], request.form.get('target-collection-select', type=int))
+        if target is None or target['id'] == collection['id']:
+            return render_template("error_message.html", message="You did not select another collection.")
+
+    if action == 'remove':
+        remove_artworks_from_collection(conn, session["user_id"], collection['id'], artwork_ids)
+    elif action in ('copy', 'move'):
+        add_artworks_to_collection(conn, session["user_id"], target['id'], artwork_ids)
+        if action == 'move':
+            remove_artworks_from_collection(conn, session["user_id"], collection['id'], artwork_ids)
+    elif action in ('copy-all', 'merge'):
+        copy_collection(conn, session["user_id"], collection['id'], target['id'])
+        if action == 'merge':
+            delete_user_collection(conn, session["user_id"], collection['id'])
+    else:
+        return render_template("error_message.html", message="Unknown change to a collection")
+    conn.commit()
+
+    # after a merge this collection is gone, so go to the one it was merged into; otherwise go back to the page of this one that the change was made from
+    if action == 'merge':
+        return redirect(f"/collections/{target['id']}")
+    return redirect(f"/collections/{collection['id']}" + (f"?after={after}" if after is not None else ""))
+
+
+@routes.route("/collection_search", methods=["GET", "POST"])
+def collection_search():
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    if request.method == "POST":
+        if request.form.get('collection-search'):
+            # search the titles, artists and dates of the artworks in the user's collections, or in one collection if it was searched from that collection's page
+            # this is answered from the local full-text index, so it does not make any fetches to the API
+            search_term = request.form.get('collection-search')
+            collection_id = request.form.get('collection_id') or None
+            conn = get_db_connection()
+            collection_title = None
+            if collection_id:
+                # only the user's own collections can be searched
+                collection = get_user_collection(conn, session["user_id"], collection_id)
+                if collection is None:
+                    return render_template("error_message.html", message="That collection does not exist"), 404
+                collection_title = collection['title']
+
+            artworks = search_collections(conn, session["user_id"], search_term, collection_id)
+            return render_template("collection_search_results.html", artworks=artworks, search_term=search_term, collection_title=collection_title)
+
+        # if no search term was submitted, render an error message
+        return render_template("error_message.html", message="You did not enter anything to search for.")
+
+    return redirect("/collections")
+
 
-@app.route("/collection_artwork_showpage", methods=["GET", "POST"])
+@routes.route("/collection_artwork_showpage", methods=["GET", "POST"])
 def collection_artwork_showpage():
     if not session or not session["user_id"]:
         return redirect("/")
 
     if request.method == "POST":
-        collection_id = request.form.get('collection_id')
-        artwork_id = request.form.get('artwork_id')
+        collection_id = request.form.get('collection_id', type=int)
+        artwork_id = request.form.get('artwork_id', type=int)
+        after = request.form.get('after', type=int)
 
         if not collection_id or not artwork_id :
             # render an error message if there is no collection or artwork id
@@ -444,31 +632,106 @@ def collection_artwork_showpage():
             # if the artwork is in another of the user's collections, it should still be in that other collection
 
             conn = get_db_connection()
-            conn.execute("DELETE from collected_works WHERE artwork_id = ? AND collection_id = ? AND user_id = ?", [artwork_id, collection_id, session["user_id"]]).fetchall()
+            remove_artworks_from_collection(conn, session["user_id"], collection_id, [artwork_id])
             conn.commit()
-            conn.close()
 
-            conn = get_db_connection()
-            conn.execute("DELETE FROM artworks WHERE artwork_id NOT IN (SELECT artwork_id FROM artwork_searches) AND artwork_id NOT IN (SELECT artwork_id FROM collected_works)").fetchall()
-            conn.commit()
-            conn.close()
+            # go back to the page of the collection that the artwork was on
+            return redirect(f"/collections/{collection_id}" + (f"?after={after}" if after is not None else ""))
 
-            conn = get_db_connection()
-            collection_title = conn.execute("SELECT title FROM collections WHERE id = ?", [collection_id]).fetchall()[0]['title']
-            conn.commit()
-            conn.close()
+        # the artwork's showpage within a collection used to be reached by a form post; it now has its own url
+        return redirect(f"/collections/{collection_id}/artworks/{artwork_id}" + (f"?after={after}" if after is not None else ""))
 
-            conn = get_db_connection()
-            artworks = conn.execute("SELECT * FROM artworks JOIN collected_works on artworks.artwork_id = collected_works.artwork_id WHERE collected_works.user_id = ? AND collected_works.collection_id = ?", [session["user_id"], collection_id]).fetchall()
-            conn.commit()
-            conn.close()
-            return render_template("collection_showpage.html", artworks=artworks, collection_title=collection_title, collection_id=collection_id)
+    return redirect("/collections")
 
-        else:
-            # if the user clicked on a particular artwork's title on the collection showpage, then display the showpage for that artwork
-            conn = get_db_connection()
-            artwork = conn.execute("SELECT * FROM artworks WHERE artwork_id = ?", [artwork_id]).fetchall()
-            conn.commit()
-            conn.close()
-            return render_template("collection_artwork_showpage.html", artwork=artwork[0], collection_id=collection_id)
+
+@routes.route("/collections/<int:collection_id>/artworks/<int:artwork_id>")
+def collection_artwork_page(collection_id, artwork_id):
+    if not session or not session["user_id"]:
+        return redirect("/")
+
+    # display the showpage for an artwork that the user clicked on in one of their collections
+    conn = get_db_connection()
+    artwork = conn.execute("SELECT * FROM artworks WHERE artwork_id = ?", [artwork_id]).fetchone()
+    if artwork is None:
+        return render_template("error_message.html", message="That artwork is not available"), 404
+
+    # after is the page of the collection to go back to
+    after = request.args.get('after', type=int)
+    etag = make_etag('collection-artwork', session["user_id"], collection_id, artwork_id, artwork['version'], artwork['updated_at'], after)
+    response = not_modified(etag, artwork['updated_at'])
+    if response is not None:
+        return response
+
+    return cacheable(render_template(
+        "collection_artwork_showpage.html", artwork_details=render_artwork_details(artwork), artwork_id=artwork_id, collection_id=collection_id, after=after
+    ), etag, artwork['updated_at'])
+
+
+def create_app(config=None):
+    # build the app; config overrides the settings that load_config reads from the environment (see config.py)
+    # for several worker processes, create it once before forking them, as "gunicorn --preload -w 4 wsgi:app" or serve.py --workers do (see startup.py)
+    # importing this module does not create an app; wsgi.py does, for servers and "flask run"
+    created_started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.from_mapping(load_config())
+    if config:
+        app.config.update(config)
+    if not app.config['DB_PATH']:
+        raise RuntimeError("DB_PATH is not set; set it in the environment, in .env or in create_app's config")
+
+    startup_seconds = app.extensions['startup_seconds'] = {'import': import_seconds}
+    with timed(startup_seconds, 'configure'):
+        # the app's own clients, schedulers and caches (see helper_methods.py)
+        init_services(app)
+        configure_sessions(app, app.config['SESSION_BACKEND'], get_db_connection)
+
+        # every request shares one database connection, which is closed when the app context is torn down
+        app.teardown_appcontext(close_db_connection)
+
+        # time every request, and the SQL and calls to the Art Institute in it, for the /metrics route
+        init_instrumentation(app, app.config['SLOW_REQUEST_MS'])
+        app.register_blueprint(routes)
+
+        # "flask db upgrade" and "flask db check-plans"
+        app.cli.add_command(db_cli)
+        # "flask sessions cleanup"
+        app.cli.add_command(sessions_cli)
+        # "flask import-catalog", which loads the Art Institute's data dump into the artworks table
+        app.cli.add_command(import_catalog_command)
+
+        # a thread started now would only run in this process, not in workers forked from it
+        if app.config['ORPHAN_SWEEP_INTERVAL'] > 0:
+            start_in_each_process(app, lambda: start_orphan_sweep(app, app.config['ORPHAN_SWEEP_INTERVAL']))
+
+    # the connection used here is closed when the app context ends, before any worker is forked
+    with app.app_context():
+        conn = get_db_connection()
+        # bring the database schema up to date before serving any requests
+        if app.config['DB_AUTO_MIGRATE']:
+            with timed(startup_seconds, 'migrate'):
+                upgrade_database(conn)
+
+        with timed(startup_seconds, 'compile_templates'):
+            templates = compile_templates(app)
+
+        # with DB_AUTO_MIGRATE=0 the schema can be behind until "flask db upgrade" is run, which needs the app to be created first
+        schema_current = get_schema_version(conn) == MIGRATIONS[-1][0]
+        if not schema_current:
+            app.logger.warning("the database schema is not up to date, so the queries were not prepared and the caches were not warmed; run flask db upgrade")
+
+        statements = artworks = searches = 0
+        if schema_current:
+            with timed(startup_seconds, 'prepare_statements'):
+                statements = prepare_statements(conn, ROUTE_QUERIES)
+        if schema_current and app.config['STARTUP_WARM_CACHES']:
+            with timed(startup_seconds, 'warm_caches'):
+                artworks = warm_artwork_fragments(conn, app.config['STARTUP_WARM_ARTWORKS'])
+                searches = search_cache.warm(app.config['STARTUP_WARM_SEARCHES'])
+
+    startup_seconds['total'] = import_seconds + time.perf_counter() - created_started
+    app.logger.info(
+        "app started in %.0fms (%.0fms of it importing): %s templates compiled, %s statements prepared, %s artworks and %s search results cached",
+        startup_seconds['total'] * 1000, import_seconds * 1000, templates, statements, artworks, searches
+    )
+    return app
 
@@ -0,0 +1,111 @@
+# Checks how long the app takes to start: from launching serve.py until it has served its first request,
+# along with how long that first request and the one after it took, and the app's own account of its startup from /metrics
+# (importing, migrating, compiling templates, preparing statements and warming the caches; see startup.py).
+#
+# usage: python benchmarks/cold_start.py --runs 5 --workers 4 --db seeded.db --max-seconds 5
+#
+# Each run starts the app on a fresh copy of the database. With --max-seconds, it exits with a non-zero status
+# if the median time to the first response is longer than that, so it can be used as a check in CI.
+# Compare --env STARTUP_WARM_CACHES=0 to see what warming the caches costs at startup.
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import ROOT, free_port
+
+
+def read_startup_seconds(url):
+    # the app_startup_seconds gauge from /metrics, by phase
+    phases = {}
+    for line in requests.get(url + '/metrics', timeout=10).text.splitlines():
+        if line.startswith('app_startup_seconds{'):
+            labels, value = line.rsplit(' ', 1)
+            phases[labels.split('"')[1]] = float(value)
+    return phases
+
+
+def run_once(args, source_db):
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'cold_start.db')
+    if source_db:
+        shutil.copy(source_db, db_path)
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, DB_PATH=db_path, IMAGE_CACHE_DIR=os.path.join(directory, 'image_cache'))
+    env.update(setting.split('=', 1) for setting in args.env)
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--port', str(port), '--threads', str(args.threads), '--workers', str(args.workers)],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        deadline = start + args.timeout
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"the app exited with status {server.returncode} before serving a request")
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"the app did not serve a request within {args.timeout}s")
+            request_start = time.perf_counter()
+            try:
+                response = requests.get(url + '/login', timeout=args.timeout)
+            except requests.ConnectionError:
+                # not listening yet
+                time.sleep(0.01)
+                continue
+            if response.status_code == 200:
+                break
+        first_response = time.perf_counter() - start
+        first_request = time.perf_counter() - request_start
+
+        request_start = time.perf_counter()
+        requests.get(url + '/login', timeout=args.timeout)
+        second_request = time.perf_counter() - request_start
+        phases = read_startup_seconds(url)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory)
+
+    return {'first_response': first_response, 'first_request': first_request, 'second_request': second_request, 'phases': phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the app takes from being launched to serving its first request.")
+    parser.add_argument('--runs', type=int, default=5, help="times to start the app")
+    parser.add_argument('--workers', type=int, default=1, help="serve.py's worker processes")
+    parser.add_argument('--threads', type=int, default=8, help="serve.py's threads in each worker")
+    parser.add_argument('--db', default=os.getenv('DB_PATH'), help="database to copy for each run; an empty one is created without it")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for the first response")
+    parser.add_argument('--max-seconds', type=float, help="fail if the median time to the first response is longer than this")
+    parser.add_argument('--env', nargs='*', default=[], help="settings for the app, such as STARTUP_WARM_CACHES=0")
+    args = parser.parse_args()
+
+    results = []
+    for run in range(1, args.runs + 1):
+        result = run_once(args, args.db)
+        results.append(result)
+        print(f"run {run}: first response after {result['first_response'] * 1000:.0f} ms, first request {result['first_request'] * 1000:.1f} ms, second request {result['second_request'] * 1000:.1f} ms")
+
+    median = statistics.median(result['first_response'] for result in results)
+    print(f"median over {args.runs} runs with {args.workers} workers: first response after {median * 1000:.0f} ms, "
+          f"first request {statistics.median(result['first_request'] for result in results) * 1000:.1f} ms, "
+          f"second request {statistics.median(result['second_request'] for result in results) * 1000:.1f} ms")
+    for phase in results[0]['phases']:
+        print(f"{phase:>20} {statistics.median(result['phases'].get(phase, 0) for result in results) * 1000:8.1f} ms")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"the median time to the first response, {median:.2f}s, is over the limit of {args.max_seconds:.2f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
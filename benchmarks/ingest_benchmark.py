@@ -0,0 +1,117 @@
+# Measures how long it takes to save one page of search results as the database grows.
+# It compares the original row-by-row inserts (a new connection and a commit for every statement)
+# with the batched, single-transaction store_search_page in helper_methods.
+#
+# usage: python benchmarks/ingest_benchmark.py --source aic_collections.db --sizes 0 10000 100000 --pages 20
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helper_methods import open_db_connection, store_search_page
+from migrations import upgrade_database
+
+PAGE_SIZE = 10
+
+
+def make_page(first_artwork_id):
+    # build a page of artworks shaped like the 'data' list returned by the search endpoint
+    return [{'id': artwork_id, 'title': f'Artwork {artwork_id}'} for artwork_id in range(first_artwork_id, first_artwork_id + PAGE_SIZE)]
+
+
+def grow_database(conn, size):
+    # fill the artworks and artwork_searches tables with synthetic rows so that the timings reflect a database of the given size
+    # the ids start above the artworks already in the copied database, since the unique index on artwork_id would reject any it already has
+    # returns the first artwork id after them, which is still free
+    first_artwork_id = (conn.execute("SELECT MAX(artwork_id) FROM artworks").fetchone()[0] or 0) + 1
+    artwork_ids = range(first_artwork_id, first_artwork_id + size)
+    conn.executemany(
+        "INSERT INTO artworks (title, artwork_id, art_institute_url) VALUES(?, ?, ?)",
+        ((f'Artwork {artwork_id}', artwork_id, f'https://www.artic.edu/artworks/{artwork_id}') for artwork_id in artwork_ids)
+    )
+    conn.executemany(
+        "INSERT INTO artwork_searches (current_page, search_id, artwork_id) VALUES(?, ?, ?)",
+        ((artwork_id // PAGE_SIZE + 1, 0, artwork_id) for artwork_id in artwork_ids)
+    )
+    conn.commit()
+    return first_artwork_id + size
+
+
+def ingest_row_by_row(path, search_id, page_number, artworks):
+    # the way get_items used to save a page: check then insert each row, on its own connection, with a commit after each statement
+    for artwork in artworks:
+        conn = sqlite3.connect(path)
+        artwork_rows = conn.execute("SELECT * FROM artworks WHERE artwork_id = ?", [artwork['id']]).fetchall()
+        conn.commit()
+        conn.close()
+
+        if not len(artwork_rows):
+            conn = sqlite3.connect(path)
+            conn.execute("INSERT INTO artworks (title, artwork_id, art_institute_url) VALUES(?, ?, ?)", [artwork['title'], artwork['id'], f'https://www.artic.edu/artworks/{artwork["id"]}'])
+            conn.commit()
+            conn.close()
+
+        conn = sqlite3.connect(path)
+        artwork_searches = conn.execute("SELECT * FROM artwork_searches WHERE current_page = ? AND artwork_id = ? AND search_id = ?", [page_number, artwork['id'], search_id]).fetchall()
+        conn.commit()
+        conn.close()
+
+        if not len(artwork_searches):
+            conn = sqlite3.connect(path)
+            conn.execute("INSERT INTO artwork_searches (current_page, search_id, artwork_id) VALUES(?, ?, ?)", [page_number, search_id, artwork['id']])
+            conn.commit()
+            conn.close()
+
+
+def ingest_batched(conn, search_id, page_number, artworks):
+    store_search_page(conn, search_id, page_number, artworks)
+    conn.commit()
+
+
+def run(source, size, pages, batched):
+    # copy the source database so the benchmark never touches real data
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'benchmark.db')
+    shutil.copy(source, path)
+
+    # both ways of saving a page are timed against the app's current schema, with the same indexes
+    conn = open_db_connection(path)
+    upgrade_database(conn)
+    first_artwork_id = grow_database(conn, size)
+
+    timings = []
+    for page_number in range(1, pages + 1):
+        artworks = make_page(first_artwork_id + (page_number - 1) * PAGE_SIZE)
+        start = time.perf_counter()
+        if batched:
+            ingest_batched(conn, 1, page_number, artworks)
+        else:
+            ingest_row_by_row(path, 1, page_number, artworks)
+        timings.append(time.perf_counter() - start)
+
+    conn.close()
+    shutil.rmtree(directory)
+    return sum(timings) / len(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how long saving a page of search results takes as the database grows.")
+    parser.add_argument('--source', default=os.getenv('DB_PATH', 'aic_collections.db'), help="database to copy the schema and data from")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 10000, 100000], help="numbers of artworks to add before timing")
+    parser.add_argument('--pages', type=int, default=20, help="pages to ingest at each size")
+    args = parser.parse_args()
+
+    print(f"{'artworks':>10} {'row by row ms/page':>20} {'batched ms/page':>17}")
+    for size in args.sizes:
+        row_by_row = run(args.source, size, args.pages, batched=False)
+        batched = run(args.source, size, args.pages, batched=True)
+        print(f"{size:>10} {row_by_row:>20.2f} {batched:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
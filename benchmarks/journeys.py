@@ -0,0 +1,246 @@
+# Drives scripted user journeys against the app, many users at once, and reports latency percentiles and throughput for each step.
+#
+# Each virtual user logs in, searches, pages forward ten times, opens an artwork's showpage, adds the artwork to a collection,
+# goes back to the page of results it came from (sending the ETag it was given, as a browser would, so an unchanged page is a 304),
+# and views that collection along with its images. The app runs under serve.py with the Art Institute replaced by mock_aic_server.py.
+#
+# usage: python benchmarks/journeys.py --users 50 --journeys 2 --latency 100 --db seeded.db --save-baseline baseline.json
+#        python benchmarks/journeys.py --users 50 --journeys 2 --latency 100 --db seeded.db --compare baseline.json
+#
+# With --db, the users log in as the user<n> accounts that seed_data.py creates; without it, each run starts from an empty database and the users register first.
+# Search terms are drawn from a fixed seed, so every run makes the same requests.
+# --compare exits with a non-zero status if any step's p95 is more than --tolerance worse than in the baseline.
+#
+# --record cassettes.db saves every response the app gets from the Art Institute (here, the mock) during the run,
+# and --replay cassettes.db answers the app's requests from that file instead, after --latency and failing --error-rate of them (see cassettes.py),
+# so that a run can be repeated against exactly the same responses, or against ones recorded from the real API.
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import ROOT, free_port, wait_for_server
+from mock_aic_server import start_server
+
+SEARCH_WORDS = ['monet', 'water', 'lilies', 'portrait', 'landscape', 'river', 'cat', 'horse', 'night', 'city', 'garden', 'sea', 'mountain', 'bridge', 'flowers', 'woman']
+PAGES_FORWARD = 10
+STEPS = ['login', 'search', 'search_results', 'artwork_showpage', 'add_to_collection', 'revisit', 'collections', 'collection_showpage', 'image']
+
+
+class Recorder:
+    # collects the latency of every request, by step
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+
+    def request(self, step, send, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = send(*args, timeout=60, allow_redirects=False, **kwargs)
+        except requests.RequestException:
+            response = None
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            if response is None or response.status_code >= 400:
+                self.errors[step] += 1
+            else:
+                self.latencies[step].append(elapsed)
+        return response
+
+
+def run_journey(url, client, rng, recorder):
+    search_term = f'{rng.choice(SEARCH_WORDS)} {rng.choice(SEARCH_WORDS)}'
+    response = recorder.request('search', client.post, url + '/search', data={'search': search_term})
+    if response is None or 'Location' not in response.headers:
+        return
+    search_url = url + response.headers['Location']
+    search_id = re.search(r'search_id=(\d+)', search_url).group(1)
+
+    response = recorder.request('search_results', client.get, search_url)
+    for page_number in range(2, PAGES_FORWARD + 2):
+        response = recorder.request('search_results', client.get, url + '/search_results', params={'search_id': search_id, 'page_number': page_number})
+    if response is None:
+        return
+
+    etag = response.headers.get('ETag')
+    artwork_ids = re.findall(r'action="/artworks/(\d+)"', response.text)
+    if not artwork_ids:
+        return
+    artwork_id = rng.choice(artwork_ids)
+    recorder.request('artwork_showpage', client.get, url + f'/artworks/{artwork_id}', params={'search_id': search_id, 'page_number': PAGES_FORWARD + 1})
+    # an empty selection adds the artwork to a collection named after the search term
+    recorder.request('add_to_collection', client.post, url + '/artwork_showpage', data={'add_to_collection': artwork_id, 'search_id': search_id, 'page_number': PAGES_FORWARD + 1, 'collection-select': ''})
+    recorder.request('revisit', client.get, url + '/search_results', params={'search_id': search_id, 'page_number': PAGES_FORWARD + 1}, headers={'If-None-Match': etag} if etag else {})
+
+    response = recorder.request('collections', client.get, url + '/collections')
+    if response is None:
+        return
+    collection_ids = re.findall(r'action="/collections/(\d+)"', response.text)
+    if not collection_ids:
+        return
+    response = recorder.request('collection_showpage', client.get, url + f'/collections/{collection_ids[-1]}')
+    if response is None:
+        return
+    # what the browser would load next: the tiles' images
+    for image_path in re.findall(r'src="(/images/[^"]+)"', response.text):
+        recorder.request('image', client.get, url + image_path)
+
+
+def run_user(url, user_number, journeys, seeded, recorder):
+    rng = random.Random(user_number)
+    client = requests.Session()
+    username = f'user{user_number}'
+    if seeded:
+        recorder.request('login', client.post, url + '/login', data={'username': username, 'password': 'benchmark'})
+    else:
+        recorder.request('login', client.post, url + '/register', data={'username': f'journey-{username}', 'password': 'benchmark', 'confirmation': 'benchmark'})
+
+    for _ in range(journeys):
+        run_journey(url, client, rng, recorder)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def summarize(recorder, elapsed):
+    results = {}
+    for step in STEPS:
+        latencies = sorted(recorder.latencies[step])
+        if not latencies and not recorder.errors[step]:
+            continue
+        results[step] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[step],
+            'per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+            'p95_ms': percentile(latencies, 0.95) * 1000 if latencies else None,
+            'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        }
+    return results
+
+
+def run(args):
+    api_port = free_port()
+    start_server(api_port, args.latency, args.error_rate)
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'journeys.db')
+    if args.db:
+        shutil.copy(args.db, db_path)
+        # point the seeded artworks' images at the mock server, so that the run never leaves this machine
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE artworks SET display_url = replace(display_url, 'https://www.artic.edu/iiif/2', ?)", [f'http://127.0.0.1:{api_port}/iiif/2'])
+        conn.commit()
+        conn.close()
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+
+    # the mock has no rate limit, so neither does the app unless one is set with --env, such as AIC_REQUESTS_PER_SECOND=1
+    env = dict(os.environ, DB_PATH=db_path, AIC_API_URL=f'http://127.0.0.1:{api_port}/api/v1', IMAGE_CACHE_DIR=os.path.join(directory, 'image_cache'), AIC_REQUESTS_PER_SECOND='0')
+    if args.record:
+        env.update(AIC_TRANSPORT='record', AIC_CASSETTE_PATH=os.path.abspath(args.record))
+    elif args.replay:
+        env.update(AIC_TRANSPORT='replay', AIC_CASSETTE_PATH=os.path.abspath(args.replay), AIC_REPLAY_LATENCY_MS=str(args.latency), AIC_REPLAY_ERROR_RATE=str(args.error_rate))
+    env.update(setting.split('=', 1) for setting in args.env)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--mode', args.mode, '--port', str(port), '--threads', str(args.threads), '--connections', str(args.users * 2)],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(url)
+        recorder = Recorder()
+        users = [threading.Thread(target=run_user, args=(url, user_number, args.journeys, bool(args.db), recorder)) for user_number in range(1, args.users + 1)]
+        start = time.perf_counter()
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory)
+
+    return {
+        'settings': {'users': args.users, 'journeys': args.journeys, 'latency_ms': args.latency, 'error_rate': args.error_rate, 'mode': args.mode, 'threads': args.threads, 'seeded': bool(args.db), 'replay': args.replay, 'env': args.env},
+        'elapsed_seconds': elapsed,
+        'requests_per_second': sum(len(latencies) for latencies in recorder.latencies.values()) / elapsed,
+        'steps': summarize(recorder, elapsed),
+    }
+
+
+def format_ms(value):
+    return f'{value:.0f}' if value is not None else '-'
+
+
+def print_results(results, baseline=None):
+    print(f"{results['settings']['users']} users x {results['settings']['journeys']} journeys in {results['elapsed_seconds']:.1f}s, {results['requests_per_second']:.1f} requests/s")
+    print(f"{'step':>20} {'requests':>9} {'errors':>7} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}" + (f" {'p95 vs baseline':>16}" if baseline else ''))
+    for step, result in results['steps'].items():
+        line = f"{step:>20} {result['requests']:>9} {result['errors']:>7} {result['per_second']:>7.1f} {format_ms(result['p50_ms']):>8} {format_ms(result['p95_ms']):>8} {format_ms(result['p99_ms']):>8}"
+        if baseline:
+            change = p95_change(result, baseline['steps'].get(step))
+            line += f" {change * 100:>+15.0f}%" if change is not None else f" {'-':>16}"
+        print(line)
+
+
+def p95_change(result, baseline_result):
+    # the relative change in p95 from the baseline, or None if either is missing
+    if not baseline_result or not baseline_result['p95_ms'] or result['p95_ms'] is None:
+        return None
+    return result['p95_ms'] / baseline_result['p95_ms'] - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run concurrent user journeys against the app and report latency per step.")
+    parser.add_argument('--users', type=int, default=20, help="concurrent virtual users")
+    parser.add_argument('--journeys', type=int, default=1, help="journeys each user makes")
+    parser.add_argument('--latency', type=float, default=100, help="milliseconds the mock API takes to answer")
+    parser.add_argument('--error-rate', type=float, default=0, help="fraction of mock API requests that fail with a 503")
+    parser.add_argument('--db', help="a database made by seed_data.py to copy for the run; without it the run starts from an empty database")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--threads', type=int, default=8, help="worker threads in sync mode")
+    parser.add_argument('--env', nargs='*', default=[], help="settings for the app, such as PREFETCH_ENABLED=0")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument('--record', help="save the responses from the mock API to this cassette file")
+    transport.add_argument('--replay', help="answer the app's requests to the API from this cassette file instead of the mock")
+    parser.add_argument('--save-baseline', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="compare the results with a baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="how much worse a step's p95 may be than the baseline's before --compare fails")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"saved the results to {args.save_baseline}")
+
+    if baseline:
+        regressions = [step for step, result in results['steps'].items() if (p95_change(result, baseline['steps'].get(step)) or 0) > args.tolerance]
+        if regressions:
+            print(f"p95 is more than {args.tolerance * 100:.0f}% worse than the baseline for: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
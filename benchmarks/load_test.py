@@ -0,0 +1,140 @@
+# Compares how many searches per second the app can serve in serve.py's sync and async modes
+# when every search has to wait on a slow Art Institute API (the mock in mock_aic_server.py).
+#
+# usage: python benchmarks/load_test.py --clients 100 --duration 20 --latency 200 --threads 8
+#
+# Each client is its own logged-in user that repeatedly opens the search page and searches for a term nobody has searched before,
+# so every search goes upstream. The async mode needs gevent installed.
+
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_aic_server import start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url + '/login', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"the app did not start at {url}")
+
+
+def register_client(url, clients):
+    # a new user, logged in by registering; the app redirects to the home page when the registration worked
+    client = requests.Session()
+    username = uuid.uuid4().hex
+    response = client.post(url + '/register', data={'username': username, 'password': 'load-test', 'confirmation': 'load-test'}, allow_redirects=False)
+    clients.append((client, response.status_code))
+
+
+def run_client(client, url, deadline, latencies, errors):
+    while time.time() < deadline:
+        # open the search page first, like a real user starting a new search
+        client.get(url + '/search')
+        start = time.perf_counter()
+        try:
+            response = client.post(url + '/search', data={'search': uuid.uuid4().hex[:12]}, timeout=60)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+
+
+def run_threads(target, args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_mode(mode, args, api_url, source_db):
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'load_test.db')
+    shutil.copy(source_db, db_path)
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+
+    # the mock has no rate limit, so neither does the app
+    env = dict(os.environ, DB_PATH=db_path, AIC_API_URL=api_url, PREFETCH_ENABLED='0', AIC_REQUESTS_PER_SECOND='0')
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--mode', mode, '--port', str(port), '--threads', str(args.threads), '--connections', str(args.clients * 2)],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(url)
+        # every client registers before the clock starts, so that hashing their passwords is not counted against the searches
+        clients = []
+        run_threads(register_client, [(url, clients)] * args.clients)
+        failed = [status for _, status in clients if status != 302]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {args.clients} clients could not register (status {failed[0]})")
+
+        latencies, errors = [], []
+        deadline = time.time() + args.duration
+        run_threads(run_client, [(client, url, deadline, latencies, errors) for client, _ in clients])
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory)
+
+    latencies.sort()
+    return {
+        'searches_per_second': len(latencies) / args.duration,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the sync and async serving modes against a mock API.")
+    parser.add_argument('--clients', type=int, default=100, help="concurrent users")
+    parser.add_argument('--duration', type=float, default=20, help="seconds to run each mode for")
+    parser.add_argument('--latency', type=float, default=200, help="milliseconds the mock API takes to answer")
+    parser.add_argument('--threads', type=int, default=8, help="worker threads in sync mode")
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'])
+    parser.add_argument('--source', default=os.getenv('DB_PATH', os.path.join(ROOT, 'aic_collections.db')), help="database to copy for each run")
+    args = parser.parse_args()
+
+    api_port = free_port()
+    start_server(api_port, args.latency)
+    api_url = f'http://127.0.0.1:{api_port}/api/v1'
+
+    print(f"{args.clients} clients, {args.duration:.0f}s per mode, mock API latency {args.latency:.0f}ms")
+    print(f"{'mode':>6} {'searches/s':>11} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for mode in args.modes:
+        result = run_mode(mode, args, api_url, args.source)
+        p50 = f"{result['p50_ms']:.0f}" if result['p50_ms'] is not None else '-'
+        p95 = f"{result['p95_ms']:.0f}" if result['p95_ms'] is not None else '-'
+        print(f"{mode:>6} {result['searches_per_second']:>11.1f} {p50:>8} {p95:>8} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
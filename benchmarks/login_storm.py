@@ -0,0 +1,127 @@
+# Measures how a storm of logins affects everyone else: how many logins a second the app gets through,
+# and how long pages of search results and collection pages take while it does, compared with the same pages when nobody is logging in.
+#
+# usage: python benchmarks/login_storm.py --browsers 5 --stormers 30 --duration 10
+#        python benchmarks/login_storm.py --browsers 5 --stormers 30 --duration 10 --env PASSWORD_HASH_WORKERS=0
+#
+# The second form hashes on the request threads, as the app did before passwords.py, for comparison.
+# Browsers are logged-in users who keep reopening a page of their search results and their collection; stormers log in over and over.
+# The database is made by seed_data.py, and the Art Institute is replaced by mock_aic_server.py.
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from journeys import percentile
+from load_test import ROOT, free_port, wait_for_server
+from mock_aic_server import start_server
+from seed_data import PASSWORD, seed
+
+ROUTES = ['search_results', 'collection_showpage']
+
+
+def browse(url, user_number, stop, latencies, phase):
+    # log in, start a search, then keep opening a page of it and the user's collection until stop is set
+    client = requests.Session()
+    client.post(url + '/login', data={'username': f'user{user_number}', 'password': PASSWORD}, timeout=60)
+    search_url = url + client.post(url + '/search', data={'search': 'water lilies'}, allow_redirects=False, timeout=60).headers['Location']
+    collection_ids = re.findall(r'action="/collections/(\d+)"', client.get(url + '/collections', timeout=60).text)
+    pages = {'search_results': search_url, 'collection_showpage': url + f'/collections/{collection_ids[0]}'}
+
+    while not stop.is_set():
+        for route, page_url in pages.items():
+            start = time.perf_counter()
+            response = client.get(page_url, timeout=60)
+            if response.status_code == 200:
+                latencies[phase[0]][route].append(time.perf_counter() - start)
+
+
+def storm(url, user_number, stop, logins):
+    # log in as the same user over and over, each time as a new browser with no session
+    while not stop.is_set():
+        response = requests.post(url + '/login', data={'username': f'user{user_number}', 'password': PASSWORD}, allow_redirects=False, timeout=60)
+        if response.status_code == 302:
+            logins.append(time.perf_counter())
+
+
+def run(args):
+    api_port = free_port()
+    start_server(api_port, args.latency, 0)
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'login_storm.db')
+    seed(db_path, args.browsers + args.stormers, 1000, 1, 20, iiif_url=f'http://127.0.0.1:{api_port}/iiif/2')
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+
+    env = dict(os.environ, DB_PATH=db_path, AIC_API_URL=f'http://127.0.0.1:{api_port}/api/v1', IMAGE_CACHE_DIR=os.path.join(directory, 'image_cache'), AIC_REQUESTS_PER_SECOND='0', PREFETCH_ENABLED='0')
+    env.update(setting.split('=', 1) for setting in args.env)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--port', str(port), '--threads', str(args.threads)],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(url)
+        stop = threading.Event()
+        latencies = {phase: {route: [] for route in ROUTES} for phase in ('warm_up', 'quiet', 'storm')}
+        # the browsers read the phase from here, so that they can keep going from one phase into the next
+        # the first few seconds, while the app fills its caches, are not counted
+        phase = ['warm_up']
+        browsers = [threading.Thread(target=browse, args=(url, user_number, stop, latencies, phase)) for user_number in range(1, args.browsers + 1)]
+        for browser in browsers:
+            browser.start()
+        time.sleep(3)
+        phase[0] = 'quiet'
+        time.sleep(args.duration)
+
+        phase[0] = 'storm'
+        logins = []
+        storm_stop = threading.Event()
+        stormers = [threading.Thread(target=storm, args=(url, user_number, storm_stop, logins)) for user_number in range(args.browsers + 1, args.browsers + args.stormers + 1)]
+        storm_start = time.perf_counter()
+        for stormer in stormers:
+            stormer.start()
+        time.sleep(args.duration)
+        storm_stop.set()
+        stop.set()
+        for thread in browsers + stormers:
+            thread.join()
+        storm_elapsed = time.perf_counter() - storm_start
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory)
+
+    return latencies, len(logins) / storm_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure page latency for logged-in users during a storm of logins.")
+    parser.add_argument('--browsers', type=int, default=5, help="logged-in users browsing throughout")
+    parser.add_argument('--stormers', type=int, default=30, help="clients logging in over and over during the storm")
+    parser.add_argument('--duration', type=float, default=10, help="seconds for each phase, without and then with the storm")
+    parser.add_argument('--latency', type=float, default=50, help="milliseconds the mock API takes to answer")
+    parser.add_argument('--threads', type=int, default=16, help="the app's worker threads")
+    parser.add_argument('--env', nargs='*', default=[], help="settings for the app, such as PASSWORD_HASH_WORKERS=0")
+    args = parser.parse_args()
+
+    latencies, logins_per_second = run(args)
+    print(f"{logins_per_second:.1f} logins/s during the storm")
+    print(f"{'route':>20} {'phase':>6} {'requests':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for route in ROUTES:
+        for phase in ('quiet', 'storm'):
+            values = sorted(latencies[phase][route])
+            if values:
+                print(f"{route:>20} {phase:>6} {len(values):>9} {percentile(values, 0.5) * 1000:>8.0f} {percentile(values, 0.95) * 1000:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# A local stand-in for the parts of the Art Institute of Chicago's API that the app uses.
+# The data is generated from the request, so the same search always returns the same artworks.
+# Point the app at it with AIC_API_URL=http://127.0.0.1:8001/api/v1
+#
+# usage: python benchmarks/mock_aic_server.py --port 8001 --latency 150 --error-rate 0.05
+#
+# It also stands in for the IIIF image server: the iiif_url in its responses points back at itself,
+# and GET /iiif/2/{image_id}/full/{width},/0/default.jpg returns a placeholder image of a size that grows with the width.
+#
+# GET /__stats returns how many requests each endpoint has served, which shows whether the app's caches are working.
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 10
+MAX_TOTAL_PAGES = 250
+
+
+def make_artwork(artwork_id):
+    return {
+        'id': artwork_id,
+        'title': f'Artwork {artwork_id}',
+        'image_id': f'mock-image-{artwork_id}',
+        'artist_display': f'Artist {artwork_id % 97}\nAmerican, 1850-1920',
+        'date_display': str(1800 + artwork_id % 200),
+        'is_public_domain': True,
+        'thumbnail': {'alt_text': f'A work of art numbered {artwork_id}.'},
+    }
+
+
+def project(artwork, fields):
+    # apply the fields= parameter the way the real API does
+    if not fields:
+        return artwork
+    return {field: artwork.get(field) for field in fields}
+
+
+def search(query, page):
+    # every query has a stable number of pages and a stable set of artwork ids
+    seed = zlib.crc32(' '.join(query.lower().split()).encode())
+    total_pages = seed % MAX_TOTAL_PAGES + 1
+    if page > total_pages:
+        return total_pages, []
+    first_id = (seed % 100000) * 1000 + page * PAGE_SIZE
+    return total_pages, [make_artwork(artwork_id) for artwork_id in range(first_id, first_id + PAGE_SIZE)]
+
+
+def make_image(width):
+    # not a real JPEG, but about as many bytes as one of that width
+    return b'\xff\xd8' + b'\0' * (width * width // 8) + b'\xff\xd9'
+
+
+class MockAICHandler(BaseHTTPRequestHandler):
+    latency_seconds = 0
+    error_rate = 0
+    iiif_url = None
+    stats = Counter()
+    stats_lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        fields = params['fields'][0].split(',') if 'fields' in params else None
+
+        if url.path == '/__stats':
+            with self.stats_lock:
+                return self.respond(200, dict(self.stats))
+
+        time.sleep(self.latency_seconds)
+
+        if random.random() < self.error_rate:
+            # an injected failure, for exercising the app's retries and circuit breaker
+            endpoint = 'injected_error'
+            status, body = 503, {'status': 503, 'error': 'Service unavailable'}
+
+        elif url.path == '/api/v1/artworks/search':
+            endpoint = 'search'
+            page = int(params.get('page', ['1'])[0])
+            # like the real API, refuse to page past the first 100 pages
+            if page > 100:
+                status, body = 403, {'status': 403, 'error': 'Invalid number of results'}
+            else:
+                total_pages, artworks = search(params.get('q', [''])[0], page)
+                status, body = 200, {
+                    'pagination': {'total': total_pages * PAGE_SIZE, 'limit': PAGE_SIZE, 'total_pages': total_pages, 'current_page': page},
+                    'data': [project(artwork, fields) for artwork in artworks],
+                    'config': {'iiif_url': self.iiif_url},
+                }
+
+        elif url.path == '/api/v1/artworks' and 'ids' in params:
+            endpoint = 'artworks_by_ids'
+            ids = [int(artwork_id) for artwork_id in params['ids'][0].split(',') if artwork_id]
+            status, body = 200, {'data': [project(make_artwork(artwork_id), fields) for artwork_id in ids], 'config': {'iiif_url': self.iiif_url}}
+
+        elif url.path.startswith('/api/v1/artworks/') and url.path.rsplit('/', 1)[1].isdigit():
+            endpoint = 'artwork'
+            artwork = make_artwork(int(url.path.rsplit('/', 1)[1]))
+            status, body = 200, {'data': project(artwork, fields), 'config': {'iiif_url': self.iiif_url}}
+
+        elif url.path.startswith('/iiif/2/') and '/full/' in url.path:
+            with self.stats_lock:
+                self.stats['image'] += 1
+            width = int(url.path.split('/full/', 1)[1].split(',', 1)[0])
+            return self.respond_bytes(200, make_image(width), 'image/jpeg')
+
+        else:
+            endpoint = 'not_found'
+            status, body = 404, {'status': 404, 'error': 'Not found'}
+
+        with self.stats_lock:
+            self.stats[endpoint] += 1
+        self.respond(status, body)
+
+    def respond(self, status, body):
+        self.respond_bytes(status, json.dumps(body).encode(), 'application/json')
+
+    def respond_bytes(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=8001, latency_ms=0, error_rate=0):
+    MockAICHandler.latency_seconds = latency_ms / 1000
+    MockAICHandler.error_rate = error_rate
+    MockAICHandler.iiif_url = f'http://127.0.0.1:{port}/iiif/2'
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockAICHandler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(port=8001, latency_ms=0, error_rate=0):
+    # start the mock server on a background thread and return it; used by the other benchmark scripts
+    server = make_server(port, latency_ms, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local mock of the Art Institute of Chicago's API.")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0, help="milliseconds to wait before answering each request")
+    parser.add_argument('--error-rate', type=float, default=0, help="fraction of requests to answer with a 503")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency, args.error_rate)
+    print(f"mock AIC API listening on http://127.0.0.1:{args.port}/api/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
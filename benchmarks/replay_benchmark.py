@@ -0,0 +1,108 @@
+# Measures how fast the replay transport in cassettes.py answers, to make sure it is never the bottleneck when the app is load tested against a recording.
+#
+# It records pages of search results, artworks and images from mock_aic_server.py into a cassette file through AICClient,
+# then replays random requests from it with many threads for a while and reports the requests per second and the latency percentiles,
+# checking that every replayed body is the same as the recorded one.
+#
+# usage: python benchmarks/replay_benchmark.py --threads 16 --duration 5
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from aic_client import AICClient
+from cassettes import make_transport
+from journeys import SEARCH_WORDS, percentile
+from load_test import free_port
+from mock_aic_server import start_server
+
+
+def make_requests(count):
+    # the same mix of requests as the app makes: pages of search results, artworks' details and images
+    rng = random.Random(0)
+    requests = []
+    for number in range(count):
+        kind = number % 3
+        if kind == 0:
+            requests.append(('/api/v1/artworks/search', {'q': rng.choice(SEARCH_WORDS), 'page': rng.randint(1, 20), 'limit': 10, 'fields': 'id,title,image_id,artist_display,date_display,thumbnail'}, False))
+        elif kind == 1:
+            requests.append((f'/api/v1/artworks/{rng.randint(1, 100000)}', {'fields': 'id,title,image_id,artist_display,date_display,thumbnail'}, False))
+        else:
+            requests.append((f'/iiif/2/mock-image-{rng.randint(1, 100000)}/full/400,/0/default.jpg', None, True))
+    return requests
+
+
+def record(base_url, path, requests):
+    client = AICClient(base_url, transport=make_transport('record', path))
+    bodies = []
+    for request_path, params, stream in requests:
+        response = client.get(request_path, params=params, stream=stream)
+        bodies.append(b''.join(response.iter_content(65536)) if stream else response.content)
+    return bodies
+
+
+def replay(base_url, path, requests, bodies, threads, duration):
+    client = AICClient(base_url, transport=make_transport('replay', path, pool_maxsize=threads))
+    latencies = []
+    mismatches = []
+    stop = threading.Event()
+
+    def run(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            index = rng.randrange(len(requests))
+            request_path, params, stream = requests[index]
+            start = time.perf_counter()
+            response = client.get(request_path, params=params, stream=stream)
+            body = b''.join(response.iter_content(65536)) if stream else response.content
+            latencies.append(time.perf_counter() - start)
+            if body != bodies[index]:
+                mismatches.append(request_path)
+
+    workers = [threading.Thread(target=run, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sorted(latencies), time.perf_counter() - start, mismatches, client.session.get_adapter(base_url).stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record responses from the mock API, then measure how fast they are replayed.")
+    parser.add_argument('--requests', type=int, default=3000, help="distinct requests to record")
+    parser.add_argument('--threads', type=int, default=16, help="threads replaying at once")
+    parser.add_argument('--duration', type=float, default=5, help="seconds to replay for")
+    args = parser.parse_args()
+
+    port = free_port()
+    start_server(port)
+    base_url = f'http://127.0.0.1:{port}'
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'cassettes.db')
+    try:
+        requests = make_requests(args.requests)
+        start = time.perf_counter()
+        bodies = record(base_url, path, requests)
+        print(f"recorded {len(requests)} requests in {time.perf_counter() - start:.1f}s, {os.path.getsize(path) / 1e6:.1f} MB on disk for {sum(map(len, bodies)) / 1e6:.1f} MB of bodies")
+
+        latencies, elapsed, mismatches, stats = replay(base_url, path, requests, bodies, args.threads, args.duration)
+        print(f"replayed {len(latencies)} requests with {args.threads} threads in {elapsed:.1f}s, {len(latencies) / elapsed:.0f} requests/s, "
+              f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms, {stats['misses']} misses, {len(mismatches)} mismatched bodies")
+    finally:
+        shutil.rmtree(directory)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Fills a database with synthetic users, collections and artworks, so that the app can be benchmarked against a database of a realistic size.
+# Every user is named user<n> and has the password "benchmark", which is what journeys.py logs in with.
+# The artworks look like the ones that mock_aic_server.py returns, and are marked as imported from the catalog so the orphan sweep keeps them.
+#
+# usage: python benchmarks/seed_data.py --db seeded.db --users 10000 --artworks 1000000 --collections-per-user 5 --works-per-collection 20
+#
+# Rows are generated and written in batches, so memory use stays the same however many millions of rows are asked for.
+# The same --seed always produces the same database.
+
+import argparse
+import os
+import random
+import sys
+import time
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import load_config
+from helper_methods import get_artwork_details, open_db_connection
+from migrations import upgrade_database
+from mock_aic_server import make_artwork
+
+PASSWORD = 'benchmark'
+BATCH_SIZE = 50000
+
+
+def batches(rows, batch_size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(conn, sql, rows):
+    # write rows in batches of BATCH_SIZE, one transaction per batch; returns how many were written
+    count = 0
+    for batch in batches(rows):
+        conn.executemany(sql, batch)
+        conn.commit()
+        count += len(batch)
+    return count
+
+
+def artwork_rows(count, iiif_url, now):
+    for artwork_id in range(1, count + 1):
+        artwork = make_artwork(artwork_id)
+        yield [artwork['title'], artwork_id, f'https://www.artic.edu/artworks/{artwork_id}', *get_artwork_details(artwork, iiif_url), now, now]
+
+
+def user_rows(count):
+    # hashing a password is slow on purpose, so every user shares the same hash, made the way the app is set to hash them
+    password_hash = generate_password_hash(PASSWORD, load_config()['PASSWORD_HASH_METHOD'])
+    for user_number in range(1, count + 1):
+        yield [f'user{user_number}', password_hash]
+
+
+def collection_rows(first_user_id, users, collections_per_user):
+    for user_id in range(first_user_id, first_user_id + users):
+        for collection_number in range(1, collections_per_user + 1):
+            yield [user_id, f'Collection {collection_number}']
+
+
+def collected_work_rows(rng, first_user_id, first_collection_id, users, collections_per_user, works_per_collection, artworks):
+    # collections are numbered in the order they were inserted, collections_per_user at a time for each user
+    collection_id = first_collection_id
+    for user_id in range(first_user_id, first_user_id + users):
+        for collection_number in range(collections_per_user):
+            for artwork_id in rng.sample(range(1, artworks + 1), min(works_per_collection, artworks)):
+                yield [user_id, artwork_id, collection_id]
+            collection_id += 1
+
+
+def seed(path, users, artworks, collections_per_user, works_per_collection, seed_value=0, iiif_url='https://www.artic.edu/iiif/2'):
+    rng = random.Random(seed_value)
+    conn = open_db_connection(path)
+    upgrade_database(conn)
+    # the seeded database can be thrown away and made again, so skip the fsyncs
+    conn.execute("PRAGMA synchronous = OFF")
+
+    start = time.perf_counter()
+    counts = {}
+    counts['artworks'] = insert(conn, "INSERT INTO artworks (title, artwork_id, art_institute_url, alt_text, display_url, artist_info, date_info, details_fetched_at, catalog_imported_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (artwork_id) DO NOTHING", artwork_rows(artworks, iiif_url, time.time()))
+
+    first_user_id = (conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0) + 1
+    counts['users'] = insert(conn, "INSERT INTO users (username, hash) VALUES(?, ?)", user_rows(users))
+
+    first_collection_id = (conn.execute("SELECT MAX(id) FROM collections").fetchone()[0] or 0) + 1
+    counts['collections'] = insert(conn, "INSERT INTO collections (user_id, title) VALUES(?, ?)", collection_rows(first_user_id, users, collections_per_user))
+
+    counts['collected_works'] = insert(conn, "INSERT INTO collected_works (user_id, artwork_id, collection_id) VALUES(?, ?, ?)", collected_work_rows(rng, first_user_id, first_collection_id, users, collections_per_user, works_per_collection, artworks))
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return counts, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a database with synthetic users, collections and artworks.")
+    parser.add_argument('--db', required=True, help="database to create or add to")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--artworks', type=int, default=100000)
+    parser.add_argument('--collections-per-user', type=int, default=3)
+    parser.add_argument('--works-per-collection', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iiif-url', default='https://www.artic.edu/iiif/2', help="image server for the artworks' image urls, such as the mock server's http://127.0.0.1:8001/iiif/2")
+    args = parser.parse_args()
+
+    counts, elapsed = seed(args.db, args.users, args.artworks, args.collections_per_user, args.works_per_collection, args.seed, args.iiif_url)
+    rows = sum(counts.values())
+    print(', '.join(f"{count} {table}" for table, count in counts.items()))
+    print(f"wrote {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Measures how much time each session backend in sessions.py adds to a request.
+# Each backend runs on a small Flask app with the same session settings as app.py; the "none" row is the same route without reading the session.
+# The sqlite row includes opening the request's database connection, which the real app does on almost every request anyway.
+#
+# usage: python benchmarks/session_benchmark.py --requests 2000
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from flask import Flask, g, session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helper_methods import open_db_connection
+from migrations import upgrade_database
+from sessions import configure_sessions
+
+BACKENDS = ['none', 'cookie', 'sqlite', 'filesystem']
+
+
+def make_app(backend, directory):
+    app = Flask(__name__)
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_FILE_DIR"] = os.path.join(directory, 'flask_session')
+    app.secret_key = 'session-benchmark'
+    db_path = os.path.join(directory, 'sessions.db')
+
+    def get_connection():
+        if 'db' not in g:
+            g.db = open_db_connection(db_path)
+        return g.db
+
+    @app.teardown_appcontext
+    def close_connection(exception=None):
+        conn = g.pop('db', None)
+        if conn is not None:
+            conn.close()
+
+    if backend != 'none':
+        configure_sessions(app, backend, get_connection)
+
+    @app.route('/login')
+    def login():
+        session["user_id"] = 1
+        return 'ok'
+
+    @app.route('/page')
+    def page():
+        # what most routes do: check that a user is logged in
+        if backend != 'none' and not session.get("user_id"):
+            return 'logged out', 401
+        return 'ok'
+
+    return app
+
+
+def run(backend, requests):
+    directory = tempfile.mkdtemp()
+    conn = open_db_connection(os.path.join(directory, 'sessions.db'))
+    upgrade_database(conn)
+    conn.close()
+
+    client = make_app(backend, directory).test_client()
+    client.get('/login')
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get('/page')
+        assert response.status_code == 200
+    elapsed = time.perf_counter() - start
+
+    shutil.rmtree(directory)
+    return elapsed / requests * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-request overhead of each session backend.")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'backend':>11} {'us/request':>11} {'overhead us':>12}")
+    for backend in args.backends:
+        microseconds = run(backend, args.requests)
+        if backend == 'none':
+            baseline = microseconds
+        overhead = f"{microseconds - baseline:.0f}" if baseline is not None else '-'
+        print(f"{backend:>11} {microseconds:>11.0f} {overhead:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import io
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+# Transports for the requests that AICClient makes, so that the Art Institute can be recorded once and replayed without it.
+#
+#   live:   requests go to the Art Institute as usual
+#   record: requests go to the Art Institute, and every response that is not an error is also saved in a cassette store
+#   replay: requests are answered from the cassette store and never leave the machine, each after latency_ms,
+#           with error_rate of them failing with a 503 as the API does when it is struggling
+#
+# A transport is a requests adapter mounted on the client's session, so retries, the circuit breaker, the rate limit and streamed image downloads
+# all behave the same whichever one is in use. Responses are keyed by the request's path and query parameters, without the host,
+# so that a store recorded against api.artic.edu (or the mock in benchmarks/mock_aic_server.py) can be replayed with AIC_API_URL pointing anywhere.
+# The store is a SQLite file of compressed bodies; a request that was never recorded is answered with a 404 and counted as a miss.
+
+
+def request_key(method, url):
+    # the path and the query parameters in sorted order, so the same request is found whatever order its parameters were sent in
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f'{method} {parts.path}?{query}' if query else f'{method} {parts.path}'
+
+
+class CassetteStore:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.writer = None
+        self.writer_pid = None
+
+    def get_connection(self):
+        # replaying reads from one connection per thread, so threads never wait on each other
+        # a process forked from this one gets its own, since an SQLite connection cannot be shared with a child process
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.local.pid = os.getpid()
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER NOT NULL, content_type TEXT, compressed INTEGER NOT NULL, body BLOB NOT NULL, recorded_at REAL NOT NULL)")
+        return conn
+
+    def get(self, key):
+        # the (status, content type, body) recorded for key, or None
+        row = self.get_connection().execute("SELECT status, content_type, compressed, body FROM responses WHERE key = ?", [key]).fetchone()
+        if row is None:
+            return None
+        status, content_type, compressed, body = row
+        return status, content_type, zlib.decompress(body) if compressed else body
+
+    def put(self, key, status, content_type, body):
+        # images are already compressed, so only the bodies that zlib makes smaller are stored compressed
+        compressed_body = zlib.compress(body, 6)
+        compressed = len(compressed_body) < len(body)
+        with self.write_lock:
+            if self.writer is None or self.writer_pid != os.getpid():
+                self.writer = self.get_connection()
+                self.writer_pid = os.getpid()
+            self.writer.execute(
+                "INSERT INTO responses (key, status, content_type, compressed, body, recorded_at) VALUES(?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET status = excluded.status, content_type = excluded.content_type, compressed = excluded.compressed, body = excluded.body, recorded_at = excluded.recorded_at",
+                [key, status, content_type, int(compressed), compressed_body if compressed else body, time.time()]
+            )
+            self.writer.commit()
+
+    def count(self):
+        return self.get_connection().execute("SELECT count(*) FROM responses").fetchone()[0]
+
+
+class RecordingAdapter(HTTPAdapter):
+    # sends requests on as usual and saves a copy of each response that is worth replaying
+    def __init__(self, store, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.stats = Counter()
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # errors and rate limiting are not recorded; replay makes its own with error_rate
+        if response.status_code < 500 and response.status_code != 429:
+            # reading the body here still lets a caller that streams it iterate over it afterwards
+            self.store.put(request_key(request.method, request.url), response.status_code, response.headers.get('Content-Type'), response.content)
+            self.stats['recorded'] += 1
+        return response
+
+
+class ReplayAdapter(HTTPAdapter):
+    # answers every request from the store, without opening a connection
+    uses_network = False
+
+    def __init__(self, store, latency_ms=0, error_rate=0, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.stats = Counter()
+
+    def send(self, request, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats['injected_errors'] += 1
+            return self.make_response(request, 503, 'application/json', b'{"status": 503, "error": "injected by replay"}')
+
+        recorded = self.store.get(request_key(request.method, request.url))
+        if recorded is None:
+            self.stats['misses'] += 1
+            return self.make_response(request, 404, 'application/json', b'{"status": 404, "error": "not recorded"}')
+        self.stats['hits'] += 1
+        return self.make_response(request, *recorded)
+
+    def make_response(self, request, status, content_type, body):
+        # the same kind of response that a real connection would give, so that streaming and .json() work as usual
+        headers = {'Content-Length': str(len(body))}
+        if content_type:
+            headers['Content-Type'] = content_type
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, preload_content=False, decode_content=False)
+        return self.build_response(request, raw)
+
+
+def make_transport(mode, store_path, latency_ms=0, error_rate=0, **adapter_kwargs):
+    # the adapter to mount for mode ('live', 'record' or 'replay'); adapter_kwargs are HTTPAdapter's, such as pool_maxsize
+    if mode == 'live':
+        return HTTPAdapter(**adapter_kwargs)
+    if mode == 'record':
+        return RecordingAdapter(CassetteStore(store_path), **adapter_kwargs)
+    if mode == 'replay':
+        return ReplayAdapter(CassetteStore(store_path), latency_ms, error_rate, **adapter_kwargs)
+    raise ValueError(f"unknown transport {mode!r}; expected live, record or replay")
@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+import time
+import click
+from flask.cli import with_appcontext
+from helper_methods import get_artwork_details, get_db_connection
+
+# Loads the Art Institute's data dump (https://github.com/art-institute-of-chicago/api-data) into the artworks table,
+# so that searches and showpages can be served without a fetch to the API for every click.
+#
+# The import is a pipeline of generators: the dump's files are listed one at a time, each file is read one record at a time,
+# the records are filtered and turned into rows, and the rows are grouped into batches that are each written in one transaction.
+# Only one batch is ever held in memory. JSONL files are streamed line by line; a .json file is read whole,
+# which is fine for the dump, where each .json file is a single artwork. Either kind of file can be gzipped.
+#
+# The position of the last record in each committed batch is saved in import_checkpoints in the same transaction as the batch,
+# so an interrupted import picks up where it stopped. Once an import finishes, its checkpoint is deleted,
+# and running it again updates the artworks that changed in the dump and adds the new ones.
+
+catalog_file_extensions = ('.json', '.jsonl', '.json.gz', '.jsonl.gz')
+
+# the dump does not include the API's config block, so this is the IIIF server that image urls are built from
+default_iiif_url = 'https://www.artic.edu/iiif/2'
+
+
+def iter_catalog_files(paths):
+    # yield every dump file under paths, in a stable order so that a checkpoint means the same thing on every run
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                subdirectories.sort()
+                for name in sorted(files):
+                    if name.endswith(catalog_file_extensions):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def open_catalog_file(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_file_records(path):
+    # yield each artwork in a dump file; a .json file may hold one artwork, a list of them, or an API response with a data field
+    with open_catalog_file(path) as file:
+        if path.endswith(('.jsonl', '.jsonl.gz')):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        content = json.load(file)
+        if isinstance(content, dict) and 'data' in content:
+            content = content['data']
+        if isinstance(content, dict):
+            content = [content]
+        yield from content
+
+
+def iter_catalog_records(files, checkpoint=None):
+    # yield (file, record number, artwork) for every record in files, skipping the ones up to and including the checkpoint
+    # checkpoint is the (file, record number) of the last record that was saved
+    skipping = checkpoint is not None
+    for path in files:
+        if skipping and path != checkpoint[0]:
+            continue
+        for record_number, artwork in enumerate(iter_file_records(path), 1):
+            if skipping and record_number <= checkpoint[1]:
+                continue
+            skipping = False
+            yield path, record_number, artwork
+        skipping = False
+
+
+def iter_artwork_rows(records, iiif_url, public_domain_only=True):
+    # turn each record into (file, record number, row), where row is None for a record that is not imported
+    # records that are skipped are still passed along so that the checkpoint moves past them
+    for path, record_number, artwork in records:
+        if not isinstance(artwork, dict) or artwork.get('id') is None or (public_domain_only and not artwork.get('is_public_domain')):
+            yield path, record_number, None
+            continue
+        yield path, record_number, [
+            artwork.get('title'),
+            artwork['id'],
+            f'https://www.artic.edu/artworks/{artwork["id"]}',
+            *get_artwork_details(artwork, iiif_url)
+        ]
+
+
+def iter_batches(rows, batch_size):
+    # group rows into lists of at most batch_size
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def save_catalog_batch(conn, source, batch):
+    # upsert a batch of rows and move the checkpoint to its last record, in one transaction
+    # artworks whose stored values already match the dump are left alone, so rerunning an import only writes what changed
+    # returns the number of artworks that were added or changed
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    written = conn.executemany(
+        "INSERT INTO artworks (title, artwork_id, art_institute_url, alt_text, display_url, artist_info, date_info, details_fetched_at, catalog_imported_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (artwork_id) DO UPDATE SET title = excluded.title, alt_text = excluded.alt_text, display_url = excluded.display_url, artist_info = excluded.artist_info, date_info = excluded.date_info, details_fetched_at = excluded.details_fetched_at, catalog_imported_at = excluded.catalog_imported_at "
+        "WHERE artworks.catalog_imported_at IS NULL OR artworks.title IS NOT excluded.title OR artworks.alt_text IS NOT excluded.alt_text OR artworks.display_url IS NOT excluded.display_url OR artworks.artist_info IS NOT excluded.artist_info OR artworks.date_info IS NOT excluded.date_info",
+        [[*row, now, now] for path, record_number, row in batch if row is not None]
+    ).rowcount
+
+    path, record_number, row = batch[-1]
+    conn.execute(
+        "INSERT INTO import_checkpoints (source, file, record_number, updated_at) VALUES(?, ?, ?, ?) ON CONFLICT (source) DO UPDATE SET file = excluded.file, record_number = excluded.record_number, updated_at = excluded.updated_at",
+        [source, path, record_number, now]
+    )
+    conn.commit()
+    return written
+
+
+def get_checkpoint(conn, source):
+    row = conn.execute("SELECT file, record_number FROM import_checkpoints WHERE source = ?", [source]).fetchone()
+    if row is None:
+        return None
+    return row['file'], row['record_number']
+
+
+def import_catalog(conn, paths, batch_size=5000, iiif_url=default_iiif_url, public_domain_only=True, restart=False, progress=None):
+    # import the dump files under paths into the artworks table, resuming from the last checkpoint unless restart is set
+    # progress(records_read, rows_written, elapsed_seconds) is called after every batch
+    # returns (records_read, rows_written, elapsed_seconds)
+    paths = [os.path.abspath(path) for path in paths]
+    source = '\n'.join(paths)
+
+    checkpoint = None if restart else get_checkpoint(conn, source)
+    if checkpoint is not None and not os.path.exists(checkpoint[0]):
+        # the file the last run stopped in is gone, so the checkpoint no longer points anywhere
+        checkpoint = None
+
+    records = iter_catalog_records(iter_catalog_files(paths), checkpoint)
+    rows = iter_artwork_rows(records, iiif_url, public_domain_only)
+
+    start = time.perf_counter()
+    records_read = 0
+    rows_written = 0
+    for batch in iter_batches(rows, batch_size):
+        rows_written += save_catalog_batch(conn, source, batch)
+        records_read += len(batch)
+        if progress is not None:
+            progress(records_read, rows_written, time.perf_counter() - start)
+
+    # the import is complete, so the next run starts from the beginning again
+    conn.execute("DELETE FROM import_checkpoints WHERE source = ?", [source])
+    conn.commit()
+    return records_read, rows_written, time.perf_counter() - start
+
+
+@click.command('import-catalog')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--batch-size', default=5000, show_default=True, help="Artworks written per transaction.")
+@click.option('--iiif-url', default=default_iiif_url, show_default=True, help="IIIF server to build image urls from.")
+@click.option('--all', 'include_all', is_flag=True, help="Also import artworks that are not in the public domain.")
+@click.option('--restart', is_flag=True, help="Ignore the checkpoint from an interrupted run and start from the beginning.")
+@with_appcontext
+def import_catalog_command(paths, batch_size, iiif_url, include_all, restart):
+    # flask import-catalog path/to/api-data/json/artworks
+    def progress(records_read, rows_written, elapsed_seconds):
+        click.echo(f"read {records_read} records, wrote {rows_written} artworks ({records_read / elapsed_seconds:.0f} records/s)")
+
+    records_read, rows_written, elapsed_seconds = import_catalog(
+        get_db_connection(), paths, batch_size=batch_size, iiif_url=iiif_url, public_domain_only=not include_all, restart=restart, progress=progress
+    )
+    rate = records_read / elapsed_seconds if elapsed_seconds else 0
+    click.echo(f"imported {records_read} records in {elapsed_seconds:.1f}s ({rate:.0f} records/s); {rows_written} artworks were added or changed")
@@ -0,0 +1,225 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from flask import current_app
+from catalog_import import iter_batches
+from helper_methods import artwork_prefetcher, find_or_create_collection, get_image_rendition_url, image_cache, open_db_connection
+
+# Exports a user's collections as files, and imports them back, without ever holding a whole library in memory.
+#
+# An export is a generator that the route streams out as it goes: the user's collections are read one at a time, and the artworks in each
+# are read from the database cursor COLLECTION_EXPORT_CHUNK_SIZE rows at a time and written out before the next rows are read. It comes as JSON Lines, as CSV,
+# or as a ZIP of the JSON Lines along with the images of the artworks that are in the image cache. The ZIP is built as it is sent too:
+# zipfile writes into a ZipStream, and whatever it has written is sent after each chunk.
+# The export generators open a database connection of their own when they start, and close it when they finish or the download is abandoned:
+# a streamed response is read after the view that returned it has finished, and the request's connection (get_db_connection) is closed with the view's context.
+#
+# Every line of an export is one artwork in one collection, in the order the artworks were added, and a collection with no artworks is a line with no artwork_id.
+# An import reads the same lines back, one batch of COLLECTION_IMPORT_BATCH_SIZE lines at a time, each written in one transaction: the collections are created if the user does not have them,
+# the artworks are added to the artworks table if they are not there yet, and then to their collections, skipping the ones already in them.
+# Only an artwork's id and title are taken from the file; everything else about it, including its image url, is fetched from the API in the background
+# once the import has been answered, so an edited file cannot point the image route at another server, and a large import does not wait on the API.
+# Importing the same file twice changes nothing the second time.
+
+export_fields = ['collection', 'artwork_id', 'title', 'artist_info', 'date_info', 'alt_text', 'art_institute_url']
+
+
+class CollectionImportError(ValueError):
+    # the uploaded file is not an export that can be read back
+    pass
+
+
+def open_export_connection():
+    config = current_app.config
+    return open_db_connection(config['DB_PATH'], config['DB_BUSY_TIMEOUT_MS'], config['DB_CACHE_SIZE_KIB'])
+
+
+def iter_export_records(user_id, collection_id=None, chunk_size=None):
+    # yield a list of up to chunk_size records at a time for the user's collections, or for one of them
+    chunk_size = chunk_size or current_app.config['COLLECTION_EXPORT_CHUNK_SIZE']
+    conn = open_export_connection()
+    try:
+        collections = conn.execute(
+            "SELECT id, title FROM collections WHERE user_id = ? AND (? IS NULL OR id = ?) ORDER BY id", [user_id, collection_id, collection_id]
+        ).fetchall()
+        for collection in collections:
+            cursor = conn.execute(
+                "SELECT artworks.artwork_id, artworks.title, artworks.artist_info, artworks.date_info, artworks.alt_text, artworks.art_institute_url, artworks.display_url "
+                "FROM collected_works JOIN artworks ON artworks.artwork_id = collected_works.artwork_id WHERE collected_works.user_id = ? AND collected_works.collection_id = ? ORDER BY collected_works.id",
+                [user_id, collection['id']]
+            )
+            empty = True
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                empty = False
+                yield [dict(row, collection=collection['title']) for row in rows]
+            if empty:
+                yield [{'collection': collection['title']}]
+    finally:
+        conn.close()
+
+
+def get_cached_image(artwork):
+    # the path of the artwork's image if it is in the image cache, without downloading it if it is not
+    if not artwork.get('display_url'):
+        return None
+    return image_cache.lookup(image_cache.get_name(get_image_rendition_url(artwork['display_url'], 'full')))
+
+
+def export_jsonl(records, with_images=False):
+    for chunk in records:
+        lines = []
+        for record in chunk:
+            line = {field: record.get(field) for field in export_fields}
+            if with_images and get_cached_image(record):
+                line['image'] = f"images/{record['artwork_id']}.jpg"
+            lines.append(json.dumps(line) + '\n')
+        yield ''.join(lines)
+
+
+def export_csv(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, export_fields, extrasaction='ignore')
+    writer.writeheader()
+    for chunk in records:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class ZipStream:
+    # what zipfile writes a ZIP into when it is sent as it is built; take() returns what has been written since it was last called
+    # it cannot seek, so zipfile writes each file's size after its data instead of going back to fill it in
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_zip(user_id, collection_id=None, chunk_size=None):
+    # collections.jsonl, then the cached images of the artworks in it, each read from the database separately so that neither is held in memory
+    chunk_size = chunk_size or current_app.config['COLLECTION_EXPORT_CHUNK_SIZE']
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('collections.jsonl', 'w') as file:
+            for text in export_jsonl(iter_export_records(user_id, collection_id, chunk_size), with_images=True):
+                file.write(text.encode())
+                yield stream.take()
+
+        # an artwork in several collections is only included once; the images are JPEGs already, so they are stored without compressing them again
+        conn = open_export_connection()
+        try:
+            cursor = conn.execute(
+                "SELECT DISTINCT artworks.artwork_id, artworks.display_url FROM collected_works JOIN artworks ON artworks.artwork_id = collected_works.artwork_id WHERE collected_works.user_id = ? AND (? IS NULL OR collected_works.collection_id = ?)",
+                [user_id, collection_id, collection_id]
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    path = get_cached_image(dict(row))
+                    if path is not None:
+                        try:
+                            archive.write(path, f"images/{row['artwork_id']}.jpg", compress_type=zipfile.ZIP_STORED)
+                        except FileNotFoundError:
+                            # evicted from the cache since it was looked up
+                            continue
+                        yield stream.take()
+        finally:
+            conn.close()
+    yield stream.take()
+
+
+def iter_import_records(file, filename):
+    # yield (line number, record) for each line of an uploaded export, read as it is needed; file is the upload's binary stream
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.zip':
+        try:
+            archive = zipfile.ZipFile(file)
+            text = io.TextIOWrapper(archive.open('collections.jsonl'), encoding='utf-8')
+        except (zipfile.BadZipFile, KeyError):
+            raise CollectionImportError("That ZIP file is not an export of collections.")
+        extension = '.jsonl'
+    else:
+        text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+
+    if extension not in ('.csv', '.jsonl', '.json'):
+        raise CollectionImportError("Collections can be imported from a .jsonl, .csv or .zip export.")
+    try:
+        if extension == '.csv':
+            # the header is line 1
+            yield from enumerate(csv.DictReader(text), 2)
+            return
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                raise CollectionImportError(f"Line {line_number} of the file is not valid JSON.")
+    except UnicodeDecodeError:
+        raise CollectionImportError("The file is not UTF-8 text.")
+
+
+def parse_import_record(line_number, record):
+    # (collection title, artwork id or None, title) for a line of an export
+    collection = record.get('collection') if isinstance(record, dict) else None
+    if not isinstance(collection, str) or not collection.strip():
+        raise CollectionImportError(f"Line {line_number} of the file does not name a collection.")
+    artwork_id = record.get('artwork_id')
+    if artwork_id in (None, ''):
+        return collection.strip(), None, None
+    try:
+        artwork_id = int(artwork_id)
+    except (TypeError, ValueError):
+        raise CollectionImportError(f"Line {line_number} of the file has an artwork id that is not a number.")
+    title = record.get('title')
+    return collection.strip(), artwork_id, str(title) if title is not None else None
+
+
+def import_collection_records(conn, user_id, records, batch_size=None):
+    # import the records from iter_import_records into the user's collections; returns (collections, artworks added to them)
+    # a file that turns out to be malformed part of the way through keeps the batches before the bad line, which is safe since importing again skips them
+    collection_ids = {}
+    artworks_added = 0
+    # only the ids are kept for fetching the details, not the lines they came from
+    artwork_ids = set()
+    try:
+        for batch in iter_batches((parse_import_record(*record) for record in records), batch_size or current_app.config['COLLECTION_IMPORT_BATCH_SIZE']):
+            for title, artwork_id, artwork_title in batch:
+                if title not in collection_ids:
+                    collection_ids[title] = find_or_create_collection(conn, user_id, title)
+
+            artworks = [(collection, artwork_id, artwork_title) for collection, artwork_id, artwork_title in batch if artwork_id is not None]
+            conn.executemany(
+                "INSERT INTO artworks (title, artwork_id, art_institute_url) VALUES(?, ?, ?) ON CONFLICT (artwork_id) DO NOTHING",
+                [[artwork_title, artwork_id, f'https://www.artic.edu/artworks/{artwork_id}'] for collection, artwork_id, artwork_title in artworks]
+            )
+            artworks_added += conn.executemany(
+                "INSERT INTO collected_works (collection_id, user_id, artwork_id) VALUES(?, ?, ?) ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+                [[collection_ids[collection], user_id, artwork_id] for collection, artwork_id, artwork_title in artworks]
+            ).rowcount
+            conn.commit()
+            artwork_ids.update(artwork_id for collection, artwork_id, artwork_title in artworks)
+    finally:
+        # the new artworks' details and image urls, up to a hundred in each request to the API, for the batches that were saved
+        # importing the same artworks again while their details are still being fetched does not fetch them twice
+        if artwork_ids:
+            artwork_prefetcher.submit(user_id, frozenset(artwork_ids), sorted(artwork_ids))
+    return len(collection_ids), artworks_added
@@ -0,0 +1,114 @@
+import os
+from dotenv import load_dotenv
+
+# The app's settings. create_app reads them from the environment (and .env) with load_config, then applies its own config on top,
+# so that nothing reads the environment when a module is imported and every app made by create_app can have settings of its own.
+# Each setting has the same name as the environment variable it comes from; the comments say what they do.
+
+
+def load_config(environ=None):
+    # the settings from environ, which is os.environ after loading .env unless it is given
+    if environ is None:
+        load_dotenv()
+        environ = os.environ
+
+    def get(name, default=None, type=str):
+        value = environ.get(name)
+        return type(value) if value not in (None, '') else default
+
+    def flag(name, default):
+        return environ.get(name, '1' if default else '0') != '0'
+
+    password_hash_workers = get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1), int)
+    return dict(
+        SESSION_PERMANENT=False,
+        SECRET_KEY=get('SECRET_KEY'),
+        # sessions are stored according to SESSION_BACKEND: sqlite (the default), cookie (which needs SECRET_KEY) or filesystem; see sessions.py
+        SESSION_BACKEND=get('SESSION_BACKEND', 'sqlite'),
+
+        DB_PATH=get('DB_PATH'),
+        # how long a connection waits on a locked database before giving up, and how much page cache each connection keeps (a negative cache_size is in KiB)
+        DB_BUSY_TIMEOUT_MS=get('DB_BUSY_TIMEOUT_MS', 5000, int),
+        DB_CACHE_SIZE_KIB=get('DB_CACHE_SIZE_KIB', 16000, int),
+        # the schema for the database is defined by the migrations in migrations.py
+        # they are applied when the app is created (unless DB_AUTO_MIGRATE is set to 0) or by running "flask db upgrade"
+        DB_AUTO_MIGRATE=flag('DB_AUTO_MIGRATE', True),
+        # set SLOW_REQUEST_MS to log the requests that take longer than that, with the SQL they ran
+        SLOW_REQUEST_MS=get('SLOW_REQUEST_MS', 0, int),
+        # routes only clean up the artworks they touched; set ORPHAN_SWEEP_INTERVAL (in seconds) to also sweep the whole table periodically
+        ORPHAN_SWEEP_INTERVAL=get('ORPHAN_SWEEP_INTERVAL', 0, int),
+
+        # the Art Institute's API; this can be pointed at a local stub such as benchmarks/mock_aic_server.py
+        AIC_API_URL=get('AIC_API_URL', 'https://api.artic.edu/api/v1'),
+        # AIC_TRANSPORT=record saves the API's and the image server's responses in AIC_CASSETTE_PATH as they come in, and AIC_TRANSPORT=replay answers from there
+        # without the network, waiting AIC_REPLAY_LATENCY_MS on each request and failing AIC_REPLAY_ERROR_RATE of them, for load testing (see cassettes.py)
+        AIC_TRANSPORT=get('AIC_TRANSPORT', 'live'),
+        AIC_CASSETTE_PATH=get('AIC_CASSETTE_PATH', 'aic_cassettes.db'),
+        AIC_REPLAY_LATENCY_MS=get('AIC_REPLAY_LATENCY_MS', 0, float),
+        AIC_REPLAY_ERROR_RATE=get('AIC_REPLAY_ERROR_RATE', 0, float),
+        AIC_POOL_SIZE=get('AIC_POOL_SIZE', 20, int),
+        AIC_CONNECT_TIMEOUT=get('AIC_CONNECT_TIMEOUT', 3.05, float),
+        AIC_READ_TIMEOUT=get('AIC_READ_TIMEOUT', 10, float),
+        AIC_MAX_RETRIES=get('AIC_MAX_RETRIES', 2, int),
+        AIC_BACKOFF_SECONDS=get('AIC_BACKOFF_SECONDS', 0.25, float),
+        AIC_BREAKER_FAILURES=get('AIC_BREAKER_FAILURES', 5, int),
+        AIC_BREAKER_RESET_SECONDS=get('AIC_BREAKER_RESET_SECONDS', 30, float),
+        # the API allows AIC_REQUESTS_PER_SECOND on average (the Art Institute asks for at most 60 a minute), in bursts of up to AIC_BURST
+        # a page load that would wait more than AIC_MAX_WAIT_INTERACTIVE seconds for its turn, or background work more than AIC_MAX_WAIT_BACKGROUND, is served from what is stored instead
+        AIC_REQUESTS_PER_SECOND=get('AIC_REQUESTS_PER_SECOND', 1, float),
+        AIC_BURST=get('AIC_BURST', 60, float),
+        AIC_MAX_WAIT_INTERACTIVE=get('AIC_MAX_WAIT_INTERACTIVE', 3, float),
+        AIC_MAX_WAIT_BACKGROUND=get('AIC_MAX_WAIT_BACKGROUND', 1, float),
+        # the IIIF server's limit is separate from the API's, and is off unless AIC_IMAGE_REQUESTS_PER_SECOND is set
+        AIC_IMAGE_REQUESTS_PER_SECOND=get('AIC_IMAGE_REQUESTS_PER_SECOND', 0, float),
+        AIC_IMAGE_BURST=get('AIC_IMAGE_BURST', 100, float),
+
+        # images served by the /images route are kept on disk in IMAGE_CACHE_DIR, up to IMAGE_CACHE_MAX_MB
+        IMAGE_CACHE_DIR=get('IMAGE_CACHE_DIR', 'image_cache'),
+        IMAGE_CACHE_MAX_MB=get('IMAGE_CACHE_MAX_MB', 500, int),
+        # the width of the thumbnails on collection pages; showpages get the full width that display_url points to
+        IMAGE_THUMBNAIL_WIDTH=get('IMAGE_THUMBNAIL_WIDTH', 400, int),
+        # browsers are told they can keep the images served by the /images route for IMAGE_MAX_AGE seconds
+        IMAGE_MAX_AGE=get('IMAGE_MAX_AGE', 7 * 24 * 3600, int),
+
+        # search results from the API are shared by every user, in memory and in the api_responses table, for SEARCH_CACHE_TTL seconds
+        SEARCH_CACHE_TTL=get('SEARCH_CACHE_TTL', 3600, int),
+        SEARCH_CACHE_MEMORY_ENTRIES=get('SEARCH_CACHE_MEMORY_ENTRIES', 500, int),
+        SEARCH_CACHE_STORED_ENTRIES=get('SEARCH_CACHE_STORED_ENTRIES', 20000, int),
+        # with SEARCH_LOCAL_FIRST=1, a page of search results is answered from the artworks already stored locally when they can fill it,
+        # and only pages that the local index cannot fill are fetched from the API (see fill_search_page)
+        SEARCH_LOCAL_FIRST=flag('SEARCH_LOCAL_FIRST', False),
+        # each user keeps up to SEARCHES_PER_USER searches, so they can go back to an earlier search without fetching it again
+        # a search that has not been viewed for SEARCH_TTL seconds, or that is older than the user's most recent SEARCHES_PER_USER, is deleted with its pages
+        SEARCHES_PER_USER=get('SEARCHES_PER_USER', 10, int),
+        SEARCH_TTL=get('SEARCH_TTL', 24 * 3600, int),
+        # pages of search results, and the details of imported artworks, are each prefetched on PREFETCH_WORKERS threads, with at most PREFETCH_PER_USER in flight for each user
+        PREFETCH_ENABLED=flag('PREFETCH_ENABLED', True),
+        PREFETCH_PREVIOUS=flag('PREFETCH_PREVIOUS', False),
+        PREFETCH_WORKERS=get('PREFETCH_WORKERS', 4, int),
+        PREFETCH_PER_USER=get('PREFETCH_PER_USER', 2, int),
+        # concurrent requests for the same work wait up to SINGLE_FLIGHT_LEASE_SECONDS for a process that took it on and then died
+        SINGLE_FLIGHT_LEASE_SECONDS=get('SINGLE_FLIGHT_LEASE_SECONDS', 30, float),
+
+        # how many artworks are on a page of a collection
+        COLLECTION_PAGE_SIZE=get('COLLECTION_PAGE_SIZE', 24, int),
+        # the rendered details of up to ARTWORK_FRAGMENT_CACHE_ENTRIES artworks, which are the same on every user's showpages
+        ARTWORK_FRAGMENT_CACHE_ENTRIES=get('ARTWORK_FRAGMENT_CACHE_ENTRIES', 2000, int),
+        # how long the details fetched for an artwork (image url, artist, date and alt text) are used before they are fetched again
+        ARTWORK_DETAILS_TTL=get('ARTWORK_DETAILS_TTL', 7 * 24 * 3600, int),
+        # rows read from the database for each chunk of an export, and lines of an import written in each transaction (see collection_transfer.py)
+        COLLECTION_EXPORT_CHUNK_SIZE=get('COLLECTION_EXPORT_CHUNK_SIZE', 500, int),
+        COLLECTION_IMPORT_BATCH_SIZE=get('COLLECTION_IMPORT_BATCH_SIZE', 500, int),
+
+        # see passwords.py
+        PASSWORD_HASH_METHOD=get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+        PASSWORD_HASH_WORKERS=password_hash_workers,
+        PASSWORD_HASH_QUEUE=get('PASSWORD_HASH_QUEUE', max(password_hash_workers, 1) * 8, int),
+        PASSWORD_HASH_WAIT_SECONDS=get('PASSWORD_HASH_WAIT_SECONDS', 10, float),
+
+        # how many of the most recently collected artworks have their details rendered, and how many search results are loaded into memory, at startup
+        # set STARTUP_WARM_CACHES=0 to start with them empty
+        STARTUP_WARM_CACHES=flag('STARTUP_WARM_CACHES', True),
+        STARTUP_WARM_ARTWORKS=get('STARTUP_WARM_ARTWORKS', 500, int),
+        STARTUP_WARM_SEARCHES=get('STARTUP_WARM_SEARCHES', 500, int),
+    )
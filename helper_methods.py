@@ -1,195 +1,670 @@
-from flask import Flask, flash, redirect, render_template, request, session
-import os
+from flask import Flask, current_app, flash, g, has_app_context, has_request_context, redirect, request, session
 import sqlite3
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-db_path = os.getenv('DB_PATH')
-
-def get_db_connection():
-    conn = sqlite3.connect(db_path)
+import threading
+import time
+from aic_client import AICClient, CircuitBreaker, FairScheduler, UpstreamError, UpstreamThrottled, UpstreamUnavailable
+from cassettes import make_transport
+from api_cache import ResponseCache, normalize_search_key, normalize_search_term
+from image_cache import ImageCache
+from instrumentation import InstrumentedConnection, record_upstream_call
+from prefetch import Prefetcher
+from search_index import count_local_matches, search_local_artworks
+from page_cache import FragmentCache
+from passwords import PasswordHasher
+from single_flight import SingleFlight, delete_expired_leases
+from werkzeug.local import LocalProxy
+
+# The clients, schedulers and caches that the helpers below share are made for each app, from its settings (see config.py), by init_services,
+# which create_app calls, and are kept in app.extensions['services']. The names for them below stand for the current app's,
+# so that the helpers use them the same way whichever app they run in, and tests or workers can each have their own.
+
+def get_upstream_caller():
+    # the user and priority that a call to the Art Institute is queued under by the schedulers below:
+    # a call made while handling a request is for a page that the user is waiting on, and anything else, such as a prefetch, is background work
+    if has_request_context():
+        return session.get('user_id'), 'interactive'
+    return (g.get('upstream_user') if has_app_context() else None), 'background'
+
+def make_aic_transport(config):
+    # each client gets its own transport, since the API and the image server each have their own pool of connections
+    return make_transport(
+        config['AIC_TRANSPORT'],
+        config['AIC_CASSETTE_PATH'],
+        latency_ms=config['AIC_REPLAY_LATENCY_MS'],
+        error_rate=config['AIC_REPLAY_ERROR_RATE'],
+        pool_connections=config['AIC_POOL_SIZE'],
+        pool_maxsize=config['AIC_POOL_SIZE']
+    )
+
+def make_aic_client(config, base_url, scheduler, transport):
+    # a client that pools connections, times out, retries and trips its own circuit breaker (see aic_client.py)
+    return AICClient(
+        base_url,
+        connect_timeout=config['AIC_CONNECT_TIMEOUT'],
+        read_timeout=config['AIC_READ_TIMEOUT'],
+        max_retries=config['AIC_MAX_RETRIES'],
+        backoff_seconds=config['AIC_BACKOFF_SECONDS'],
+        pool_size=config['AIC_POOL_SIZE'],
+        breaker=CircuitBreaker(config['AIC_BREAKER_FAILURES'], config['AIC_BREAKER_RESET_SECONDS']),
+        on_request=record_upstream_call,
+        scheduler=scheduler,
+        transport=transport
+    )
+
+def init_services(app):
+    # make the app's services from its settings; nothing here opens a connection or starts a thread, so it can be done before forking workers
+    config = app.config
+    services = app.extensions['services'] = {}
+    max_wait_seconds = {'interactive': config['AIC_MAX_WAIT_INTERACTIVE'], 'background': config['AIC_MAX_WAIT_BACKGROUND']}
+
+    services['aic_scheduler'] = FairScheduler('api', config['AIC_REQUESTS_PER_SECOND'], config['AIC_BURST'], max_wait_seconds, get_caller=get_upstream_caller)
+    services['image_scheduler'] = FairScheduler('iiif', config['AIC_IMAGE_REQUESTS_PER_SECOND'], config['AIC_IMAGE_BURST'], max_wait_seconds, get_caller=get_upstream_caller)
+    services['api_transport'] = make_aic_transport(config)
+    services['image_transport'] = make_aic_transport(config)
+    # every call to the API goes through aic_client
+    services['aic_client'] = make_aic_client(config, config['AIC_API_URL'], services['aic_scheduler'], services['api_transport'])
+    # images are fetched from the Art Institute's IIIF server, which is a different service from the API, so it gets its own circuit breaker
+    # display_url is already a full url, so the client has no base url
+    services['image_client'] = make_aic_client(config, '', services['image_scheduler'], services['image_transport'])
+
+    # the widths that images are served at by the /images route: small ones for the tiles on collection pages, and the full width that display_url points to for showpages
+    services['image_widths'] = {'thumbnail': config['IMAGE_THUMBNAIL_WIDTH'], 'full': 843}
+    services['artwork_fragments'] = FragmentCache(config['ARTWORK_FRAGMENT_CACHE_ENTRIES'])
+
+    # concurrent requests for the same page of search results, artwork details or image share one fetch and one write, across threads and across processes
+    services['single_flight'] = SingleFlight(get_db_connection, lease_seconds=config['SINGLE_FLIGHT_LEASE_SECONDS'])
+    services['image_cache'] = ImageCache(config['IMAGE_CACHE_DIR'], max_bytes=config['IMAGE_CACHE_MAX_MB'] * 1024 * 1024, flight=services['single_flight'])
+    # search results from the API are shared by every user, so a popular search only has to be fetched once until it expires
+    services['search_cache'] = ResponseCache(
+        get_db_connection,
+        ttl_seconds=config['SEARCH_CACHE_TTL'],
+        max_memory_entries=config['SEARCH_CACHE_MEMORY_ENTRIES'],
+        max_stored_entries=config['SEARCH_CACHE_STORED_ENTRIES']
+    )
+    # pages of search results are prefetched on a small pool of threads, with at most a couple in flight per user
+    services['search_prefetcher'] = Prefetcher(prefetch_search_page, max_workers=config['PREFETCH_WORKERS'], per_user_limit=config['PREFETCH_PER_USER'])
+    # the details of artworks that a user imported are fetched after the import has been answered, on a pool of their own so that they never hold up the user's next page
+    services['artwork_prefetcher'] = Prefetcher(prefetch_artwork_details, max_workers=config['PREFETCH_WORKERS'], per_user_limit=config['PREFETCH_PER_USER'])
+    services['password_hasher'] = PasswordHasher(config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_WORKERS'], config['PASSWORD_HASH_QUEUE'], config['PASSWORD_HASH_WAIT_SECONDS'])
+    return services
+
+def service(name):
+    # the current app's service called name
+    return LocalProxy(lambda: current_app.extensions['services'][name])
+
+aic_scheduler = service('aic_scheduler')
+image_scheduler = service('image_scheduler')
+api_transport = service('api_transport')
+image_transport = service('image_transport')
+aic_client = service('aic_client')
+image_client = service('image_client')
+image_widths = service('image_widths')
+artwork_fragments = service('artwork_fragments')
+single_flight = service('single_flight')
+image_cache = service('image_cache')
+search_cache = service('search_cache')
+search_prefetcher = service('search_prefetcher')
+artwork_prefetcher = service('artwork_prefetcher')
+password_hasher = service('password_hasher')
+
+# only ask the API for the fields that we store, instead of downloading every field of every artwork
+artwork_fields = 'id,title,image_id,artist_display,date_display,thumbnail'
+
+# how many artworks are on a page of search results; it is asked for explicitly so that pages filled from the local index are the same size as the API's
+search_page_size = 10
+
+# journal_mode is stored in the database file itself, so each database only needs to be switched to WAL once per process
+wal_enabled_paths = set()
+
+def open_db_connection(path, busy_timeout_ms=5000, cache_size_kib=16000):
+    # open a connection that is configured once when it is created instead of for every statement
+    # WAL lets readers keep reading while another request writes, and synchronous=NORMAL is safe with WAL while skipping an fsync on every commit
+    # busy_timeout_ms is how long it waits on a locked database before giving up, and cache_size_kib how much page cache it keeps (a negative cache_size is in KiB)
+    # statements are timed for the request they run in (see instrumentation.py)
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
+    if path not in wal_enabled_paths:
+        conn.execute("PRAGMA journal_mode = WAL")
+        wal_enabled_paths.add(path)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+    conn.execute(f"PRAGMA cache_size = -{cache_size_kib}")
     return conn
 
+def get_db_connection():
+    # share one connection for the whole request (or app context) instead of opening a new one for every statement
+    # it is closed in close_db_connection, which app.py registers with teardown_appcontext
+    # how many were opened is counted for the http_request_db_connections histogram (see instrumentation.py), which should only ever see one
+    if 'db' not in g:
+        config = current_app.config
+        g.db = open_db_connection(config['DB_PATH'], config['DB_BUSY_TIMEOUT_MS'], config['DB_CACHE_SIZE_KIB'])
+        g.db_connections_opened = g.get('db_connections_opened', 0) + 1
+    return g.db
+
+def close_db_connection(exception=None):
+    # close the request's connection; anything that was not committed is rolled back
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
 def get_items(search_term, page_number):
     # check whether we already stored the information for the requested page in the database
     conn = get_db_connection()
-    search_rows = conn.execute("SELECT * FROM searches WHERE name = ? AND user_id = ?", [search_term, session["user_id"]]).fetchall()
-    conn.commit()
-    conn.close()
 
+    if not search_page_is_stored(conn, session["user_id"], search_term, page_number):
+        # if we do not already have the requested page for the current search in the database, get it and save it
+        # the page may already be on its way from a background prefetch or from the user's other tab, in which case this waits for it instead
+        fill_search_page_once(conn, session["user_id"], search_term, page_number)
+        if not search_page_is_stored(conn, session["user_id"], search_term, page_number):
+            # the page that was waited for came from a prefetch that gave up, because the search was deleted while it ran
+            fill_search_page(conn, session["user_id"], search_term, page_number)
+
+    search = find_search(conn, session["user_id"], search_term)
+    artworks = get_artwork_for_search(search['id'], page_number)
+
+    return artworks
+
+def search_page_is_stored(conn, user_id, search_term, page_number):
+    # whether the page of the user's search has been saved, or the API was asked and had no results for the search, which has a page limit of 0 and no pages to save
+    # an empty search is then served from the database like any other until it expires, instead of being fetched again on every view
+    search_rows = conn.execute("SELECT searches.id FROM searches LEFT JOIN artwork_searches on artwork_searches.search_id = searches.id AND artwork_searches.current_page = ? WHERE searches.user_id = ? AND searches.normalized_name = ? AND (searches.page_limit = 0 OR artwork_searches.id IS NOT NULL) LIMIT 1", [page_number, user_id, normalize_search_term(search_term)]).fetchall()
+    return len(search_rows) > 0
+
+def find_search(conn, user_id, search_term):
+    # return the user's search for search_term, or None if they do not have one
+    return conn.execute("SELECT * FROM searches WHERE user_id = ? AND normalized_name = ?", [user_id, normalize_search_term(search_term)]).fetchone()
+
+def get_search(conn, user_id, search_id):
+    # return one of the user's searches by its id, or None if it has expired or belongs to another user
+    return conn.execute("SELECT * FROM searches WHERE id = ? AND user_id = ?", [search_id, user_id]).fetchone()
+
+def get_recent_searches(conn, user_id):
+    # the user's searches, most recently viewed first
+    return conn.execute("SELECT * FROM searches WHERE user_id = ? ORDER BY last_used_at DESC", [user_id]).fetchall()
+
+def start_search(search_term):
+    # return the current user's search for search_term, fetching its first page if they do not already have it
     conn = get_db_connection()
-    artwork_search_rows = conn.execute("SELECT * FROM artwork_searches JOIN searches on artwork_searches.search_id = searches.id WHERE searches.user_id = ? AND artwork_searches.current_page = ?", [session["user_id"], page_number]).fetchall()
-    conn.commit()
-    conn.close()
+    search = find_search(conn, session["user_id"], search_term)
+    if search is None:
+        get_items(search_term, 1)
+        search = find_search(conn, session["user_id"], search_term)
+        # a new search may push the user's oldest one out
+        expire_searches(conn, session["user_id"])
+    return search
+
+def use_search(conn, search):
+    # record that a search was viewed, so that it is the last of the user's searches to expire
+    # it is written at most once a minute per search rather than on every page view
+    now = time.time()
+    if now - search['last_used_at'] > 60:
+        conn.execute("UPDATE searches SET last_used_at = ? WHERE id = ?", [now, search['id']])
+        conn.commit()
 
-    if not len(search_rows) or not len(artwork_search_rows):
-        # if we do not already have the requested page for the current search in the database, make a fetch to the API
-        response = requests.get(f'https://api.artic.edu/api/v1/artworks/search?q={search_term}&query[term][is_public_domain]=true&page={page_number}')
+def fill_search_page_once(conn, user_id, search_term, page_number, only_if_search_exists=False):
+    # fill_search_page, unless the same page of the same user's search is already being filled, in which case wait for that instead
+    single_flight.do(
+        f'search-page:{user_id}:{normalize_search_key(search_term, page_number)}',
+        lambda: fill_search_page(conn, user_id, search_term, page_number, only_if_search_exists),
+        lambda: search_page_is_stored(conn, user_id, search_term, page_number) or None
+    )
+
+def fill_search_page(conn, user_id, search_term, page_number, only_if_search_exists=False):
+    # save a page of a user's search, from the local full-text index if local-first search is on and it can fill the page, otherwise from the API
+    if current_app.config['SEARCH_LOCAL_FIRST'] and save_local_search_page(conn, user_id, search_term, page_number, only_if_search_exists):
+        return
 
-        if response.status_code != 200:
-            #render an error message if we could not get the requested page
-            return render_template("error_message", message="There was an error retrieving that page")
-
-        artworks = response.json()['data']
-
-        # if a page number higher than 100 is requested, the Art Institute responds with a 403 status code, so reset the page limit accordingly
-        if response.json()['pagination']['total_pages'] > 100:
-            total_pages = 100
-        else:
-            total_pages = response.json()['pagination']['total_pages']
-
-        # if there is not already a search stored with the current search term, save the current search
-        # it is not saved long-term but is stored while the user is performing a search in order to minimize the number of fetches made and help with navigation between pages
-        if not len(search_rows):
-            conn = get_db_connection()
-            conn.execute(
-                "INSERT INTO searches (user_id, name, page_limit) VALUES(?, ?, ?)",
-                [session["user_id"],
-                search_term,
-                total_pages
-                ]
-            ).fetchall()
-            conn.commit()
-            conn.close()
-
-        conn = get_db_connection()
-        search_rows = conn.execute("SELECT * FROM searches WHERE name = ? AND user_id = ?", [search_term, session["user_id"]]).fetchall()
+    try:
+        payload = fetch_search_page(search_term, page_number)
+    except UpstreamUnavailable:
+        # while the API is down, a page with whatever matches are stored locally is better than an error
+        if current_app.config['SEARCH_LOCAL_FIRST'] and save_local_search_page(conn, user_id, search_term, page_number, only_if_search_exists, allow_partial=True):
+            return
+        raise
+
+    save_search_page(conn, user_id, search_term, page_number, payload, only_if_search_exists)
+
+def fetch_search_page(search_term, page_number):
+    # return the API's response for a page of search results
+    # check whether any user has fetched it recently; otherwise make a fetch to the API
+    # a popular search that many users start at once is only fetched by one of them
+    cache_key = normalize_search_key(search_term, page_number)
+    payload = search_cache.get(cache_key)
+
+    if payload is None:
+        payload = single_flight.do(f'search:{cache_key}', lambda: fetch_search_payload(search_term, page_number, cache_key), lambda: search_cache.get(cache_key))
+
+    return payload
+
+def fetch_search_payload(search_term, page_number, cache_key):
+    # the search asks for the same fields as the artwork detail endpoint, so the results arrive with everything the showpages need
+    try:
+        response = aic_client.get('/artworks/search', params={'q': search_term, 'query[term][is_public_domain]': 'true', 'page': page_number, 'limit': search_page_size, 'fields': artwork_fields}, endpoint='search')
+    except UpstreamUnavailable:
+        # while the API is down, an expired copy of the page is better than an error; without one, app.py renders an error page
+        payload = search_cache.get_stale(cache_key)
+        if payload is None:
+            raise
+        return payload
+
+    if response.status_code != 200:
+        #render an error message if we could not get the requested page
+        raise UpstreamError("There was an error retrieving that page")
+
+    payload = response.json()
+    search_cache.set(cache_key, payload)
+    get_db_connection().commit()
+    return payload
+
+def save_search_page(conn, user_id, search_term, page_number, payload, only_if_search_exists=False):
+    # save a page of search results for a user
+    # the search and the whole page of artworks are written in one transaction, so there is a single commit per page instead of one per row
+    # BEGIN IMMEDIATE takes the write lock before the search is looked up, so a search that expires in the meantime cannot be written to
+    artworks = payload['data']
+
+    # if a page number higher than 100 is requested, the Art Institute responds with a 403 status code, so reset the page limit accordingly
+    if payload['pagination']['total_pages'] > 100:
+        total_pages = 100
+    else:
+        total_pages = payload['pagination']['total_pages']
+
+    conn.execute("BEGIN IMMEDIATE")
+    search_rows = conn.execute("SELECT * FROM searches WHERE user_id = ? AND normalized_name = ?", [user_id, normalize_search_term(search_term)]).fetchall()
+
+    # if there is not already a search stored with the current search term, save the current search
+    # it is not saved long-term, but is kept for a while so that the user can page through it and come back to it without fetching the pages again
+    if not len(search_rows):
+        if only_if_search_exists:
+            # a prefetch for a search the user has since left
+            conn.rollback()
+            return
+
+        search_id = conn.execute(
+            "INSERT INTO searches (user_id, name, normalized_name, page_limit, last_used_at) VALUES(?, ?, ?, ?, ?)",
+            [user_id,
+            search_term,
+            normalize_search_term(search_term),
+            total_pages,
+            time.time()
+            ]
+        ).lastrowid
+    else:
         search_id = search_rows[0]['id']
-        conn.commit()
-        conn.close()
+        if search_rows[0]['page_limit'] != total_pages:
+            # a search that started from the local index only knew how many pages it could fill locally
+            conn.execute("UPDATE searches SET page_limit = ? WHERE id = ?", [total_pages, search_id])
 
-        print(artworks)
-
-
-        # set properties of the artwork for display purposes
-        for artwork in artworks:
-            title = artwork['title']
-            artwork_id = artwork['id']
-            image_url = f'https://www.artic.edu/artworks/{artwork_id}'
-
-            conn = get_db_connection()
-            artwork_rows = conn.execute("SELECT * FROM artworks WHERE artwork_id = ?", [artwork_id]).fetchall()
-            conn.commit()
-            conn.close()
-
-            # if this artwork does not already exist in the database, create a new row for it
-            if not len(artwork_rows):
-                conn = get_db_connection()
-                conn.execute(
-                    "INSERT INTO artworks (title, artwork_id, art_institute_url) VALUES(?, ?, ?)",
-                    [title,
-                    artwork_id,
-                    image_url
-                    ]
-                ).fetchall()
-                conn.commit()
-                conn.close()
-
-
-            conn = get_db_connection()
-            artwork_searches = conn.execute("SELECT * FROM artwork_searches WHERE current_page = ? AND artwork_id = ? AND search_id = ?", [page_number, artwork_id, search_id]).fetchall()
-            conn.commit()
-            conn.close()
-
-            # also create a new artwork_search; this saves the current page number that the artwork belongs to for this user's search
-            # it is used to help with paginating the results
-            if not len(artwork_searches):
-                conn = get_db_connection()
-                conn.execute(
-                    "INSERT INTO artwork_searches (current_page, search_id, artwork_id) VALUES(?, ?, ?)",
-                    [page_number,
-                    search_id,
-                    artwork_id
-                    ]
-                ).fetchall()
-                conn.commit()
-                conn.close()
-
-    artworks = get_artwork_for_search(page_number)
+    store_search_page(conn, search_id, page_number, artworks, (payload.get('config') or {}).get('iiif_url'))
+    conn.commit()
 
-    return artworks
+    # a response cached before the search asked for the detail fields will not have them, so fetch whatever is missing in one batch
+    hydrate_artworks([artwork['id'] for artwork in artworks])
+
+def save_local_search_page(conn, user_id, search_term, page_number, only_if_search_exists=False, allow_partial=False):
+    # save a page of a user's search from the artworks that are stored locally, ranked by how well they match
+    # returns False without saving anything if there are not enough matches to fill the page, unless allow_partial is set and there is at least one
+    # a page is made of the best matches that are not already on another page of the search, so visiting the pages in any order never repeats an artwork
+    conn.execute("BEGIN IMMEDIATE")
+    search_rows = conn.execute("SELECT * FROM searches WHERE user_id = ? AND normalized_name = ?", [user_id, normalize_search_term(search_term)]).fetchall()
+    if not len(search_rows) and only_if_search_exists:
+        conn.rollback()
+        return False
+
+    search_id = search_rows[0]['id'] if len(search_rows) else None
+    artworks = search_local_artworks(conn, search_term, search_page_size, exclude_search_id=search_id)
+    if not artworks or (len(artworks) < search_page_size and not allow_partial):
+        conn.rollback()
+        return False
+
+    if search_id is None:
+        # there is always one page more than the local index can fill, and that page comes from the API, which sets the real page limit
+        page_limit = min(count_local_matches(conn, search_term) // search_page_size + 1, 100)
+        search_id = conn.execute(
+            "INSERT INTO searches (user_id, name, normalized_name, page_limit, last_used_at) VALUES(?, ?, ?, ?, ?)",
+            [user_id, search_term, normalize_search_term(search_term), page_limit, time.time()]
+        ).lastrowid
+
+    conn.executemany(
+        "INSERT INTO artwork_searches (current_page, search_id, artwork_id) VALUES(?, ?, ?) ON CONFLICT (search_id, current_page, artwork_id) DO NOTHING",
+        [[page_number, search_id, artwork['artwork_id']] for artwork in artworks]
+    )
+    conn.commit()
+    return True
+
+def prefetch_search_page(user_id, search_term, page_number):
+    # fetch and save a page of a user's search in the background, so that paging to it is served from the database
+    conn = get_db_connection()
+    if search_page_is_stored(conn, user_id, search_term, page_number):
+        return
+
+    # the user's prefetches take turns with other users' under the rate limit
+    g.upstream_user = user_id
+    try:
+        fill_search_page_once(conn, user_id, search_term, page_number, only_if_search_exists=True)
+    except UpstreamThrottled:
+        # the API is busy with pages that users are waiting on; the page is fetched when the user gets to it instead
+        pass
+
+def prefetch_adjacent_pages(search_term, page_number, page_limit):
+    # after serving a page of results, warm the next page (and the previous one if PREFETCH_PREVIOUS is set) in the background
+    if not current_app.config['PREFETCH_ENABLED']:
+        return
+
+    page_number = int(page_number)
+    page_numbers = [page_number + 1]
+    if current_app.config['PREFETCH_PREVIOUS']:
+        page_numbers.append(page_number - 1)
+
+    for adjacent_page in page_numbers:
+        if 1 <= adjacent_page <= page_limit:
+            search_prefetcher.submit(session["user_id"], normalize_search_key(search_term, adjacent_page), search_term, adjacent_page)
+
+def store_search_page(conn, search_id, page_number, artworks, iiif_url=None):
+    # set properties of the artwork for display purposes and save a page of search results with one statement per table
+    # rows that are already stored are skipped by the unique indexes added in migrations.py, so there is no need to check for them first
+    # the caller commits, so that the page is saved in the same transaction as the search it belongs to
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO artworks (title, artwork_id, art_institute_url, alt_text, display_url, artist_info, date_info, details_fetched_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (artwork_id) DO NOTHING",
+        [[artwork['title'],
+        artwork['id'],
+        f'https://www.artic.edu/artworks/{artwork["id"]}',
+        *get_artwork_details(artwork, iiif_url),
+        # artworks from a search that did not ask for the detail fields still need them fetched
+        now if 'artist_display' in artwork else None
+        ] for artwork in artworks]
+    )
+
+    # also create a new artwork_search for each artwork; this saves the current page number that the artwork belongs to for this user's search
+    # it is used to help with paginating the results
+    conn.executemany(
+        "INSERT INTO artwork_searches (current_page, search_id, artwork_id) VALUES(?, ?, ?) ON CONFLICT (search_id, current_page, artwork_id) DO NOTHING",
+        [[page_number,
+        search_id,
+        artwork['id']
+        ] for artwork in artworks]
+    )
 
 def get_image_url(artwork_id):
     # make a fetch to get more information about a particular artwork
     # this is used for display on the artwork showpages when a user clicks on a title in the search results
     # or it is used for display when a work of art is saved to a collection and its showpage is viewed within a user's collection
-    response = requests.get(f'https://api.artic.edu/api/v1/artworks/{artwork_id}')
+    # the fetch is skipped if the details were already fetched recently, for example because they came with the search results
+    # many users opening the same popular artwork at once share one fetch
+    conn = get_db_connection()
+    if not get_stale_artwork_ids(conn, [artwork_id]):
+        return
+
+    single_flight.do(f'artwork:{artwork_id}', lambda: fetch_artwork_details(conn, artwork_id), lambda: None if get_stale_artwork_ids(conn, [artwork_id]) else True)
+
+def fetch_artwork_details(conn, artwork_id):
+    try:
+        response = aic_client.get(f'/artworks/{artwork_id}', params={'fields': artwork_fields}, endpoint='artwork')
+    except UpstreamUnavailable:
+        # the showpage still renders with whatever is already stored for the artwork
+        return
 
     if response.status_code != 200:
         return
 
-    image_id = response.json()['data']['image_id']
+    payload = response.json()
 
-    if response.json()['config']:
-        iiif_url = response.json()['config']['iiif_url']
+    # add the additional information that was fetched and the image url for displaying the image to the row for the artwork
+    save_artwork_details(conn, [payload['data']], (payload.get('config') or {}).get('iiif_url'))
+    conn.commit()
 
-    artist_info = response.json()['data']['artist_display']
-    date_info = response.json()['data']['date_display']
+    return
+
+def hydrate_artworks(artwork_ids):
+    # fetch the details for many artworks at once with the API's multi-id endpoint, instead of one request per artwork
+    # only the artworks whose details are missing or out of date are requested
+    conn = get_db_connection()
+    artwork_ids = get_stale_artwork_ids(conn, artwork_ids)
 
-    if response.json()['data']['thumbnail']:
-        alt_text = response.json()['data']['thumbnail']['alt_text']
+    # the API returns at most 100 artworks per request
+    for start in range(0, len(artwork_ids), 100):
+        batch = artwork_ids[start:start + 100]
+        try:
+            # filling in details is never what a page is waiting on first, so it gives way to the calls that are
+            response = aic_client.get('/artworks', params={'ids': ','.join(str(artwork_id) for artwork_id in batch), 'fields': artwork_fields, 'limit': len(batch)}, endpoint='artworks', priority='background')
+        except UpstreamUnavailable:
+            return
 
+        if response.status_code != 200:
+            return
+
+        payload = response.json()
+        save_artwork_details(conn, payload['data'], (payload.get('config') or {}).get('iiif_url'))
+        conn.commit()
+
+def prefetch_artwork_details(user_id, artwork_ids):
+    # fetch the details of artworks a user added in the background; their collection pages show what is stored until then
+    g.upstream_user = user_id
+    hydrate_artworks(artwork_ids)
+
+def get_stale_artwork_ids(conn, artwork_ids):
+    # return the ids, out of the ones given, of the stored artworks whose details have not been fetched or have expired
+    # artworks imported from the catalog are refreshed by importing it again rather than by fetching them one at a time
+    artwork_ids = list(set(artwork_ids))
+    if not artwork_ids:
+        return []
+
+    placeholders = ', '.join('?' for artwork_id in artwork_ids)
+    rows = conn.execute(
+        f"SELECT artwork_id FROM artworks WHERE artwork_id IN ({placeholders}) AND catalog_imported_at IS NULL AND (details_fetched_at IS NULL OR details_fetched_at < ?)",
+        [*artwork_ids, time.time() - current_app.config['ARTWORK_DETAILS_TTL']]
+    ).fetchall()
+    return [row['artwork_id'] for row in rows]
+
+def get_artwork_details(artwork, iiif_url):
+    # build the values for the alt_text, display_url, artist_info and date_info columns from an artwork returned by the API
+    if artwork.get('thumbnail'):
+        alt_text = artwork['thumbnail'].get('alt_text')
     else:
         alt_text = None
 
-    if iiif_url and image_id:
-        full_url = iiif_url + '/' + image_id + '/full/843,/0/default.jpg'
+    if iiif_url and artwork.get('image_id'):
+        full_url = iiif_url + '/' + artwork['image_id'] + '/full/843,/0/default.jpg'
     else:
         full_url = None
 
-    # add the additional information that was fetched and the image url for displaying the image to the row for the artwork
-    conn = get_db_connection()
-    rows = conn.execute(
-            "UPDATE artworks SET alt_text = (?), display_url = (?), artist_info = (?), date_info = (?) WHERE artwork_id = (?)",
-            [alt_text,
-            full_url,
-            artist_info,
-            date_info,
-            artwork_id
-            ]
-        ).fetchall()
-    conn.commit()
-    conn.close()
-
-    return
-
-def get_artwork_for_search(page_number):
-    # return all of the works of art in the database that are associated with the user's current search
-    conn = get_db_connection()
-    search_rows = conn.execute("SELECT * FROM searches WHERE user_id = ?", [session["user_id"]]).fetchall()
-    conn.commit()
-    conn.close()
-    id_of_search = search_rows[0]['id']
+    return [alt_text, full_url, artwork.get('artist_display'), artwork.get('date_display')]
+
+def save_artwork_details(conn, artworks, iiif_url):
+    # store the details fetched for artworks and when they were fetched; the caller commits
+    # the title is stored again as well, since an artwork imported from a user's file (see collection_transfer.py) only has the title the file gave it
+    now = time.time()
+    conn.executemany(
+        "UPDATE artworks SET title = COALESCE(?, title), alt_text = (?), display_url = (?), artist_info = (?), date_info = (?), details_fetched_at = (?) WHERE artwork_id = (?)",
+        [[artwork.get('title'),
+        *get_artwork_details(artwork, iiif_url),
+        now,
+        artwork['id']
+        ] for artwork in artworks]
+    )
+
+def get_image_rendition_url(display_url, rendition):
+    # display_url asks the IIIF server for the image at 843 pixels wide; ask for the rendition's width instead
+    return display_url.replace('/full/843,/', f'/full/{image_widths[rendition]},/')
+
+def get_artwork_image(display_url, rendition):
+    # return (path, etag) for a rendition of an artwork's image from the image cache, downloading it if it is not cached
+    # returns None if the IIIF server could not provide it
+    return image_cache.get(get_image_rendition_url(display_url, rendition), download_image)
+
+def download_image(url, file):
+    # stream an image from the IIIF server into file, so the whole image is never held in memory
+    try:
+        response = image_client.get(url, endpoint='image', stream=True)
+    except UpstreamUnavailable:
+        return False
+
+    with response:
+        if response.status_code != 200:
+            return False
+        for chunk in response.iter_content(64 * 1024):
+            file.write(chunk)
+    return True
 
+def get_artwork_for_search(search_id, page_number):
+    # return all of the works of art in the database that are on a page of one of the user's searches
     conn = get_db_connection()
-    artwork_rows = conn.execute("SELECT * FROM artworks JOIN artwork_searches on artwork_searches.artwork_id = artworks.artwork_id WHERE artwork_searches.search_id = ? AND artwork_searches.current_page = ?", [id_of_search, page_number]).fetchall()
-    conn.commit()
-    conn.close()
+    artwork_rows = conn.execute("SELECT * FROM artworks JOIN artwork_searches on artwork_searches.artwork_id = artworks.artwork_id WHERE artwork_searches.search_id = ? AND artwork_searches.current_page = ?", [search_id, page_number]).fetchall()
     return artwork_rows
 
-def clear_search():
-    # clear the database of the user's last search
-    conn = get_db_connection()
-    search_rows = conn.execute("SELECT * FROM searches WHERE user_id = ?", [session["user_id"]]).fetchall()
-    conn.commit()
-    conn.close()
-
-    if len(search_rows):
-        search_id = search_rows[0]['id']
-        conn = get_db_connection()
-        conn.execute("DELETE FROM artwork_searches WHERE search_id = ?", [search_id]).fetchall()
-        conn.commit()
-        conn.close()
-
-        conn = get_db_connection()
-        conn.execute("DELETE FROM searches WHERE user_id = ?", [session["user_id"]]).fetchall()
-        conn.commit()
-        conn.close()
-        # delete artworks that are neither in a current search nor in a collection
+def get_collection_page(conn, user_id, collection_id, after=None, before=None):
+    # return one page of a user's collection as a dict of its title, its number of artworks, the page's artworks, whether there is an earlier page and a later one,
+    # and the collection's version and modification time, or None if the user has no such collection
+    # pages are keyed on collected_works.id rather than numbered with an OFFSET: the page after the one that ended with id n is the next artworks with an id above n,
+    # and the page before the one that started with id n is the artworks just below it, so every page is one seek on the collected_works index however deep it is
+    # the collection's title, its size and the page's artworks come back from one query, with only the columns that the page shows
+    # one row more than a page is asked for, to tell whether there is another page in the direction of travel
+    page_size = current_app.config['COLLECTION_PAGE_SIZE']
+    if before is not None:
+        rows = conn.execute(
+            "SELECT collections.title AS collection_title, collections.version AS collection_version, collections.updated_at AS collection_updated_at, (SELECT COUNT(*) FROM collected_works WHERE collected_works.user_id = collections.user_id AND collected_works.collection_id = collections.id) AS artwork_count, "
+            "page.id AS collected_work_id, page.artwork_id, artworks.title, artworks.alt_text, artworks.details_fetched_at, artworks.version, artworks.updated_at "
+            "FROM collections LEFT JOIN (SELECT id, artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ? AND id < ? ORDER BY id DESC LIMIT ?) AS page ON 1 LEFT JOIN artworks ON artworks.artwork_id = page.artwork_id "
+            "WHERE collections.id = ? AND collections.user_id = ? ORDER BY page.id DESC",
+            [user_id, collection_id, before, page_size + 1, collection_id, user_id]
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT collections.title AS collection_title, collections.version AS collection_version, collections.updated_at AS collection_updated_at, (SELECT COUNT(*) FROM collected_works WHERE collected_works.user_id = collections.user_id AND collected_works.collection_id = collections.id) AS artwork_count, "
+            "page.id AS collected_work_id, page.artwork_id, artworks.title, artworks.alt_text, artworks.details_fetched_at, artworks.version, artworks.updated_at "
+            "FROM collections LEFT JOIN (SELECT id, artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ? AND id > ? ORDER BY id LIMIT ?) AS page ON 1 LEFT JOIN artworks ON artworks.artwork_id = page.artwork_id "
+            "WHERE collections.id = ? AND collections.user_id = ? ORDER BY page.id",
+            [user_id, collection_id, after or 0, page_size + 1, collection_id, user_id]
+        ).fetchall()
+    if not rows:
+        return None
+
+    # an empty collection, or a page past its end, comes back as a single row with only the title and count
+    artworks = [row for row in rows if row['collected_work_id'] is not None]
+    more = len(artworks) > page_size
+    artworks = artworks[:page_size]
+    if before is not None:
+        artworks.reverse()
+        has_previous, has_next = more, True
+    else:
+        has_previous, has_next = bool(after), more
+    return {
+        'title': rows[0]['collection_title'],
+        'artwork_count': rows[0]['artwork_count'],
+        'artworks': artworks,
+        'has_previous': has_previous,
+        'has_next': has_next,
+        'version': rows[0]['collection_version'],
+        'updated_at': rows[0]['collection_updated_at'],
+    }
+
+# The bulk collection operations below each change any number of artworks with one statement, relying on the unique index on collected_works (collection_id, artwork_id)
+# to skip the artworks that a collection already has. They only touch the user's own collections, which the route checks with get_user_collection,
+# and the caller commits, so that an operation made of several of them (such as a move) happens all at once or not at all.
+
+def get_user_collection(conn, user_id, collection_id):
+    # one of the user's collections, or None if they have no collection with that id
+    return conn.execute("SELECT * FROM collections WHERE id = ? AND user_id = ?", [collection_id, user_id]).fetchone()
+
+def find_or_create_collection(conn, user_id, title):
+    # the id of the user's collection with this title, which is created if they do not have one yet
+    collection = conn.execute("SELECT id FROM collections WHERE user_id = ? AND title = ?", [user_id, title]).fetchone()
+    if collection is not None:
+        return collection['id']
+    return conn.execute("INSERT INTO collections (title, user_id) VALUES(?, ?)", [title, user_id]).lastrowid
+
+def add_artworks_to_collection(conn, user_id, collection_id, artwork_ids):
+    # add stored artworks to a collection in the order given; returns how many were not already in it
+    return conn.executemany(
+        "INSERT INTO collected_works (collection_id, user_id, artwork_id) SELECT ?, ?, artwork_id FROM artworks WHERE artwork_id = ? ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+        [[collection_id, user_id, artwork_id] for artwork_id in dict.fromkeys(artwork_ids)]
+    ).rowcount
+
+def add_search_page_to_collection(conn, user_id, collection_id, search_id, page_number):
+    # add every artwork on a page of one of the user's searches to a collection; returns how many were not already in it
+    return conn.execute(
+        "INSERT INTO collected_works (collection_id, user_id, artwork_id) SELECT ?, ?, artwork_id FROM artwork_searches WHERE search_id = ? AND current_page = ? ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+        [collection_id, user_id, search_id, page_number]
+    ).rowcount
+
+def copy_collection(conn, user_id, source_id, target_id):
+    # add every artwork in one of the user's collections to another, in the order they were added to the first; returns how many were not already in it
+    return conn.execute(
+        "INSERT INTO collected_works (collection_id, user_id, artwork_id) SELECT ?, user_id, artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ? ORDER BY id ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+        [target_id, user_id, source_id]
+    ).rowcount
+
+def remove_artworks_from_collection(conn, user_id, collection_id, artwork_ids):
+    # remove artworks from a collection, along with the ones that are then in no other collection or search; returns how many were removed
+    removed = conn.executemany(
+        "DELETE from collected_works WHERE artwork_id = ? AND collection_id = ? AND user_id = ?",
+        [[artwork_id, collection_id, user_id] for artwork_id in set(artwork_ids)]
+    ).rowcount
+    delete_orphaned_artworks(conn, artwork_ids)
+    return removed
+
+def delete_user_collection(conn, user_id, collection_id):
+    # delete a collection, along with its artworks that are in no other collection or search
+    artwork_rows = conn.execute("SELECT artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ?", [user_id, collection_id]).fetchall()
+    conn.execute("DELETE FROM collected_works WHERE user_id = ? AND collection_id = ?", [user_id, collection_id])
+    conn.execute("DELETE FROM collections WHERE id = ? AND user_id = ?", [collection_id, user_id])
+    delete_orphaned_artworks(conn, [row['artwork_id'] for row in artwork_rows])
+
+def delete_searches(conn, search_ids):
+    # delete searches and their pages, along with the artworks from them that are neither in another current search nor in a collection; the caller commits
+    for search_id in search_ids:
+        artwork_rows = conn.execute("SELECT artwork_id FROM artwork_searches WHERE search_id = ?", [search_id]).fetchall()
+        conn.execute("DELETE FROM artwork_searches WHERE search_id = ?", [search_id])
+        conn.execute("DELETE FROM searches WHERE id = ?", [search_id])
+        delete_orphaned_artworks(conn, [row['artwork_id'] for row in artwork_rows])
+
+def expire_searches(conn, user_id=None):
+    # delete the searches that have not been viewed for SEARCH_TTL seconds
+    # given a user, only their searches are checked, and the ones beyond their SEARCHES_PER_USER most recently viewed are deleted as well
+    # returns how many searches were deleted
+    cutoff = time.time() - current_app.config['SEARCH_TTL']
+    if user_id is None:
+        search_rows = conn.execute("SELECT id FROM searches WHERE last_used_at < ?", [cutoff]).fetchall()
+    else:
+        search_rows = conn.execute("SELECT id FROM searches WHERE user_id = ? ORDER BY last_used_at DESC", [user_id]).fetchall()
+        search_rows = search_rows[current_app.config['SEARCHES_PER_USER']:] + conn.execute("SELECT id FROM searches WHERE user_id = ? AND last_used_at < ?", [user_id, cutoff]).fetchall()
 
-        conn = get_db_connection()
-        conn.execute("DELETE FROM artworks WHERE artwork_id NOT IN (SELECT artwork_id FROM artwork_searches) AND artwork_id NOT IN (SELECT artwork_id FROM collected_works)").fetchall()
-        conn.commit()
-        conn.close()
+    search_ids = set(row['id'] for row in search_rows)
+    delete_searches(conn, search_ids)
+    conn.commit()
+    return len(search_ids)
+
+def delete_orphaned_artworks(conn, artwork_ids):
+    # delete the given artworks if they are neither in a current search nor in a collection, nor imported from the catalog
+    # only the artworks that the current operation touched are checked, so the cost depends on how many there are rather than on the size of the artworks table
+    # each check is an index lookup on artwork_searches.artwork_id and collected_works.artwork_id; the caller commits
+    conn.executemany(
+        "DELETE FROM artworks WHERE artwork_id = ? AND catalog_imported_at IS NULL AND NOT EXISTS (SELECT 1 FROM artwork_searches WHERE artwork_searches.artwork_id = artworks.artwork_id) AND NOT EXISTS (SELECT 1 FROM collected_works WHERE collected_works.artwork_id = artworks.artwork_id)",
+        [[artwork_id] for artwork_id in set(artwork_ids)]
+    )
+    artwork_fragments.invalidate(set(artwork_ids))
+
+def delete_all_orphaned_artworks(conn):
+    # sweep the whole artworks table for rows that are neither in a current search nor in a collection
+    # routes only clean up the artworks they touched, so this catches anything left behind, for example by a request that failed part of the way through
+    deleted = conn.execute("DELETE FROM artworks WHERE catalog_imported_at IS NULL AND NOT EXISTS (SELECT 1 FROM artwork_searches WHERE artwork_searches.artwork_id = artworks.artwork_id) AND NOT EXISTS (SELECT 1 FROM collected_works WHERE collected_works.artwork_id = artworks.artwork_id)").rowcount
+    conn.commit()
+    return deleted
+
+def start_orphan_sweep(app, interval_seconds):
+    # run expire_searches, delete_all_orphaned_artworks and delete_expired_leases every interval_seconds on a background thread
+    def sweep():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                with app.app_context():
+                    expired = expire_searches(get_db_connection())
+                    deleted = delete_all_orphaned_artworks(get_db_connection())
+                    delete_expired_leases(get_db_connection())
+                    app.logger.info("orphaned artwork sweep deleted %s expired searches and %s artworks", expired, deleted)
+            except sqlite3.Error:
+                app.logger.exception("orphaned artwork sweep failed")
+
+    thread = threading.Thread(target=sweep, name="orphan-sweep", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from single_flight import SingleFlight
+
+# A cache of downloaded images on disk, capped at max_bytes.
+# When a new image would take it over the cap, the least recently served images are deleted first.
+# Recency is kept in each file's modification time, which is bumped every time the file is served,
+# so the order survives a restart: the directory is read back in order of modification time when the cache is created.
+#
+# Concurrent requests for an image that is not cached yet are coalesced through a SingleFlight: the first one downloads it while the others wait for it,
+# so a page full of tiles that many users open at once only downloads each image once.
+# Given a SingleFlight with a database connection, this holds across every process that shares the directory as well (see single_flight.py).
+
+
+class ImageCache:
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024, flight=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.flight = flight or SingleFlight()
+        self.stats = Counter()
+
+        os.makedirs(directory, exist_ok=True)
+        self.files = OrderedDict()
+        self.total_bytes = 0
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.')]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            size = entry.stat().st_size
+            self.files[entry.name] = size
+            self.total_bytes += size
+
+    def get_name(self, url):
+        return hashlib.sha256(url.encode()).hexdigest()[:32] + '.jpg'
+
+    def get_etag(self, name):
+        # the image at a url does not change, so its name and size are enough to tell one cached image from another
+        return f'{name[:-4]}-{self.files.get(name, 0)}'
+
+    def lookup(self, name):
+        # return the path of a cached image and mark it as the most recently served, or None if it is not cached
+        with self.lock:
+            if name not in self.files:
+                return None
+            self.files.move_to_end(name)
+
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # another process sharing the directory evicted it
+            with self.lock:
+                self.forget(name)
+            return None
+        return path
+
+    def get(self, url, download):
+        # return (path, etag) for the image at url, calling download(url, file) to write it into the cache if it is not there yet
+        # download returns False if the image could not be fetched, in which case None is returned and nothing is cached
+        name = self.get_name(url)
+        path = self.lookup(name)
+        if path is not None:
+            self.stats['hits'] += 1
+            return path, self.get_etag(name)
+
+        downloaded = []
+
+        def fetch():
+            downloaded.append(name)
+            return self.download(name, url, download)
+
+        # another process sharing the directory may have downloaded it while this one waited for the lease
+        path = self.flight.do(f'image:{name}', fetch, lambda: self.lookup(name) or self.adopt(name))
+        self.stats['misses' if downloaded else 'coalesced'] += 1
+
+        if path is None:
+            return None
+        return path, self.get_etag(name)
+
+    def adopt(self, name):
+        # add an image that another process sharing the directory downloaded to this cache, returning its path, or None if it is not on disk
+        path = os.path.join(self.directory, name)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.forget(name)
+            self.files[name] = size
+            self.total_bytes += size
+        return path
+
+    def download(self, name, url, download):
+        # download into a temporary file and move it into place once it is complete, so a half-written image is never served
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix='.download-')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                if download(url, file) is False:
+                    os.remove(temporary_path)
+                    return None
+            path = os.path.join(self.directory, name)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        with self.lock:
+            self.forget(name)
+            self.files[name] = os.path.getsize(path)
+            self.total_bytes += self.files[name]
+            self.evict()
+        return path
+
+    def evict(self):
+        # delete the least recently served images until the cache is under its cap, always keeping the newest one; call with the lock held
+        while self.total_bytes > self.max_bytes and len(self.files) > 1:
+            name, size = self.files.popitem(last=False)
+            self.total_bytes -= size
+            self.stats['evictions'] += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def forget(self, name):
+        # call with the lock held
+        size = self.files.pop(name, None)
+        if size is not None:
+            self.total_bytes -= size
@@ -0,0 +1,135 @@
+import sqlite3
+import time
+from flask import g, has_app_context, request
+from metrics import Histogram
+
+# Records where the time goes in each request: the wall time of the request, how many database connections it opened (which should be one; see get_db_connection
+# in helper_methods.py), how many SQL statements it ran and how long they took, and how many calls it made to the Art Institute (API and images) and how long they took.
+# Each is observed into a histogram labelled by route, which the /metrics route exposes.
+#
+# SQL is timed by opening every database connection as an InstrumentedConnection (see open_db_connection in helper_methods.py),
+# and upstream calls by AICClient's on_request hook. Work done outside a request, such as a background prefetch, is not counted.
+#
+# With SLOW_REQUEST_MS set, any request that takes at least that long is logged with every SQL statement it ran and how long each one took.
+
+request_duration = Histogram('http_request_duration_seconds', "Time taken to handle each request.", ['route', 'method', 'status'])
+request_db_connections = Histogram('http_request_db_connections', "Database connections opened while handling each request.", ['route'], buckets=(0, 1, 2, 5))
+request_sql_statements = Histogram('http_request_sql_statements', "SQL statements run while handling each request.", ['route'], buckets=(1, 2, 5, 10, 20, 50, 100, 250))
+request_sql_seconds = Histogram('http_request_sql_seconds', "Time spent running SQL statements while handling each request.", ['route'])
+request_upstream_calls = Histogram('http_request_upstream_calls', "Calls made to the Art Institute while handling each request.", ['route'], buckets=(0, 1, 2, 5, 10, 25))
+request_upstream_seconds = Histogram('http_request_upstream_seconds', "Time spent waiting on the Art Institute while handling each request.", ['route'])
+
+request_histograms = [request_duration, request_db_connections, request_sql_statements, request_sql_seconds, request_upstream_calls, request_upstream_seconds]
+
+# the most statements a slow request log lists
+slow_request_max_statements = 100
+
+
+class RequestStats:
+    def __init__(self, keep_statements=False):
+        self.start = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        # set once the response is made; a request that raised is recorded as a 500
+        self.status_code = 500
+        # (seconds, sql) for each statement; only kept when slow requests are logged
+        self.statements = [] if keep_statements else None
+
+
+def get_request_stats():
+    # the stats of the request being handled, or None outside a request
+    if not has_app_context():
+        return None
+    return g.get('request_stats')
+
+
+def record_sql(sql, seconds):
+    stats = get_request_stats()
+    if stats is None:
+        return
+    stats.sql_statements += 1
+    stats.sql_seconds += seconds
+    if stats.statements is not None and len(stats.statements) < slow_request_max_statements:
+        stats.statements.append((seconds, sql))
+
+
+def record_upstream_call(endpoint, seconds):
+    # AICClient's on_request hook
+    stats = get_request_stats()
+    if stats is None:
+        return
+    stats.upstream_calls += 1
+    stats.upstream_seconds += seconds
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # a connection that adds each statement, and the time it took, to the current request's stats
+    # for a query, the time is that of running it up to its first row; reading the rest of the rows afterwards is not included
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_sql(sql, time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_sql('COMMIT', time.perf_counter() - start)
+
+
+def init_instrumentation(app, slow_request_ms=None):
+    # register the hooks that time every request on app; slow_request_ms turns on the slow request log
+    slow_request_seconds = slow_request_ms / 1000 if slow_request_ms else None
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats(keep_statements=slow_request_seconds is not None)
+
+    @app.after_request
+    def add_server_timing(response):
+        # the numbers so far for the browser's developer tools; the session is saved after this, so its SQL is only in the histograms
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        stats.status_code = response.status_code
+        response.headers['Server-Timing'] = f'app;dur={(time.perf_counter() - stats.start) * 1000:.1f}, sql;dur={stats.sql_seconds * 1000:.1f}, upstream;dur={stats.upstream_seconds * 1000:.1f}'
+        return response
+
+    # the histograms are recorded once the request is torn down, after Flask has saved the session, so that the session's SQL counts towards the request
+    @app.teardown_request
+    def record_request_stats(exception=None):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return
+
+        duration = time.perf_counter() - stats.start
+        # label by the route's rule rather than the path, so that urls with ids in them share a series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        status_code = 500 if exception is not None else stats.status_code
+        request_duration.observe(duration, route, request.method, status_code)
+        # counted by get_db_connection, including the connection that the session was read with before the request started
+        request_db_connections.observe(g.get('db_connections_opened', 0), route)
+        request_sql_statements.observe(stats.sql_statements, route)
+        request_sql_seconds.observe(stats.sql_seconds, route)
+        request_upstream_calls.observe(stats.upstream_calls, route)
+        request_upstream_seconds.observe(stats.upstream_seconds, route)
+
+        if slow_request_seconds is not None and duration >= slow_request_seconds:
+            statements = '\n'.join(f'    {seconds * 1000:8.2f}ms  {sql}' for seconds, sql in stats.statements)
+            app.logger.warning(
+                "slow request: %s %s took %.0fms, with %s SQL statements taking %.0fms and %s upstream calls taking %.0fms\n%s",
+                request.method, request.full_path.rstrip('?'), duration * 1000, stats.sql_statements, stats.sql_seconds * 1000,
+                stats.upstream_calls, stats.upstream_seconds * 1000, statements
+            )
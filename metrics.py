@@ -0,0 +1,80 @@
+import threading
+
+# Simple in-process metrics that other modules record into.
+# render_metrics formats them in Prometheus' text format for the /metrics route.
+
+# upper bounds, in seconds, of the latency buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    # counts observations into cumulative buckets, separately for each combination of label values
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        # the histogram in Prometheus' text format, as a list of lines
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.snapshot().items()):
+            labels = format_labels(self.label_names, label_values)
+            bucket_labels = labels + ',' if labels else ''
+            for upper_bound, count in zip(self.buckets, series['buckets']):
+                lines.append(f'{self.name}_bucket{{{bucket_labels}le="{upper_bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{bucket_labels}le="+Inf"}} {series["count"]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series["sum"]}' if labels else f'{self.name}_sum {series["sum"]}')
+            lines.append(f'{self.name}_count{{{labels}}} {series["count"]}' if labels else f'{self.name}_count {series["count"]}')
+        return lines
+
+    def snapshot(self):
+        # a copy of every series that is safe to read while other threads keep observing
+        with self.lock:
+            return {label_values: {'buckets': list(series['buckets']), 'sum': series['sum'], 'count': series['count']} for label_values, series in self.series.items()}
+
+
+def format_labels(label_names, label_values):
+    values = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in label_values]
+    return ','.join(f'{name}="{value}"' for name, value in zip(label_names, values))
+
+
+def render_counter(name, description, label_name, counts):
+    # a counter for each key of counts (such as a cache's stats) in Prometheus' text format, as a list of lines
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} counter']
+    for key, count in sorted(dict(counts).items()):
+        lines.append(f'{name}{{{format_labels([label_name], [key])}}} {count}')
+    return lines
+
+
+def render_gauge(name, description, label_name, values):
+    # a gauge for each key of values (such as the length of each queue right now) in Prometheus' text format, as a list of lines
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+    for key, value in sorted(dict(values).items()):
+        lines.append(f'{name}{{{format_labels([label_name], [key])}}} {value}')
+    return lines
+
+
+def render_metrics(histograms, counters=(), gauges=()):
+    # histograms is a list of Histograms, and counters and gauges are lists of (name, description, label name, values)
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    for counter in counters:
+        lines.extend(render_counter(*counter))
+    for gauge in gauges:
+        lines.extend(render_gauge(*gauge))
+    return '\n'.join(lines) + '\n'
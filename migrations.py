@@ -0,0 +1,268 @@
+import sys
+import click
+from flask.cli import AppGroup
+from api_cache import normalize_search_term
+from helper_methods import delete_all_orphaned_artworks, expire_searches, get_db_connection
+from single_flight import delete_expired_leases
+
+# The database schema is built up by the migrations below, in order.
+# The version of the last migration that was applied is kept in SQLite's user_version pragma,
+# so upgrading only runs the migrations that a database has not seen yet.
+# To change the schema, add a new migration to the end of the list; never edit one that has already shipped.
+
+MIGRATIONS = [
+    (1, "create the tables", [
+        "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, username TEXT NOT NULL, hash TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS searches (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER, name TEXT UNIQUE NOT NULL, page_limit INTEGER)",
+        "CREATE TABLE IF NOT EXISTS artwork_searches (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, artwork_id INTEGER, search_id INTEGER, current_page INTEGER)",
+        "CREATE TABLE IF NOT EXISTS collected_works (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER, artwork_id INTEGER, collection_id INTEGER)",
+        "CREATE TABLE IF NOT EXISTS collections (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER NOT NULL, title NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS artworks (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, title TEXT, alt_text TEXT, artwork_id INTEGER NOT NULL, art_institute_url TEXT, display_url TEXT, artist_info TEXT, date_info TEXT)",
+    ]),
+    # the upserts in store_search_page need a unique index to detect rows that already exist
+    # duplicates left over from before the indexes existed are removed first so that the indexes can be built
+    (2, "add unique constraints for batched search ingestion", [
+        "DELETE FROM artworks WHERE id NOT IN (SELECT MIN(id) FROM artworks GROUP BY artwork_id)",
+        "DELETE FROM artwork_searches WHERE id NOT IN (SELECT MIN(id) FROM artwork_searches GROUP BY search_id, current_page, artwork_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS artworks_artwork_id ON artworks (artwork_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS artwork_searches_search_page_artwork ON artwork_searches (search_id, current_page, artwork_id)",
+    ]),
+    # filtering artwork_searches by (search_id, current_page) is already covered by the unique index from migration 2
+    (3, "index the columns that routes filter and join on", [
+        "CREATE INDEX IF NOT EXISTS users_username ON users (username)",
+        "CREATE INDEX IF NOT EXISTS searches_user_id ON searches (user_id)",
+        "CREATE INDEX IF NOT EXISTS artwork_searches_artwork_id ON artwork_searches (artwork_id)",
+        "CREATE INDEX IF NOT EXISTS collected_works_user_collection ON collected_works (user_id, collection_id)",
+        "CREATE INDEX IF NOT EXISTS collected_works_user_artwork ON collected_works (user_id, artwork_id)",
+        "CREATE INDEX IF NOT EXISTS collected_works_collection_id ON collected_works (collection_id)",
+        "CREATE INDEX IF NOT EXISTS collected_works_artwork_id ON collected_works (artwork_id)",
+        "CREATE INDEX IF NOT EXISTS collections_user_title ON collections (user_id, title)",
+    ]),
+    # the persistent tier of the shared cache of API responses in api_cache.py
+    (4, "add a table for cached API responses", [
+        "CREATE TABLE IF NOT EXISTS api_responses (key TEXT PRIMARY KEY NOT NULL, payload TEXT NOT NULL, fetched_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS api_responses_fetched_at ON api_responses (fetched_at)",
+    ]),
+    # lets get_image_url and hydrate_artworks skip artworks whose details were fetched recently
+    (5, "record when an artwork's details were fetched", [
+        "ALTER TABLE artworks ADD COLUMN details_fetched_at REAL",
+    ]),
+    # server-side sessions for the sqlite session backend in sessions.py
+    (6, "add a table for sessions", [
+        "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY NOT NULL, data TEXT NOT NULL, expires_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)",
+    ]),
+    # a full-text index over the artworks' titles, artists and dates for search_index.py
+    # it is an external content table, so the text is not stored twice; the triggers keep it in step with the artworks table
+    # and the rebuild indexes the artworks that were stored before the migration
+    (7, "add a full-text index of artworks", [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS artworks_fts USING fts5(title, artist_info, date_info, content='artworks', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS artworks_fts_insert AFTER INSERT ON artworks BEGIN INSERT INTO artworks_fts (rowid, title, artist_info, date_info) VALUES (new.id, new.title, new.artist_info, new.date_info); END",
+        "CREATE TRIGGER IF NOT EXISTS artworks_fts_delete AFTER DELETE ON artworks BEGIN INSERT INTO artworks_fts (artworks_fts, rowid, title, artist_info, date_info) VALUES ('delete', old.id, old.title, old.artist_info, old.date_info); END",
+        "CREATE TRIGGER IF NOT EXISTS artworks_fts_update AFTER UPDATE OF title, artist_info, date_info ON artworks BEGIN INSERT INTO artworks_fts (artworks_fts, rowid, title, artist_info, date_info) VALUES ('delete', old.id, old.title, old.artist_info, old.date_info); INSERT INTO artworks_fts (rowid, title, artist_info, date_info) VALUES (new.id, new.title, new.artist_info, new.date_info); END",
+        "INSERT INTO artworks_fts (artworks_fts) VALUES ('rebuild')",
+    ]),
+    # artworks loaded by "flask import-catalog" (catalog_import.py) are kept even when no search or collection uses them,
+    # and import_checkpoints records how far an import has got so that an interrupted one can resume
+    (8, "support importing the catalog", [
+        "ALTER TABLE artworks ADD COLUMN catalog_imported_at REAL",
+        "CREATE TABLE IF NOT EXISTS import_checkpoints (source TEXT PRIMARY KEY NOT NULL, file TEXT NOT NULL, record_number INTEGER NOT NULL, updated_at REAL NOT NULL)",
+    ]),
+    # a user keeps several searches, each unique per user by its normalized term, instead of one search whose name was unique across every user
+    # SQLite cannot drop a UNIQUE constraint, so the table is rebuilt with the same ids, which keeps artwork_searches pointing at the right rows
+    # a user's searches that normalize to the same term, such as "Monet" and "monet", become one: the newest is kept and the others' pages are moved to it
+    # last_used_at is when the search was last viewed, and decides which searches expire first
+    (9, "keep several searches per user", [
+        "CREATE TABLE searches_rebuilt (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER, name TEXT NOT NULL, normalized_name TEXT NOT NULL, page_limit INTEGER, last_used_at REAL NOT NULL)",
+        # with MAX(id), the other columns come from the row that has it
+        "INSERT INTO searches_rebuilt (id, user_id, name, normalized_name, page_limit, last_used_at) "
+        "SELECT MAX(id), user_id, name, normalize_search_term(name), page_limit, CAST(strftime('%s', 'now') AS REAL) FROM searches GROUP BY user_id, normalize_search_term(name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS searches_user_normalized_name ON searches_rebuilt (user_id, normalized_name)",
+        # a page that the kept search already has stays where it is, and is deleted with the rest of the dropped searches' rows below
+        "UPDATE OR IGNORE artwork_searches SET search_id = (SELECT kept.id FROM searches JOIN searches_rebuilt AS kept ON kept.user_id IS searches.user_id AND kept.normalized_name = normalize_search_term(searches.name) WHERE searches.id = artwork_searches.search_id) "
+        "WHERE search_id NOT IN (SELECT id FROM searches_rebuilt) AND search_id IN (SELECT id FROM searches)",
+        "DELETE FROM artwork_searches WHERE search_id NOT IN (SELECT id FROM searches_rebuilt)",
+        "DROP TABLE searches",
+        "ALTER TABLE searches_rebuilt RENAME TO searches",
+        "CREATE INDEX IF NOT EXISTS searches_user_last_used_at ON searches (user_id, last_used_at)",
+        "CREATE INDEX IF NOT EXISTS searches_last_used_at ON searches (last_used_at)",
+    ]),
+    # leases on work that is in flight in one of the processes sharing the database (see single_flight.py)
+    (10, "add leases for single-flight work", [
+        "CREATE TABLE IF NOT EXISTS flight_leases (key TEXT PRIMARY KEY NOT NULL, owner TEXT NOT NULL, expires_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS flight_leases_expires_at ON flight_leases (expires_at)",
+    ]),
+    # a version and a modification time on every artwork and collection, for the ETag and Last-Modified headers of the pages that show them (see page_cache.py)
+    # the triggers keep them up to date whatever writes the rows: an artwork's version goes up when anything the pages show about it changes,
+    # and a collection's when it is renamed or an artwork is added to it or removed from it
+    # the times are in seconds since the epoch, to the millisecond
+    (11, "version artworks and collections", [
+        "ALTER TABLE artworks ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE artworks ADD COLUMN updated_at REAL",
+        "ALTER TABLE collections ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE collections ADD COLUMN updated_at REAL",
+        "UPDATE artworks SET updated_at = COALESCE(catalog_imported_at, details_fetched_at, (julianday('now') - 2440587.5) * 86400.0)",
+        "UPDATE collections SET updated_at = (julianday('now') - 2440587.5) * 86400.0",
+        "CREATE TRIGGER IF NOT EXISTS artworks_version_insert AFTER INSERT ON artworks BEGIN UPDATE artworks SET updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id; END",
+        "CREATE TRIGGER IF NOT EXISTS artworks_version_update AFTER UPDATE OF title, alt_text, display_url, artist_info, date_info, art_institute_url ON artworks "
+        "WHEN old.title IS NOT new.title OR old.alt_text IS NOT new.alt_text OR old.display_url IS NOT new.display_url OR old.artist_info IS NOT new.artist_info OR old.date_info IS NOT new.date_info OR old.art_institute_url IS NOT new.art_institute_url "
+        "BEGIN UPDATE artworks SET version = version + 1, updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id; END",
+        "CREATE TRIGGER IF NOT EXISTS collections_version_insert AFTER INSERT ON collections BEGIN UPDATE collections SET updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id; END",
+        "CREATE TRIGGER IF NOT EXISTS collections_version_update AFTER UPDATE OF title ON collections WHEN old.title IS NOT new.title "
+        "BEGIN UPDATE collections SET version = version + 1, updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id; END",
+        "CREATE TRIGGER IF NOT EXISTS collected_works_version_insert AFTER INSERT ON collected_works BEGIN UPDATE collections SET version = version + 1, updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.collection_id; END",
+        "CREATE TRIGGER IF NOT EXISTS collected_works_version_delete AFTER DELETE ON collected_works BEGIN UPDATE collections SET version = version + 1, updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = old.collection_id; END",
+    ]),
+    # the bulk collection operations add many artworks with one statement, which relies on a unique index to skip the ones a collection already has
+    # duplicates left over from before the index are removed first, and the index on collection_id alone is covered by the new one
+    (12, "keep each artwork once per collection", [
+        "DELETE FROM collected_works WHERE id NOT IN (SELECT MIN(id) FROM collected_works GROUP BY collection_id, artwork_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS collected_works_collection_artwork ON collected_works (collection_id, artwork_id)",
+        "DROP INDEX IF EXISTS collected_works_collection_id",
+    ]),
+]
+
+# the queries that routes run on every request, and the ones the app's cleanups and startup run; check_query_plans makes sure none of them has to read a whole table
+# the periodic sweep in delete_all_orphaned_artworks reads the whole artworks table on purpose, so it is not listed
+# tests/test_route_queries.py checks that each of them is still in the code and that the routes run no other query
+ROUTE_QUERIES = [
+    "SELECT * FROM users WHERE username = ?",
+    "UPDATE users SET hash = ? WHERE id = ?",
+    "SELECT * FROM searches WHERE user_id = ? AND normalized_name = ?",
+    "SELECT * FROM searches WHERE id = ? AND user_id = ?",
+    "SELECT * FROM searches WHERE user_id = ? ORDER BY last_used_at DESC",
+    "SELECT id FROM searches WHERE user_id = ? ORDER BY last_used_at DESC",
+    "SELECT id FROM searches WHERE user_id = ? AND last_used_at < ?",
+    "SELECT id FROM searches WHERE last_used_at < ?",
+    "UPDATE searches SET last_used_at = ? WHERE id = ?",
+    "SELECT searches.id FROM searches LEFT JOIN artwork_searches on artwork_searches.search_id = searches.id AND artwork_searches.current_page = ? WHERE searches.user_id = ? AND searches.normalized_name = ? AND (searches.page_limit = 0 OR artwork_searches.id IS NOT NULL) LIMIT 1",
+    "SELECT * FROM artworks WHERE artwork_id = ?",
+    "SELECT display_url FROM artworks WHERE artwork_id = ?",
+    "SELECT * FROM artworks JOIN artwork_searches on artwork_searches.artwork_id = artworks.artwork_id WHERE artwork_searches.search_id = ? AND artwork_searches.current_page = ?",
+    "UPDATE artworks SET title = COALESCE(?, title), alt_text = (?), display_url = (?), artist_info = (?), date_info = (?), details_fetched_at = (?) WHERE artwork_id = (?)",
+    "SELECT artwork_id FROM artworks WHERE artwork_id IN (?, ?, ?) AND catalog_imported_at IS NULL AND (details_fetched_at IS NULL OR details_fetched_at < ?)",
+    "SELECT artwork_id FROM artwork_searches WHERE search_id = ?",
+    "DELETE FROM artwork_searches WHERE search_id = ?",
+    "DELETE FROM searches WHERE id = ?",
+    "SELECT * FROM collections WHERE user_id = ?",
+    "SELECT * FROM collections WHERE user_id = ? AND title = ?",
+    "DELETE from collected_works WHERE artwork_id = ? AND collection_id = ? AND user_id = ?",
+    "SELECT * FROM collections WHERE id = ? AND user_id = ?",
+    "SELECT id FROM collections WHERE user_id = ? AND title = ?",
+    "INSERT INTO collected_works (collection_id, user_id, artwork_id) SELECT ?, ?, artwork_id FROM artworks WHERE artwork_id = ? ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+    "INSERT INTO collected_works (collection_id, user_id, artwork_id) SELECT ?, ?, artwork_id FROM artwork_searches WHERE search_id = ? AND current_page = ? ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+    "INSERT INTO collected_works (collection_id, user_id, artwork_id) SELECT ?, user_id, artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ? ORDER BY id ON CONFLICT (collection_id, artwork_id) DO NOTHING",
+    "SELECT artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ?",
+    "DELETE FROM collected_works WHERE user_id = ? AND collection_id = ?",
+    "DELETE FROM collections WHERE id = ? AND user_id = ?",
+    "SELECT id, title FROM collections WHERE user_id = ? AND (? IS NULL OR id = ?) ORDER BY id",
+    "SELECT artworks.artwork_id, artworks.title, artworks.artist_info, artworks.date_info, artworks.alt_text, artworks.art_institute_url, artworks.display_url FROM collected_works JOIN artworks ON artworks.artwork_id = collected_works.artwork_id WHERE collected_works.user_id = ? AND collected_works.collection_id = ? ORDER BY collected_works.id",
+    "SELECT DISTINCT artworks.artwork_id, artworks.display_url FROM collected_works JOIN artworks ON artworks.artwork_id = collected_works.artwork_id WHERE collected_works.user_id = ? AND (? IS NULL OR collected_works.collection_id = ?)",
+    "SELECT collections.title AS collection_title, collections.version AS collection_version, collections.updated_at AS collection_updated_at, (SELECT COUNT(*) FROM collected_works WHERE collected_works.user_id = collections.user_id AND collected_works.collection_id = collections.id) AS artwork_count, page.id AS collected_work_id, page.artwork_id, artworks.title, artworks.alt_text, artworks.details_fetched_at, artworks.version, artworks.updated_at FROM collections LEFT JOIN (SELECT id, artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ? AND id < ? ORDER BY id DESC LIMIT ?) AS page ON 1 LEFT JOIN artworks ON artworks.artwork_id = page.artwork_id WHERE collections.id = ? AND collections.user_id = ? ORDER BY page.id DESC",
+    "SELECT collections.title AS collection_title, collections.version AS collection_version, collections.updated_at AS collection_updated_at, (SELECT COUNT(*) FROM collected_works WHERE collected_works.user_id = collections.user_id AND collected_works.collection_id = collections.id) AS artwork_count, page.id AS collected_work_id, page.artwork_id, artworks.title, artworks.alt_text, artworks.details_fetched_at, artworks.version, artworks.updated_at FROM collections LEFT JOIN (SELECT id, artwork_id FROM collected_works WHERE user_id = ? AND collection_id = ? AND id > ? ORDER BY id LIMIT ?) AS page ON 1 LEFT JOIN artworks ON artworks.artwork_id = page.artwork_id WHERE collections.id = ? AND collections.user_id = ? ORDER BY page.id",
+    "SELECT payload, fetched_at FROM api_responses WHERE key = ?",
+    "SELECT payload FROM api_responses WHERE key = ?",
+    "SELECT key, payload, fetched_at FROM api_responses WHERE fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?",
+    "DELETE FROM api_responses WHERE fetched_at < ?",
+    "DELETE FROM api_responses WHERE fetched_at < (SELECT fetched_at FROM api_responses ORDER BY fetched_at DESC LIMIT 1 OFFSET ?)",
+    "SELECT file, record_number FROM import_checkpoints WHERE source = ?",
+    "DELETE FROM import_checkpoints WHERE source = ?",
+    "INSERT INTO flight_leases (key, owner, expires_at) VALUES(?, ?, ?) ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at WHERE flight_leases.expires_at < ?",
+    "DELETE FROM flight_leases WHERE key = ? AND owner = ?",
+    "DELETE FROM flight_leases WHERE expires_at < ?",
+    "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+    "DELETE FROM sessions WHERE id = ?",
+    "DELETE FROM sessions WHERE expires_at <= ?",
+    "SELECT COUNT(*) FROM artworks_fts WHERE artworks_fts MATCH ?",
+    "SELECT artworks.* FROM artworks_fts JOIN artworks ON artworks.id = artworks_fts.rowid WHERE artworks_fts MATCH ? AND NOT EXISTS (SELECT 1 FROM artwork_searches WHERE artwork_searches.search_id = ? AND artwork_searches.artwork_id = artworks.artwork_id) ORDER BY bm25(artworks_fts, ?, ?, ?) LIMIT ?",
+    "SELECT artworks.*, collected_works.collection_id, collections.title AS collection_title FROM artworks_fts JOIN artworks ON artworks.id = artworks_fts.rowid JOIN collected_works ON collected_works.artwork_id = artworks.artwork_id JOIN collections ON collections.id = collected_works.collection_id WHERE artworks_fts MATCH ? AND collected_works.user_id = ? AND (? IS NULL OR collected_works.collection_id = ?) ORDER BY bm25(artworks_fts, ?, ?, ?)",
+    "UPDATE searches SET page_limit = ? WHERE id = ?",
+    "DELETE FROM artworks WHERE artwork_id = ? AND catalog_imported_at IS NULL AND NOT EXISTS (SELECT 1 FROM artwork_searches WHERE artwork_searches.artwork_id = artworks.artwork_id) AND NOT EXISTS (SELECT 1 FROM collected_works WHERE collected_works.artwork_id = artworks.artwork_id)",
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade_database(conn):
+    # apply every migration that is newer than the database's schema version, each in its own transaction
+    # returns the list of migrations that were applied
+    if conn.in_transaction:
+        conn.commit()
+
+    # the migrations normalize search terms with the same function as the app, rather than an approximation of it in SQL
+    conn.create_function('normalize_search_term', 1, normalize_search_term, deterministic=True)
+
+    current_version = get_schema_version(conn)
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, name))
+    return applied
+
+
+def check_query_plans(conn, queries=ROUTE_QUERIES):
+    # run EXPLAIN QUERY PLAN on each query and return the ones where SQLite would scan a whole table instead of searching an index
+    # the parameters do not affect the plan, so every placeholder is bound to NULL
+    # SQLite reports a full-text MATCH as a scan of the virtual table even though it is answered from the full-text index, so those are not counted,
+    # and neither are scans of a subquery that was materialized first, which only hold the rows the subquery found,
+    # nor, in a query with a LIMIT that needs no sorting, scans of an index in its own order, which stop once the LIMIT (and OFFSET) rows have been read
+    full_scans = []
+    for query in queries:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", [None] * query.count('?')).fetchall()
+        materialized = [row['detail'][len('MATERIALIZE '):] for row in plan if row['detail'].startswith('MATERIALIZE ')]
+        ordered_by_index = ' LIMIT ' in query and not any('TEMP B-TREE FOR ORDER BY' in row['detail'] for row in plan)
+        scans = [
+            row['detail'] for row in plan
+            if row['detail'].startswith('SCAN') and 'VIRTUAL TABLE' not in row['detail'] and row['detail'].split()[1] not in materialized
+            and not (ordered_by_index and 'USING COVERING INDEX' in row['detail'])
+        ]
+        if scans:
+            full_scans.append((query, scans))
+    return full_scans
+
+
+db_cli = AppGroup('db', help="Manage the database schema.")
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    # flask db upgrade
+    conn = get_db_connection()
+    applied = upgrade_database(conn)
+    for version, name in applied:
+        click.echo(f"applied migration {version}: {name}")
+    click.echo(f"database is at schema version {get_schema_version(conn)}")
+
+
+@db_cli.command('check-plans')
+def check_plans_command():
+    # flask db check-plans; exits with a non-zero status if any route query falls back to a full table scan
+    full_scans = check_query_plans(get_db_connection())
+    for query, scans in full_scans:
+        click.echo(f"full table scan: {query}\n    {'; '.join(scans)}", err=True)
+    if full_scans:
+        sys.exit(1)
+    click.echo(f"all {len(ROUTE_QUERIES)} route queries use an index")
+
+
+@db_cli.command('sweep')
+def sweep_command():
+    # flask db sweep; delete the searches that have expired, then every artwork that is neither in a current search nor in a collection, nor imported from the catalog,
+    # and the single-flight leases left behind by processes that died
+    expired = expire_searches(get_db_connection())
+    deleted = delete_all_orphaned_artworks(get_db_connection())
+    leases = delete_expired_leases(get_db_connection())
+    click.echo(f"deleted {expired} expired searches, {deleted} orphaned artworks and {leases} expired leases")
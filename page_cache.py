@@ -0,0 +1,84 @@
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from flask import make_response, request
+from markupsafe import Markup
+
+# HTTP caching for the pages that only show data: artwork showpages, collection pages and pages of search results.
+#
+# Each page gets an ETag made from the versions of the rows it shows (see migration 11, whose triggers bump them on every change),
+# and a Last-Modified from when those rows last changed. The browser keeps the page and checks back with If-None-Match every time it is opened,
+# so going back to a page whose rows have not changed is answered with a 304 and no body, without rendering the page again.
+# A change made through one of the POST routes only bumps the versions of the rows it touched, so only the pages showing those rows are sent again.
+#
+# The pages are behind a login and include things that belong to the user, such as their collections, so they are private to the browser.
+# The parts of pages that are the same for every user, such as an artwork's details, are also rendered once and kept in a FragmentCache.
+
+
+def make_etag(*parts):
+    # an ETag for a page made from everything it depends on
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()[:32]
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # the browser may keep the page, but has to check that it is still current before showing it again
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    # a 304 response if the browser's copy of the page is still current, going by If-None-Match or, without one, If-Modified-Since; otherwise None
+    if request.if_none_match:
+        current = request.if_none_match.contains(etag)
+    else:
+        current = request.if_modified_since is not None and last_modified is not None and int(last_modified) <= request.if_modified_since.timestamp()
+    if not current:
+        return None
+    response = make_response('', 304)
+    return set_validators(response, etag, last_modified)
+
+
+def cacheable(body, etag, last_modified=None):
+    # a response for a rendered page, with the validators that let the browser ask for it again conditionally
+    return set_validators(make_response(body), etag, last_modified)
+
+
+class FragmentCache:
+    # rendered parts of pages that are the same for every user, kept in memory up to max_entries, the least recently used going first
+    # each is kept with the version of the rows it was rendered from, and a part whose rows have a newer version is rendered again
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def get(self, key, version, render):
+        # return the fragment for key at version, calling render() to make it if it is not cached at that version
+        with self.lock:
+            entry = self.fragments.get(key)
+            if entry is not None and entry[0] == version:
+                self.fragments.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+
+        self.stats['misses'] += 1
+        fragment = Markup(render())
+        with self.lock:
+            self.fragments[key] = (version, fragment)
+            self.fragments.move_to_end(key)
+            while len(self.fragments) > self.max_entries:
+                self.fragments.popitem(last=False)
+                self.stats['evictions'] += 1
+        return fragment
+
+    def invalidate(self, keys):
+        # drop the fragments for rows that were deleted
+        with self.lock:
+            for key in keys:
+                if self.fragments.pop(key, None) is not None:
+                    self.stats['invalidations'] += 1
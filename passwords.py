@@ -0,0 +1,97 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Hashes and checks passwords on a small pool of worker processes instead of on the thread handling the request.
+# Hashing is slow on purpose and holds the CPU the whole time, so a burst of logins hashed in the web process
+# would stall every other request in it; in their own processes they only cost the CPU time they actually use.
+#
+# PASSWORD_HASH_METHOD is the hashing method and its work factor, in werkzeug's form: for example scrypt:32768:8:1 (the default)
+# or pbkdf2:sha256:600000. When it changes, each user's stored hash is upgraded to it the next time they log in.
+# At most PASSWORD_HASH_QUEUE hashes are waiting or running at once; past that, a login waits up to PASSWORD_HASH_WAIT_SECONDS for room
+# and is then turned away with PasswordHasherBusy, rather than queueing without limit behind a storm of logins.
+# PASSWORD_HASH_WORKERS=0 hashes on the request's thread, as before.
+# The workers are spawned, so a script that imports the app and hashes passwords needs the usual if __name__ == '__main__' guard.
+# Each app has its own PasswordHasher, made from its settings by init_services in helper_methods.py.
+
+
+class PasswordHasherBusy(Exception):
+    # every slot in the hashing queue stayed taken for longer than a login may wait
+    status_code = 503
+    message = "Too many people are logging in right now. Please try again in a moment."
+
+
+def watch_parent(parent_pid):
+    # runs in each worker: a worker whose web process is gone, such as one stopped with SIGTERM, which skips the pool's shutdown, exits rather than lingering
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def get_hash_prefix(method):
+    # the method as generate_password_hash writes it at the front of every hash, with werkzeug's defaults filled in for the parameters it leaves out
+    # raises ValueError for a method that werkzeug cannot hash with
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return f'scrypt:{2 ** 15}:8:1'
+    if name == 'scrypt' and len(args) == 3:
+        return 'scrypt:' + ':'.join(str(int(arg)) for arg in args)
+    if name == 'pbkdf2' and len(args) <= 2:
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"invalid PASSWORD_HASH_METHOD {method!r}")
+
+
+class PasswordHasher:
+    def __init__(self, method, workers, queue_size, wait_seconds):
+        self.method = method
+        self.workers = workers
+        self.wait_seconds = wait_seconds
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        # the pool is started on first use, so a process that never hashes anything, or that is forked after import, does not start one it cannot use
+        self.executor = None
+        self.current_prefix = get_hash_prefix(method)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawned rather than forked, since forking a process that is already running threads can leave locks held in the child
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=watch_parent, initargs=(os.getpid(),))
+                # stop the workers when the process exits, so they and the pool's semaphores are not left behind
+                atexit.register(self.shutdown)
+            return self.executor
+
+    def run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if not self.slots.acquire(timeout=self.wait_seconds):
+            raise PasswordHasherBusy(PasswordHasherBusy.message)
+        try:
+            return self.get_executor().submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # whether a stored hash was made with a different method or work factor from the current one
+        return password_hash.split('$', 1)[0] != self.current_prefix
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
@@ -0,0 +1,67 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+# Runs work in the background after a response has been served, such as fetching the next page of a user's search.
+# Each piece of work has a key; work whose key is already queued or running is not queued again,
+# each user can only have a few pieces of work in flight at once, and a user's queued work can be cancelled.
+
+
+class Prefetcher:
+    def __init__(self, work, max_workers=4, per_user_limit=2):
+        # work(user_id, *args) is called inside an app context on one of the pool's threads
+        self.work = work
+        self.per_user_limit = per_user_limit
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self.in_flight = {}
+        self.user_in_flight = Counter()
+        # bumped by cancel, so work that was queued before the cancellation knows not to run
+        self.generations = Counter()
+        self.lock = threading.RLock()
+        self.stats = Counter()
+
+    def submit(self, user_id, key, *args):
+        # queue work for a user unless the same work is already in flight or the user is at their limit
+        app = current_app._get_current_object()
+        with self.lock:
+            if (user_id, key) in self.in_flight:
+                self.stats['deduplicated'] += 1
+                return
+            if self.user_in_flight[user_id] >= self.per_user_limit:
+                self.stats['skipped_user_limit'] += 1
+                return
+
+            future = self.executor.submit(self.run, app, user_id, self.generations[user_id], args)
+            self.in_flight[(user_id, key)] = future
+            self.user_in_flight[user_id] += 1
+            self.stats['submitted'] += 1
+            # also called if the future is cancelled before it runs
+            future.add_done_callback(lambda future: self.finished(user_id, key))
+
+    def run(self, app, user_id, generation, args):
+        if self.generations[user_id] != generation:
+            self.stats['cancelled'] += 1
+            return
+        try:
+            with app.app_context():
+                self.work(user_id, *args)
+            self.stats['completed'] += 1
+        except Exception:
+            self.stats['failed'] += 1
+            app.logger.exception("background prefetch failed")
+
+    def finished(self, user_id, key):
+        with self.lock:
+            self.in_flight.pop((user_id, key), None)
+            self.user_in_flight[user_id] -= 1
+            if not self.user_in_flight[user_id]:
+                del self.user_in_flight[user_id]
+
+    def cancel(self, user_id):
+        # drop the user's queued work; work that is already running finishes, so it has to check for itself whether it is still wanted before saving anything
+        with self.lock:
+            self.generations[user_id] += 1
+            for (future_user_id, key), future in list(self.in_flight.items()):
+                if future_user_id == user_id and future.cancel():
+                    self.stats['cancelled'] += 1
@@ -0,0 +1,51 @@
+import re
+
+# Full-text search over the artworks that are already stored locally, using the artworks_fts table from migrations.py.
+# The triggers that keep artworks_fts in sync with the artworks table are part of the same migration,
+# so anything that inserts, updates or deletes artworks keeps the index up to date without knowing about it.
+#
+# Matches are ranked with BM25, with a match in the title counting for more than one in the artist, and both for more than one in the date.
+title_weight = 10.0
+artist_weight = 5.0
+date_weight = 1.0
+
+
+def build_match_query(search_term):
+    # turn what the user typed into an FTS5 query that matches artworks containing every word, or a word that starts with it
+    # each word is quoted so that characters FTS5 treats as syntax (quotes, AND, NEAR, column filters, ...) are searched for literally
+    # returns None if there is nothing to search for
+    words = re.findall(r'\w+', search_term.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def count_local_matches(conn, search_term):
+    match_query = build_match_query(search_term)
+    if match_query is None:
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM artworks_fts WHERE artworks_fts MATCH ?", [match_query]).fetchone()[0]
+
+
+def search_local_artworks(conn, search_term, limit, exclude_search_id=None):
+    # return up to limit stored artworks that match the search term, best match first
+    # artworks that are already on a page of the search exclude_search_id are skipped, so that each page of a search shows new artworks
+    match_query = build_match_query(search_term)
+    if match_query is None:
+        return []
+    return conn.execute(
+        "SELECT artworks.* FROM artworks_fts JOIN artworks ON artworks.id = artworks_fts.rowid WHERE artworks_fts MATCH ? AND NOT EXISTS (SELECT 1 FROM artwork_searches WHERE artwork_searches.search_id = ? AND artwork_searches.artwork_id = artworks.artwork_id) ORDER BY bm25(artworks_fts, ?, ?, ?) LIMIT ?",
+        [match_query, exclude_search_id, title_weight, artist_weight, date_weight, limit]
+    ).fetchall()
+
+
+def search_collections(conn, user_id, search_term, collection_id=None):
+    # return the artworks in a user's collections (or in one of them, if collection_id is given) that match the search term, best match first
+    # each row also has the id and title of the collection the artwork is in; an artwork in two collections appears once for each
+    match_query = build_match_query(search_term)
+    if match_query is None:
+        return []
+    return conn.execute(
+        "SELECT artworks.*, collected_works.collection_id, collections.title AS collection_title FROM artworks_fts JOIN artworks ON artworks.id = artworks_fts.rowid JOIN collected_works ON collected_works.artwork_id = artworks.artwork_id JOIN collections ON collections.id = collected_works.collection_id WHERE artworks_fts MATCH ? AND collected_works.user_id = ? AND (? IS NULL OR collected_works.collection_id = ?) ORDER BY bm25(artworks_fts, ?, ?, ?)",
+        [match_query, user_id, collection_id, collection_id, title_weight, artist_weight, date_weight]
+    ).fetchall()
@@ -0,0 +1,126 @@
+# Serves the app in one of two modes:
+#
+#   sync:  a fixed pool of worker threads, like a threaded gunicorn worker; each request holds a thread
+#          for as long as it waits on the Art Institute's API, so at most --threads requests are handled at once
+#   async: gevent, which turns every blocking socket call (including the ones requests makes to the API)
+#          into a cooperative wait, so one process can keep hundreds of upstream requests in flight
+#          while routes such as /search, /search_results and /artwork_showpage wait on the API
+#
+# usage: DB_PATH=aic_collections.db python serve.py --mode async --connections 500
+#
+# The async mode needs gevent (pip install gevent). It is the same setup as "gunicorn -k gevent wsgi:app".
+#
+# In sync mode, --workers starts that many processes, each with its own pool of threads, accepting connections on the same socket.
+# The app is created, and its caches warmed, once before they are forked, as with "gunicorn --preload -w 4 wsgi:app" (see startup.py).
+
+import argparse
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    # hands each connection to a fixed pool of threads instead of starting a thread per connection
+    threads = 8
+    # more waiting connections than the default of 5, so a burst of requests queues instead of being refused
+    request_queue_size = 1024
+
+    def server_activate(self):
+        super().server_activate()
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_in_thread, request, client_address)
+
+    def process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def exit_on_sigterm():
+    # SIGTERM exits through the finally blocks and atexit handlers, such as the one that stops the password hashing pool (see passwords.py),
+    # instead of killing the process outright
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def serve_sync(host, port, threads, workers=1):
+    from app import create_app
+    app = create_app()
+    ThreadPoolWSGIServer.threads = threads
+    server = make_server(host, port, app, server_class=ThreadPoolWSGIServer, handler_class=QuietRequestHandler)
+    if workers > 1:
+        print(f"serving in sync mode with {workers} workers of {threads} threads on http://{host}:{port}", flush=True)
+        serve_forked(server, workers)
+        return
+    print(f"serving in sync mode with {threads} threads on http://{host}:{port}")
+    exit_on_sigterm()
+    server.serve_forever()
+
+
+def serve_forked(server, workers):
+    # fork the workers, then wait for them; stopping this process stops them too
+    # the workers inherit the SIGTERM handler, so they exit through their finally blocks as well
+    exit_on_sigterm()
+    pids = []
+    try:
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+
+def serve_async(host, port, connections):
+    # patch the standard library before the app (and with it requests and threading) is imported
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer as GeventWSGIServer
+    from app import create_app
+    app = create_app()
+    print(f"serving in async mode with up to {connections} concurrent connections on http://{host}:{port}")
+    exit_on_sigterm()
+    GeventWSGIServer((host, port), app, spawn=Pool(connections), log=None).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with a thread pool (sync) or with gevent (async).")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8, help="worker threads in sync mode")
+    parser.add_argument('--connections', type=int, default=500, help="concurrent connections in async mode")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes in sync mode, forked after the app is created")
+    args = parser.parse_args()
+
+    if args.mode == 'async':
+        serve_async(args.host, args.port, args.connections)
+    else:
+        serve_sync(args.host, args.port, args.threads, args.workers)
+
+
+if __name__ == '__main__':
+    main()
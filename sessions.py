@@ -0,0 +1,130 @@
+import json
+import os
+import secrets
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask.sessions import SecureCookieSession, SessionInterface
+from flask_session import Session
+from helper_methods import get_db_connection
+
+# The app only keeps the logged-in user's id in the session, so there is a choice of where to store it:
+#
+#   sqlite:     a row in the sessions table, keyed by a random id in the cookie, that expires after PERMANENT_SESSION_LIFETIME
+#               (the default; it is shared by every worker process and is only written when the session changes)
+#   cookie:     Flask's signed cookie, which needs no storage at all but requires SECRET_KEY to be set
+#   filesystem: Flask-Session's pickle files under flask_session/, which is how sessions used to be stored
+
+
+class SQLiteSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        # the user the session belonged to when it was opened, and whether it has been cleared since, which is what login, register and logout do
+        self.opened_user_id = (initial or {}).get('user_id')
+        self.cleared = False
+
+    def clear(self):
+        super().clear()
+        self.cleared = True
+
+    def needs_new_sid(self):
+        # a session whose user changes gets a new id, so that an id someone learned or planted before the user logged in is no use afterwards
+        return self.cleared or self.get('user_id') != self.opened_user_id
+
+
+class SQLiteSessionInterface(SessionInterface):
+    def __init__(self, get_connection):
+        # get_connection returns the database connection for the current request
+        self.get_connection = get_connection
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self.get_connection().execute("SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?", [sid, time.time()]).fetchone()
+            if row is not None:
+                return SQLiteSession(json.loads(row['data']), sid, row['expires_at'])
+        return SQLiteSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        conn = self.get_connection()
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            # the session was emptied (for example at logout), so forget it on both ends
+            if session.modified:
+                conn.execute("DELETE FROM sessions WHERE id = ?", [session.sid])
+                conn.commit()
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        # only write when the data changed, or when the session is past half its lifetime and needs its expiry pushed back
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        if session.modified or session.expires_at is None or session.expires_at - now < lifetime / 2:
+            if session.needs_new_sid():
+                # the old row is deleted in the same transaction that the session is saved under its new id
+                conn.execute("DELETE FROM sessions WHERE id = ?", [session.sid])
+                session.sid = secrets.token_urlsafe(32)
+            conn.execute(
+                "INSERT INTO sessions (id, data, expires_at) VALUES(?, ?, ?) ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                [session.sid, json.dumps(dict(session)), now + lifetime]
+            )
+            conn.commit()
+            response.set_cookie(
+                cookie_name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+
+def configure_sessions(app, backend, get_connection=None):
+    # set up the session backend named by backend on the app
+    if backend == 'sqlite':
+        app.session_interface = SQLiteSessionInterface(get_connection)
+    elif backend == 'cookie':
+        # Flask's default session interface; it signs the cookie with the secret key
+        if not app.secret_key:
+            raise RuntimeError("SESSION_BACKEND=cookie needs SECRET_KEY to be set")
+    elif backend == 'filesystem':
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+    else:
+        raise ValueError(f"unknown SESSION_BACKEND {backend!r}; use sqlite, cookie or filesystem")
+
+
+def delete_expired_sessions(conn, session_file_directory, max_age_seconds):
+    # delete expired rows from the sessions table, and session files that have not been touched for max_age_seconds
+    # returns how many rows and files were deleted
+    deleted_rows = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", [time.time()]).rowcount
+    conn.commit()
+
+    deleted_files = 0
+    if os.path.isdir(session_file_directory):
+        cutoff = time.time() - max_age_seconds
+        for entry in os.scandir(session_file_directory):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                deleted_files += 1
+    return deleted_rows, deleted_files
+
+
+sessions_cli = AppGroup('sessions', help="Manage stored sessions.")
+
+
+@sessions_cli.command('cleanup')
+@click.option('--directory', default='flask_session', help="Directory that the filesystem backend keeps its session files in.")
+def cleanup_command(directory):
+    # flask sessions cleanup; safe to run from cron whichever backend is in use
+    max_age_seconds = current_app.permanent_session_lifetime.total_seconds()
+    deleted_rows, deleted_files = delete_expired_sessions(get_db_connection(), directory, max_age_seconds)
+    click.echo(f"deleted {deleted_rows} expired sessions and {deleted_files} stale session files")
@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Makes sure that work which many requests need at the same moment, such as fetching a page of search results or downloading an image,
+# is only done once: the first caller for a key does the work, and everyone else who asks for the same key while it is in flight waits and shares its result.
+#
+# Within a process, the waiting callers get the leader's return value, or its exception.
+# Across processes (several workers sharing the database), the leader also holds a lease on the key in the flight_leases table.
+# A caller in another process that cannot take the lease polls until it is released, then asks lookup() for the result that the leader stored
+# (in the database, the response cache or the image cache), and only does the work itself if there is still nothing there.
+# A lease expires after lease_seconds, so the key is not stuck if the process holding it dies.
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, get_connection=None, lease_seconds=30, poll_seconds=0.05):
+        # without get_connection, work is only deduplicated within this process
+        self.get_connection = get_connection
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = Counter()
+
+    def do(self, key, work, lookup=None):
+        # return work() for key, unless the same key is already in flight, in which case wait for it and return its result instead
+        # lookup() returns the result of work that another process did, or None if it is not there; without it, leases are not used
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            self.stats['coalesced'] += 1
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.lead(key, work, lookup)
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def lead(self, key, work, lookup):
+        if self.get_connection is None or lookup is None:
+            self.stats['led'] += 1
+            return work()
+
+        owner = uuid.uuid4().hex
+        if not self.acquire(key, owner):
+            self.stats['waited_for_lease'] += 1
+            while not self.acquire(key, owner):
+                time.sleep(self.poll_seconds)
+
+        try:
+            # the process that held the lease has most likely just done the work
+            result = lookup()
+            if result is not None:
+                self.stats['found_after_lease'] += 1
+            else:
+                self.stats['led'] += 1
+                result = work()
+        except BaseException:
+            self.release(key, owner, failed=True)
+            raise
+        self.release(key, owner)
+        return result
+
+    def acquire(self, key, owner):
+        # take the lease on key, unless another caller holds one that has not expired; each lease change is committed straight away
+        conn = self.get_connection()
+        now = time.time()
+        acquired = conn.execute(
+            "INSERT INTO flight_leases (key, owner, expires_at) VALUES(?, ?, ?) ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at WHERE flight_leases.expires_at < ?",
+            [key, owner, now + self.lease_seconds, now]
+        ).rowcount
+        conn.commit()
+        return acquired > 0
+
+    def release(self, key, owner, failed=False):
+        conn = self.get_connection()
+        # if the work failed part of the way through a transaction, the exception is on its way out of the request, so its writes are dropped rather than committed with the release
+        if failed and conn.in_transaction:
+            conn.rollback()
+        conn.execute("DELETE FROM flight_leases WHERE key = ? AND owner = ?", [key, owner])
+        conn.commit()
+
+
+def delete_expired_leases(conn):
+    # delete the leases left behind by processes that died while holding them; returns how many there were
+    deleted = conn.execute("DELETE FROM flight_leases WHERE expires_at < ?", [time.time()]).rowcount
+    conn.commit()
+    return deleted
@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# What the app does once when it starts, so that with "gunicorn --preload" (or serve.py --workers) it is done once in the master process
+# and every worker forked from it starts warm, sharing the memory copy-on-write: the templates are compiled, every query the routes run is
+# compiled against the schema so a broken one fails before any worker starts, and the caches that live in memory are filled from the database.
+#
+# Nothing that belongs to a single process may be created before the fork. Database connections are only opened inside an app context
+# and closed when it ends, so none is left open to be shared with the workers, and background threads, which a fork does not copy,
+# are started by each worker when it serves its first request (see start_in_each_process).
+#
+# How long each step took is kept in app.extensions['startup_seconds'] and reported by /metrics.
+
+
+@contextmanager
+def timed(phases, phase):
+    # add the seconds the block took to phases[phase]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0) + time.perf_counter() - start
+
+
+def compile_templates(app):
+    # compile every template into the Jinja environment's cache, so no request has to; returns how many there were
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def prepare_statements(conn, queries):
+    # compile each query without running it; SQLite rejects a query that does not match the schema here rather than in a worker's first request
+    # a prepared statement belongs to the connection it was prepared on, so the workers still prepare their own, on their own connections
+    for query in queries:
+        conn.execute(f"EXPLAIN {query}", [None] * query.count('?')).fetchall()
+    return len(queries)
+
+
+def start_in_each_process(app, start):
+    # call start() once in every process that serves requests, before its first request, instead of in the process that created the app
+    started_in = set()
+    lock = threading.Lock()
+
+    @app.before_request
+    def start_once_per_process():
+        if os.getpid() in started_in:
+            return
+        with lock:
+            if os.getpid() not in started_in:
+                started_in.add(os.getpid())
+                start()
@@ -0,0 +1,140 @@
+# Fixtures for the tests: a mock of the Art Institute's API on a local port (benchmarks/mock_aic_server.py),
+# a database with the schema applied, and an app made by create_app that talks to the mock instead of the real API.
+#
+# usage: python -m pytest tests
+
+import os
+import re
+import sys
+import time
+import pytest
+import requests
+from flask import has_app_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import instrumentation
+from app import create_app
+from helper_methods import open_db_connection
+from load_test import free_port
+from migrations import ROUTE_QUERIES, upgrade_database
+from mock_aic_server import MockAICHandler, start_server
+
+
+@pytest.fixture(scope='session')
+def aic_server():
+    # the url of the mock API, shared by every test; tests that need it to fail set MockAICHandler.error_rate with monkeypatch
+    port = free_port()
+    server = start_server(port)
+    yield f'http://127.0.0.1:{port}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def failing_aic_server(aic_server, monkeypatch):
+    # the mock API, answering every request with a 503
+    monkeypatch.setattr(MockAICHandler, 'error_rate', 1)
+    return aic_server
+
+
+def wait_until(condition, timeout=5):
+    # poll condition until it is true, failing the test instead of hanging if it never is
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.001)
+
+
+def upstream_stats(aic_server):
+    # how many requests the mock API has served for each endpoint
+    return requests.get(aic_server + '/__stats', timeout=10).json()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    # a connection to a new database with every migration applied
+    conn = open_db_connection(str(tmp_path / 'test.db'))
+    upgrade_database(conn)
+    yield conn
+    conn.close()
+
+
+def app_config(directory, aic_server, **overrides):
+    # the settings for a test app that keeps its files in directory and talks to the mock API
+    # the API is not rate limited, nothing is prefetched on background threads, and passwords are hashed quickly on the request's thread
+    return {
+        'TESTING': True,
+        'DB_PATH': str(directory / 'app.db'),
+        'SESSION_BACKEND': 'sqlite',
+        'IMAGE_CACHE_DIR': str(directory / 'image_cache'),
+        'AIC_API_URL': aic_server + '/api/v1',
+        'AIC_TRANSPORT': 'live',
+        'AIC_REQUESTS_PER_SECOND': 0,
+        'AIC_BACKOFF_SECONDS': 0,
+        'PREFETCH_ENABLED': False,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0,
+        'STARTUP_WARM_CACHES': False,
+        **overrides,
+    }
+
+
+@pytest.fixture
+def app(tmp_path, aic_server):
+    return create_app(app_config(tmp_path, aic_server))
+
+
+def register(client, username, password='password'):
+    # register a user with the app, which also logs them in
+    response = client.post('/register', data={'username': username, 'password': password, 'confirmation': password})
+    assert response.status_code == 302
+    return response
+
+
+def create_collection(app, client, title):
+    # create a collection for the client's user and return its id
+    client.post('/collections', data={'create-new-collection': title})
+    conn = open_db_connection(app.config['DB_PATH'])
+    try:
+        return conn.execute("SELECT id FROM collections WHERE title = ?", [title]).fetchone()['id']
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    register(client, 'alice')
+    return client
+
+
+@pytest.fixture
+def executed_statements(app, monkeypatch):
+    # the SQL that the app runs from now on, as it is written in the code rather than with the parameters filled in
+    # the tests' own queries are run outside the app's context, so they are left out
+    statements = []
+    record_sql = instrumentation.record_sql
+
+    def record(sql, seconds):
+        if has_app_context():
+            statements.append(sql)
+        record_sql(sql, seconds)
+    monkeypatch.setattr(instrumentation, 'record_sql', record)
+    return statements
+
+
+def normalize_query(sql):
+    # an IN list has a placeholder for each of its values, so any number of them is the same query
+    return re.sub(r'IN \((\?, )*\?\)', 'IN (?)', ' '.join(sql.split()))
+
+
+def unregistered_queries(statements):
+    # the statements that look rows up but are not in ROUTE_QUERIES, so their query plans are never checked
+    registered = {normalize_query(query) for query in ROUTE_QUERIES}
+    return sorted({
+        normalize_query(sql) for sql in statements
+        if (sql.startswith('SELECT') or ' WHERE ' in sql) and normalize_query(sql) not in registered
+    })
@@ -0,0 +1,96 @@
+import time
+from types import SimpleNamespace
+import pytest
+import requests
+import cassettes
+from cassettes import CassetteStore, ReplayAdapter, request_key
+from conftest import app_config, register, upstream_stats
+from helper_methods import open_db_connection
+from app import create_app
+
+
+def browse(app, client):
+    # a search, its first page of results and the thumbnail of the first artwork on it; returns the pages' bodies
+    location = client.post('/search', data={'search': 'monet'}).headers['Location']
+    results = client.get(location)
+    assert results.status_code == 200
+    conn = open_db_connection(app.config['DB_PATH'])
+    artwork_id = conn.execute("SELECT artwork_id FROM artworks WHERE display_url IS NOT NULL ORDER BY artwork_id LIMIT 1").fetchone()['artwork_id']
+    conn.close()
+    thumbnail = client.get(f'/images/{artwork_id}/thumbnail')
+    assert thumbnail.status_code == 200
+    return results.data, thumbnail.data
+
+
+def test_responses_recorded_from_the_api_are_replayed_without_it(tmp_path, aic_server):
+    cassette_path = str(tmp_path / 'cassettes.db')
+    (tmp_path / 'record').mkdir()
+    (tmp_path / 'replay').mkdir()
+    recording = create_app(app_config(tmp_path / 'record', aic_server, AIC_TRANSPORT='record', AIC_CASSETTE_PATH=cassette_path))
+    client = recording.test_client()
+    register(client, 'alice')
+    recorded = browse(recording, client)
+    transport_stats = recording.extensions['services']['api_transport'].stats
+    assert transport_stats['recorded'] > 0
+    assert CassetteStore(cassette_path).count() >= transport_stats['recorded']
+
+    # nothing listens on port 9, so every answer has to come from the store
+    replaying = create_app(app_config(tmp_path / 'replay', 'http://127.0.0.1:9', AIC_TRANSPORT='replay', AIC_CASSETTE_PATH=cassette_path))
+    client = replaying.test_client()
+    register(client, 'alice')
+    before = upstream_stats(aic_server)
+    assert browse(replaying, client) == recorded
+    assert upstream_stats(aic_server) == before
+
+    api_stats = replaying.extensions['services']['api_transport'].stats
+    image_stats = replaying.extensions['services']['image_transport'].stats
+    assert api_stats['hits'] > 0 and image_stats['hits'] > 0
+    assert api_stats['misses'] == image_stats['misses'] == 0
+
+
+@pytest.fixture
+def replay_session(tmp_path):
+    # a requests session that replays a store holding one response; returns the session, its adapter and the response's url
+    store = CassetteStore(str(tmp_path / 'cassettes.db'))
+    url = 'http://aic.test/api/v1/artworks/1'
+    store.put(request_key('GET', url), 200, 'application/json', b'{"data": {"id": 1}}')
+    session = requests.Session()
+
+    def replay(**kwargs):
+        adapter = ReplayAdapter(store, **kwargs)
+        session.mount('http://', adapter)
+        return adapter
+    yield session, replay, url
+    session.close()
+
+
+def test_a_request_that_was_not_recorded_is_a_miss(replay_session):
+    session, replay, url = replay_session
+    adapter = replay()
+    assert session.get(url).json() == {'data': {'id': 1}}
+    assert session.get(url + '?fields=id').status_code == 404
+    assert (adapter.stats['hits'], adapter.stats['misses']) == (1, 1)
+
+
+def test_replayed_responses_wait_for_the_latency(replay_session):
+    session, replay, url = replay_session
+    replay(latency_ms=50)
+    start = time.monotonic()
+    for _ in range(3):
+        assert session.get(url).status_code == 200
+    assert time.monotonic() - start >= 0.15
+
+
+def test_replay_fails_the_error_rate_of_requests(replay_session, monkeypatch):
+    session, replay, url = replay_session
+    adapter = replay(error_rate=0.25)
+    rolls = iter([0.1, 0.3, 0.5, 0.9, 0.2, 0.7, 0.8, 0.4, 0.99])
+    monkeypatch.setattr(cassettes, 'random', SimpleNamespace(random=lambda: next(rolls)))
+
+    statuses = [session.get(url).status_code for _ in range(8)]
+    assert statuses == [503, 200, 200, 200, 503, 200, 200, 200]
+    assert (adapter.stats['injected_errors'], adapter.stats['hits']) == (2, 6)
+
+    adapter = replay(error_rate=1)
+    assert session.get(url).status_code == 503
+    assert adapter.stats['injected_errors'] == 1
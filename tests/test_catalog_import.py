@@ -0,0 +1,65 @@
+import gzip
+import json
+import pytest
+from catalog_import import get_checkpoint, import_catalog
+
+
+def make_artwork(artwork_id, is_public_domain=True, title=None):
+    return {'id': artwork_id, 'title': title or f'Artwork {artwork_id}', 'image_id': f'image-{artwork_id}', 'artist_display': 'Artist', 'date_display': '1900', 'is_public_domain': is_public_domain}
+
+
+@pytest.fixture
+def dump(tmp_path):
+    # a small dump: a JSON Lines file with one artwork that is not in the public domain, and a gzipped API response
+    directory = tmp_path / 'dump'
+    directory.mkdir()
+    with open(directory / 'a.jsonl', 'w') as file:
+        for artwork in [make_artwork(1), make_artwork(2), make_artwork(3, is_public_domain=False), make_artwork(4), make_artwork(5)]:
+            file.write(json.dumps(artwork) + '\n')
+    with gzip.open(directory / 'b.json.gz', 'wt') as file:
+        json.dump({'data': [make_artwork(6), make_artwork(7)]}, file)
+    return directory
+
+
+def imported_artworks(conn):
+    return {row['artwork_id']: row['title'] for row in conn.execute("SELECT artwork_id, title FROM artworks WHERE catalog_imported_at IS NOT NULL")}
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_an_interrupted_import_resumes_from_its_checkpoint(conn, dump):
+    def stop_after_two_batches(records_read, rows_written, elapsed_seconds):
+        if records_read >= 4:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        import_catalog(conn, [str(dump)], batch_size=2, progress=stop_after_two_batches)
+    # the batches before the interruption were committed, along with how far they got
+    assert sorted(imported_artworks(conn)) == [1, 2, 4]
+    assert get_checkpoint(conn, str(dump)) == (str(dump / 'a.jsonl'), 4)
+
+    # the rest of the first file and all of the second are read, and nothing before the checkpoint is read again
+    records_read, rows_written, elapsed_seconds = import_catalog(conn, [str(dump)], batch_size=2)
+    assert (records_read, rows_written) == (3, 3)
+    assert sorted(imported_artworks(conn)) == [1, 2, 4, 5, 6, 7]
+    assert get_checkpoint(conn, str(dump)) is None
+
+
+def test_rerunning_an_unchanged_import_writes_no_artworks(app, dump):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['import-catalog', str(dump), '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert '6 artworks were added or changed' in result.output
+
+    result = runner.invoke(args=['import-catalog', str(dump), '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'imported 7 records' in result.output
+    assert '0 artworks were added or changed' in result.output
+
+    # an artwork that changed in the dump is the only one written
+    with open(dump / 'a.jsonl', 'a') as file:
+        file.write(json.dumps(make_artwork(1, title='Renamed')) + '\n')
+    result = runner.invoke(args=['import-catalog', str(dump), '--batch-size', '2'])
+    assert '1 artworks were added or changed' in result.output
@@ -0,0 +1,101 @@
+import time
+import pytest
+from aic_client import AICClient, CircuitBreaker, FairScheduler, UpstreamThrottled, UpstreamUnavailable
+from conftest import upstream_stats
+
+
+def test_the_circuit_opens_after_enough_failures_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+
+def test_one_trial_call_is_let_through_after_the_reset_time():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    time.sleep(0.05)
+    assert breaker.allow_request()
+    # only one call at a time tries the API while the circuit is open
+    assert not breaker.allow_request()
+
+    # the trial failed, so the circuit stays open for another reset_seconds
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    time.sleep(0.05)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_an_open_circuit_fails_fast_without_calling_the_api(failing_aic_server):
+    client = AICClient(failing_aic_server + '/api/v1', max_retries=1, backoff_seconds=0, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=30))
+    before = upstream_stats(failing_aic_server).get('injected_error', 0)
+    for _ in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            client.get('/artworks/1')
+    # each failed call was tried once and retried once
+    assert upstream_stats(failing_aic_server)['injected_error'] == before + 4
+
+    with pytest.raises(UpstreamUnavailable):
+        client.get('/artworks/1')
+    assert upstream_stats(failing_aic_server)['injected_error'] == before + 4
+
+
+def test_a_response_that_is_not_retried_closes_the_circuit(aic_server):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0)
+    breaker.record_failure()
+    client = AICClient(aic_server + '/api/v1', breaker=breaker)
+    # the API refuses to page past page 100 with a 403, which is returned to the caller rather than retried
+    assert client.get('/artworks/search', params={'q': 'monet', 'page': 101}).status_code == 403
+    assert breaker.failures == 0
+
+
+def make_scheduler(tokens):
+    # a scheduler with tokens left that gets a new one only every 100 seconds, and sheds a request after a moment
+    scheduler = FairScheduler('test', 0.01, 1, {'interactive': 0.05, 'background': 0.05})
+    scheduler.tokens = tokens
+    return scheduler
+
+
+def test_an_open_circuit_does_not_take_a_turn_under_the_rate_limit(aic_server):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    scheduler = make_scheduler(1)
+    client = AICClient(aic_server + '/api/v1', breaker=breaker, scheduler=scheduler)
+    with pytest.raises(UpstreamUnavailable) as raised:
+        client.get('/artworks/1')
+    assert not isinstance(raised.value, UpstreamThrottled)
+    assert scheduler.tokens == 1
+
+
+def test_a_throttled_retry_is_not_counted_as_a_failure_of_the_api(failing_aic_server):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    # enough for the first attempt, but not for its retry
+    client = AICClient(failing_aic_server + '/api/v1', max_retries=2, backoff_seconds=0, breaker=breaker, scheduler=make_scheduler(1))
+    with pytest.raises(UpstreamThrottled):
+        client.get('/artworks/1')
+    assert breaker.failures == 0
+    assert breaker.allow_request()
+
+
+def test_a_throttled_trial_call_lets_the_next_call_try(aic_server):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    scheduler = make_scheduler(0)
+    client = AICClient(aic_server + '/api/v1', breaker=breaker, scheduler=scheduler)
+    with pytest.raises(UpstreamThrottled):
+        client.get('/artworks/1')
+
+    scheduler.tokens = 1
+    assert client.get('/artworks/1').status_code == 200
+    assert breaker.opened_at is None
@@ -0,0 +1,152 @@
+import io
+import json
+import sqlite3
+import threading
+import zipfile
+import pytest
+import collection_transfer
+import helper_methods
+from conftest import create_collection, register, unregistered_queries, upstream_stats, wait_until
+from helper_methods import open_db_connection
+
+
+def test_searching_another_users_collection_is_not_found(app, client):
+    collection_id = create_collection(app, client, 'Impressionists')
+    assert client.post('/collection_search', data={'collection-search': 'monet', 'collection_id': collection_id}).status_code == 200
+
+    other = app.test_client()
+    register(other, 'bob')
+    response = other.post('/collection_search', data={'collection-search': 'monet', 'collection_id': collection_id})
+    assert response.status_code == 404
+    assert b'Impressionists' not in response.data
+
+
+def test_searching_a_collection_that_does_not_exist_is_not_found(client):
+    assert client.post('/collection_search', data={'collection-search': 'monet', 'collection_id': 12345}).status_code == 404
+
+
+@pytest.fixture
+def export_connections(monkeypatch):
+    # the connections that exports open
+    connections = []
+
+    def open_connection(*args):
+        connections.append(open_db_connection(*args))
+        return connections[-1]
+    monkeypatch.setattr(collection_transfer, 'open_db_connection', open_connection)
+    return connections
+
+
+def assert_closed(connections):
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def import_collections(client, lines):
+    data = ''.join(json.dumps(line) + '\n' for line in lines).encode()
+    response = client.post('/collections/import', data={'collections-file': (io.BytesIO(data), 'collections.jsonl')}, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def test_an_export_reads_what_was_imported_on_its_own_connection(app, client, export_connections):
+    import_collections(client, [
+        {'collection': 'Impressionists', 'artwork_id': 1, 'title': 'Artwork 1'},
+        {'collection': 'Impressionists', 'artwork_id': 2, 'title': 'Artwork 2'},
+        {'collection': 'Empty'},
+    ])
+
+    # the artworks' details are fetched from the API after the import
+    wait_until(lambda: app.extensions['services']['artwork_prefetcher'].stats['completed'] == 1)
+
+    response = client.get('/collections/export?format=jsonl')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(line['collection'], line['artwork_id']) for line in lines] == [('Impressionists', 1), ('Impressionists', 2), ('Empty', None)]
+    assert lines[0]['artist_info'] == 'Artist 1\nAmerican, 1850-1920'
+
+    response = client.get('/collections/export?format=zip')
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert len(archive.read('collections.jsonl').splitlines()) == 3
+
+    # one for the JSON Lines, and one each for the ZIP's collections.jsonl and its images
+    assert len(export_connections) == 3
+    assert_closed(export_connections)
+
+
+def test_an_import_is_answered_before_the_artworks_details_are_fetched(app, client, aic_server, monkeypatch):
+    fetching = threading.Event()
+    fetched = threading.Event()
+    hydrate_artworks = helper_methods.hydrate_artworks
+
+    def hydrate_when_released(artwork_ids):
+        fetching.set()
+        assert fetched.wait(10)
+        hydrate_artworks(artwork_ids)
+    monkeypatch.setattr(helper_methods, 'hydrate_artworks', hydrate_when_released)
+
+    before = upstream_stats(aic_server).get('artworks_by_ids', 0)
+    app.config['COLLECTION_IMPORT_BATCH_SIZE'] = 2
+    import_collections(client, [{'collection': 'Impressionists', 'artwork_id': artwork_id, 'title': None} for artwork_id in range(1, 11)])
+    assert fetching.wait(10)
+    assert upstream_stats(aic_server).get('artworks_by_ids', 0) == before
+
+    # all five batches' artworks are fetched together in the background
+    fetched.set()
+    wait_until(lambda: app.extensions['services']['artwork_prefetcher'].stats['completed'] == 1)
+    assert upstream_stats(aic_server).get('artworks_by_ids', 0) == before + 1
+
+
+def test_an_abandoned_export_closes_its_connection(app, client, export_connections):
+    import_collections(client, [{'collection': 'Impressionists', 'artwork_id': artwork_id, 'title': None} for artwork_id in range(1, 11)])
+    app.config['COLLECTION_EXPORT_CHUNK_SIZE'] = 2
+
+    response = client.get('/collections/export?format=csv', buffered=False)
+    assert next(response.response)
+    assert len(export_connections) == 1
+    response.close()
+    assert_closed(export_connections)
+
+
+def start_search(client, term):
+    # search for term and return the id of the search
+    location = client.post('/search', data={'search': term}).headers['Location']
+    return int(location.split('search_id=')[1].split('&')[0])
+
+
+def collected_artwork_ids(app, collection_id):
+    conn = open_db_connection(app.config['DB_PATH'])
+    try:
+        return [row['artwork_id'] for row in conn.execute("SELECT artwork_id FROM collected_works WHERE collection_id = ? ORDER BY id", [collection_id])]
+    finally:
+        conn.close()
+
+
+def test_bulk_changes_to_collections(app, client, executed_statements):
+    search_id = start_search(client, 'monet')
+    conn = open_db_connection(app.config['DB_PATH'])
+    page = [row['artwork_id'] for row in conn.execute("SELECT artwork_id FROM artwork_searches WHERE search_id = ? ORDER BY id", [search_id])]
+    conn.close()
+    executed_statements.clear()
+    first = create_collection(app, client, 'First')
+    second = create_collection(app, client, 'Second')
+
+    # the ticked artworks, then the whole page; the ones already in the collection are skipped
+    client.post('/add_to_collection', data={'search_id': search_id, 'page_number': 1, 'collection-select': first, 'artwork_ids': page[:3]})
+    client.post('/add_to_collection', data={'search_id': search_id, 'page_number': 1, 'collection-select': first, 'whole-page': 'on'})
+    assert collected_artwork_ids(app, first) == page[:3] + page[3:]
+
+    def edit(action, artwork_ids=(), target=second):
+        response = client.post('/edit_collection', data={'collection_id': first, 'action': action, 'artwork_ids': list(artwork_ids), 'target-collection-select': target})
+        assert response.status_code == 302
+
+    edit('remove', page[:1])
+    edit('copy', page[1:3])
+    assert collected_artwork_ids(app, second) == page[1:3]
+    edit('move', page[3:5])
+    assert collected_artwork_ids(app, first) == page[1:3] + page[5:]
+    edit('copy-all')
+    edit('merge')
+    assert collected_artwork_ids(app, second) == page[1:]
+    assert client.get(f'/collections/{first}').status_code == 404
+
+    assert unregistered_queries(executed_statements) == []
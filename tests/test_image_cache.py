@@ -0,0 +1,108 @@
+import os
+import threading
+import app as app_module
+from conftest import wait_until
+from helper_methods import open_db_connection
+from image_cache import ImageCache
+
+
+class Downloads:
+    # a download function for an ImageCache that writes size bytes for every url, and records the urls it was called with
+    def __init__(self, size=100):
+        self.size = size
+        self.urls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, url, file):
+        self.urls.append(url)
+        assert self.release.wait(10)
+        file.write(b'\0' * self.size)
+        return True
+
+
+def cached_urls(cache, urls):
+    return [url for url in urls if os.path.exists(os.path.join(cache.directory, cache.get_name(url)))]
+
+
+def test_the_least_recently_served_images_are_evicted_first(tmp_path):
+    download = Downloads(size=100)
+    cache = ImageCache(str(tmp_path), max_bytes=300)
+    for url in ('a', 'b', 'c'):
+        cache.get(url, download)
+    # serving a makes b the least recently served
+    cache.get('a', download)
+    cache.get('d', download)
+
+    assert cached_urls(cache, 'abcd') == ['a', 'c', 'd']
+    assert cache.total_bytes == 300
+    assert cache.stats['evictions'] == 1
+    assert download.urls == ['a', 'b', 'c', 'd']
+
+    # the order is kept in the files' modification times, so it survives a restart
+    os.utime(os.path.join(tmp_path, cache.get_name('c')), (1, 1))
+    restarted = ImageCache(str(tmp_path), max_bytes=300)
+    restarted.get('e', download)
+    assert cached_urls(restarted, 'acde') == ['a', 'd', 'e']
+
+
+def test_the_newest_image_is_kept_even_if_it_is_over_the_limit(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=150)
+    cache.get('a', Downloads(size=100))
+    cache.get('b', Downloads(size=500))
+    assert cached_urls(cache, 'ab') == ['b']
+    assert cache.total_bytes == 500
+
+
+def test_an_image_that_could_not_be_downloaded_is_not_cached(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    assert cache.get('a', lambda url, file: False) is None
+    assert os.listdir(tmp_path) == []
+    assert cache.total_bytes == 0
+
+
+def test_concurrent_requests_for_an_image_share_one_download(tmp_path):
+    download = Downloads()
+    download.release.clear()
+    cache = ImageCache(str(tmp_path))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('a', download))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.flight.stats['coalesced'] == 4)
+    download.release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert download.urls == ['a']
+    assert len(set(results)) == 1 and results[0] is not None
+    assert (cache.stats['misses'], cache.stats['coalesced']) == (1, 4)
+
+
+def test_an_image_evicted_before_it_is_sent_is_downloaded_again(app, client, monkeypatch):
+    location = client.post('/search', data={'search': 'monet'}).headers['Location']
+    client.get(location)
+    conn = open_db_connection(app.config['DB_PATH'])
+    artwork_id = conn.execute("SELECT artwork_id FROM artworks WHERE display_url IS NOT NULL LIMIT 1").fetchone()['artwork_id']
+    conn.close()
+    image_cache = app.extensions['services']['image_cache']
+
+    # another request evicts the image just after this one looked it up
+    get_artwork_image = app_module.get_artwork_image
+    evicted = []
+
+    def get_then_evict(display_url, rendition):
+        path, etag = get_artwork_image(display_url, rendition)
+        if not evicted:
+            evicted.append(path)
+            with image_cache.lock:
+                image_cache.forget(os.path.basename(path))
+            os.remove(path)
+        return path, etag
+    monkeypatch.setattr(app_module, 'get_artwork_image', get_then_evict)
+
+    response = client.get(f'/images/{artwork_id}/thumbnail')
+    assert response.status_code == 200
+    assert response.data
+    assert evicted and os.path.exists(evicted[0])
+    assert image_cache.stats['misses'] == 2
@@ -0,0 +1,41 @@
+import instrumentation
+from instrumentation import request_db_connections, request_sql_statements
+
+
+def observed(histogram, *label_values):
+    # (sum, count) of the histogram's series for the label values so far
+    series = histogram.snapshot().get(label_values)
+    return (series['sum'], series['count']) if series else (0, 0)
+
+
+def test_a_page_of_search_results_opens_one_database_connection(client):
+    location = client.post('/search', data={'search': 'monet'}).headers['Location']
+    before = observed(request_db_connections, '/search_results')
+
+    # a page that is fetched from the API and saved, then one that is already stored
+    assert client.get(location.replace('page_number=1', 'page_number=2')).status_code == 200
+    assert client.get(location).status_code == 200
+
+    total, count = observed(request_db_connections, '/search_results')
+    assert (total - before[0], count - before[1]) == (2, 2)
+
+
+def test_the_sql_that_saves_the_session_counts_towards_the_request(client, monkeypatch):
+    # the statements run while there are stats to record them in
+    counted = []
+    record_sql = instrumentation.record_sql
+
+    def record(sql, seconds):
+        if instrumentation.get_request_stats() is not None:
+            counted.append(sql)
+        record_sql(sql, seconds)
+    monkeypatch.setattr(instrumentation, 'record_sql', record)
+
+    client.get('/logout')
+    counted.clear()
+    before = observed(request_sql_statements, '/login')
+    assert client.post('/login', data={'username': 'alice', 'password': 'password'}).status_code == 302
+
+    assert any(sql.startswith('INSERT INTO sessions') for sql in counted)
+    total, count = observed(request_sql_statements, '/login')
+    assert (total - before[0], count - before[1]) == (len(counted), 1)
@@ -0,0 +1,44 @@
+import migrations
+from helper_methods import open_db_connection
+from migrations import MIGRATIONS, get_schema_version, upgrade_database
+
+
+def migrate_to(conn, monkeypatch, version):
+    # apply the migrations up to and including version
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', [migration for migration in MIGRATIONS if migration[0] <= version])
+        upgrade_database(conn)
+    assert get_schema_version(conn) == version
+
+
+def add_pages(conn, pages):
+    conn.executemany("INSERT INTO artwork_searches (search_id, current_page, artwork_id) VALUES(?, ?, ?)", pages)
+
+
+def stored_pages(conn, search_id):
+    return conn.execute("SELECT current_page, artwork_id FROM artwork_searches WHERE search_id = ? ORDER BY current_page, artwork_id", [search_id]).fetchall()
+
+
+def test_searches_that_normalize_to_the_same_term_are_merged(tmp_path, monkeypatch):
+    conn = open_db_connection(str(tmp_path / 'old.db'))
+    migrate_to(conn, monkeypatch, 8)
+    # before migration 9 a search's name was unique, but only as typed
+    conn.executemany("INSERT INTO searches (id, user_id, name, page_limit) VALUES(?, ?, ?, ?)", [
+        (1, 1, 'Monet', 5), (2, 1, 'monet ', 6), (3, 1, 'water  lilies', 2), (4, 1, 'Water Lilies', 3), (5, 2, 'MONET', 7),
+    ])
+    add_pages(conn, [(1, 1, 10), (1, 1, 11), (1, 3, 13), (2, 1, 10), (2, 1, 11), (2, 2, 12), (3, 1, 20), (5, 1, 10), (99, 1, 30)])
+    conn.commit()
+
+    upgrade_database(conn)
+
+    searches = conn.execute("SELECT id, user_id, name, normalized_name, page_limit FROM searches ORDER BY id").fetchall()
+    assert [tuple(search) for search in searches] == [
+        (2, 1, 'monet ', 'monet', 6), (4, 1, 'Water Lilies', 'water lilies', 3), (5, 2, 'MONET', 'monet', 7),
+    ]
+    # the newest search keeps its pages and gets the pages that only the older one had
+    assert [tuple(page) for page in stored_pages(conn, 2)] == [(1, 10), (1, 11), (2, 12), (3, 13)]
+    assert [tuple(page) for page in stored_pages(conn, 4)] == [(1, 20)]
+    assert [tuple(page) for page in stored_pages(conn, 5)] == [(1, 10)]
+    assert conn.execute("SELECT COUNT(*) FROM artwork_searches").fetchone()[0] == 6
+    conn.close()
+
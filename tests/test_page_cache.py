@@ -0,0 +1,63 @@
+from conftest import create_collection
+from helper_methods import open_db_connection
+
+
+def fill_collection(app, client, title):
+    # a collection with the first page of a search in it; returns its id and the search's url
+    location = client.post('/search', data={'search': 'monet'}).headers['Location']
+    search_id = int(location.split('search_id=')[1].split('&')[0])
+    collection_id = create_collection(app, client, title)
+    client.post('/add_to_collection', data={'search_id': search_id, 'page_number': 1, 'collection-select': collection_id, 'whole-page': 'on'})
+    return collection_id, location
+
+
+def backdate(app, seconds):
+    # move every row's modification time into the past, so that a change made now is in a later second than Last-Modified
+    conn = open_db_connection(app.config['DB_PATH'])
+    conn.execute("UPDATE collections SET updated_at = updated_at - ?", [seconds])
+    conn.execute("UPDATE artworks SET updated_at = updated_at - ?", [seconds])
+    conn.commit()
+    conn.close()
+
+
+def test_a_collection_page_is_sent_again_only_when_it_changes(app, client):
+    collection_id, location = fill_collection(app, client, 'Impressionists')
+    response = client.get(f'/collections/{collection_id}')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = client.get(f'/collections/{collection_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    # removing an artwork changes the collection's version
+    conn = open_db_connection(app.config['DB_PATH'])
+    artwork_id = conn.execute("SELECT artwork_id FROM collected_works WHERE collection_id = ?", [collection_id]).fetchone()['artwork_id']
+    conn.close()
+    client.post('/edit_collection', data={'collection_id': collection_id, 'action': 'remove', 'artwork_ids': [artwork_id]})
+    response = client.get(f'/collections/{collection_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_a_new_collection_is_in_the_menus_of_pages_checked_with_if_modified_since(app, client):
+    collection_id, location = fill_collection(app, client, 'Impressionists')
+    backdate(app, 10)
+    last_modified = client.get(f'/collections/{collection_id}').headers['Last-Modified']
+    assert client.get(f'/collections/{collection_id}', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    create_collection(app, client, 'Water Lilies')
+    response = client.get(f'/collections/{collection_id}', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert b'Water Lilies' in response.data
+
+
+def test_a_new_collection_is_in_the_menus_of_pages_of_search_results(app, client):
+    collection_id, location = fill_collection(app, client, 'Impressionists')
+    etag = client.get(location).headers['ETag']
+    assert client.get(location, headers={'If-None-Match': etag}).status_code == 304
+
+    create_collection(app, client, 'Water Lilies')
+    response = client.get(location, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Water Lilies' in response.data
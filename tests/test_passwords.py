@@ -0,0 +1,70 @@
+import os
+import time
+import pytest
+from werkzeug.security import generate_password_hash
+from conftest import register
+from helper_methods import open_db_connection
+from passwords import PasswordHasher, PasswordHasherBusy, get_hash_prefix
+
+
+@pytest.fixture
+def pooled_hasher():
+    # a hasher with one worker process and room for one hash at a time
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_size=1, wait_seconds=0.2)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_passwords_are_hashed_and_checked_on_the_pool(pooled_hasher):
+    assert pooled_hasher.run(os.getpid) != os.getpid()
+    password_hash = pooled_hasher.hash('password')
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert pooled_hasher.check(password_hash, 'password')
+    assert not pooled_hasher.check(password_hash, 'wrong')
+
+
+def test_a_login_that_cannot_get_a_slot_in_time_is_turned_away(pooled_hasher):
+    # the only slot is taken, as it is while another login's password is being hashed
+    assert pooled_hasher.slots.acquire(blocking=False)
+    start = time.monotonic()
+    with pytest.raises(PasswordHasherBusy):
+        pooled_hasher.hash('password')
+    assert time.monotonic() - start >= 0.2
+
+    # once it is free again, the next login gets it
+    pooled_hasher.slots.release()
+    assert pooled_hasher.check(pooled_hasher.hash('password'), 'password')
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'scrypt:16384:8:1', 'pbkdf2', 'pbkdf2:sha512', 'pbkdf2:sha256:1000'])
+def test_the_hash_prefix_is_the_one_werkzeug_writes(method):
+    assert get_hash_prefix(method) == generate_password_hash('password', method).split('$', 1)[0]
+
+
+def test_checking_for_a_rehash_does_not_hash_anything(monkeypatch):
+    hasher = PasswordHasher('scrypt', workers=0, queue_size=1, wait_seconds=0)
+    monkeypatch.setattr(hasher, 'run', None)
+    assert not hasher.needs_rehash('scrypt:32768:8:1$salt$hash')
+    assert hasher.needs_rehash('pbkdf2:sha256:600000$salt$hash')
+
+
+def stored_hash(app, username):
+    conn = open_db_connection(app.config['DB_PATH'])
+    try:
+        return conn.execute("SELECT hash FROM users WHERE username = ?", [username]).fetchone()['hash']
+    finally:
+        conn.close()
+
+
+def test_a_password_hashed_another_way_is_hashed_again_at_login(app):
+    client = app.test_client()
+    register(client, 'alice')
+    assert stored_hash(app, 'alice').startswith('pbkdf2:sha256:1000$')
+
+    app.extensions['services']['password_hasher'] = PasswordHasher('pbkdf2:sha256:2000', workers=0, queue_size=1, wait_seconds=0)
+    client.get('/logout')
+    assert client.post('/login', data={'username': 'alice', 'password': 'password'}).status_code == 302
+    assert stored_hash(app, 'alice').startswith('pbkdf2:sha256:2000$')
+
+    client.get('/logout')
+    assert client.post('/login', data={'username': 'alice', 'password': 'password'}).status_code == 302
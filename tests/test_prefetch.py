@@ -0,0 +1,86 @@
+import threading
+from conftest import wait_until
+from prefetch import Prefetcher
+
+
+class BlockingWork:
+    # work for a Prefetcher that records what it was called with, and waits for release() before finishing
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, user_id, *args):
+        self.calls.append((user_id, *args))
+        self.started.set()
+        assert self.released.wait(10)
+
+    def release(self):
+        self.released.set()
+
+
+def wait_for_idle(prefetcher):
+    wait_until(lambda: not prefetcher.in_flight)
+
+
+def test_the_same_work_is_only_queued_once_while_it_is_in_flight(app):
+    work = BlockingWork()
+    prefetcher = Prefetcher(work, max_workers=2, per_user_limit=5)
+    with app.app_context():
+        prefetcher.submit(1, 'monet:2', 'monet', 2)
+        prefetcher.submit(1, 'monet:2', 'monet', 2)
+        # another user's prefetch of the same page is their own
+        prefetcher.submit(2, 'monet:2', 'monet', 2)
+    work.release()
+    wait_for_idle(prefetcher)
+
+    assert sorted(work.calls) == [(1, 'monet', 2), (2, 'monet', 2)]
+    assert prefetcher.stats['deduplicated'] == 1
+
+    # once it has finished, the same page can be prefetched again
+    with app.app_context():
+        prefetcher.submit(1, 'monet:2', 'monet', 2)
+    wait_for_idle(prefetcher)
+    assert len(work.calls) == 3
+
+
+def test_cancel_drops_the_users_queued_work(app):
+    work = BlockingWork()
+    # one worker, so everything after the first piece of work stays queued until it finishes
+    prefetcher = Prefetcher(work, max_workers=1, per_user_limit=5)
+    with app.app_context():
+        prefetcher.submit(1, 'monet:2', 'monet', 2)
+        assert work.started.wait(10)
+        prefetcher.submit(1, 'monet:3', 'monet', 3)
+        prefetcher.submit(2, 'water lilies:2', 'water lilies', 2)
+
+    prefetcher.cancel(1)
+    work.release()
+    wait_for_idle(prefetcher)
+
+    # the work that was already running finishes, and the other user's is unaffected
+    assert work.calls == [(1, 'monet', 2), (2, 'water lilies', 2)]
+    assert prefetcher.stats['cancelled'] == 1
+    assert not prefetcher.user_in_flight
+
+
+def test_prefetches_are_queued_behind_the_pages_users_are_waiting_on(app, client, monkeypatch):
+    # the priority that each call to the API was queued at, with the name of the thread that made it
+    scheduler = app.extensions['services']['aic_scheduler']
+    acquire = scheduler.acquire
+    priorities = []
+
+    def record_priority(priority=None):
+        priorities.append((threading.current_thread().name, priority or scheduler.get_caller()[1]))
+        return acquire(priority)
+    monkeypatch.setattr(scheduler, 'acquire', record_priority)
+
+    app.config['PREFETCH_ENABLED'] = True
+    prefetcher = app.extensions['services']['search_prefetcher']
+    location = client.post('/search', data={'search': 'monet'}).headers['Location']
+    client.get(location)
+    wait_until(lambda: prefetcher.stats['completed'] >= 1)
+
+    prefetched = [priority for thread, priority in priorities if thread.startswith('prefetch')]
+    assert prefetched and set(prefetched) == {'background'}
+    assert 'interactive' in [priority for thread, priority in priorities if not thread.startswith('prefetch')]
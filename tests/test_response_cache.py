@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+import api_cache
+from api_cache import ResponseCache, normalize_search_key
+from conftest import register, upstream_stats
+
+
+class Clock:
+    # stands in for the time module in api_cache, so that entries can be aged without sleeping
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+def make_cache(conn, monkeypatch, **options):
+    clock = Clock()
+    monkeypatch.setattr(api_cache, 'time', SimpleNamespace(time=clock.time))
+    return ResponseCache(lambda: conn, **options), clock
+
+
+def test_entries_expire_after_the_ttl(conn, monkeypatch):
+    cache, clock = make_cache(conn, monkeypatch, ttl_seconds=60)
+    cache.set('search:monet:1', {'data': [1]})
+    clock.now += 59
+    assert cache.get('search:monet:1') == {'data': [1]}
+
+    clock.now += 1
+    assert cache.get('search:monet:1') is None
+    assert cache.stats['expirations'] == 1
+    # an expired entry is still there for when the API is down
+    assert cache.get_stale('search:monet:1') == {'data': [1]}
+
+
+def test_stored_tier_answers_after_the_memory_tier_evicts(conn, monkeypatch):
+    cache, clock = make_cache(conn, monkeypatch, max_memory_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key)
+    assert list(cache.memory) == ['b', 'c']
+    assert cache.stats['evictions'] == 1
+
+    assert cache.get('a') == 'a'
+    assert cache.stats['stored_hits'] == 1
+    # reading 'a' from the database puts it back in memory as the most recently used, pushing out 'b'
+    assert list(cache.memory) == ['c', 'a']
+
+
+def test_memory_tier_evicts_the_least_recently_used(conn, monkeypatch):
+    cache, clock = make_cache(conn, monkeypatch, max_memory_entries=2)
+    cache.set('a', 'a')
+    cache.set('b', 'b')
+    assert cache.get('a') == 'a'
+    cache.set('c', 'c')
+    assert list(cache.memory) == ['a', 'c']
+    assert cache.stats['memory_hits'] == 1
+
+
+def test_trim_drops_expired_rows_and_the_oldest_beyond_the_limit(conn, monkeypatch):
+    cache, clock = make_cache(conn, monkeypatch, ttl_seconds=1000, max_stored_entries=50)
+    cache.set('expired', 'expired')
+    clock.now += 1000
+    for number in range(99):
+        clock.now += 1
+        cache.set(f'key {number}', number)
+
+    # the 100th write trims the table
+    keys = [row['key'] for row in conn.execute("SELECT key FROM api_responses ORDER BY fetched_at")]
+    assert len(keys) == 50
+    assert keys[0] == 'key 49' and keys[-1] == 'key 98'
+    assert cache.stats['expirations'] == 1
+    assert cache.stats['evictions'] == 49
+
+
+def test_warm_loads_the_most_recent_fresh_entries(conn, monkeypatch):
+    cache, clock = make_cache(conn, monkeypatch, ttl_seconds=100, max_memory_entries=3)
+    cache.set('old', 'old')
+    clock.now += 100
+    for key in ('a', 'b', 'c', 'd'):
+        clock.now += 1
+        cache.set(key, key)
+
+    # as a new process would, with nothing in memory yet
+    warmed = ResponseCache(lambda: conn, ttl_seconds=100, max_memory_entries=3)
+    assert warmed.warm() == 3
+    assert list(warmed.memory) == ['b', 'c', 'd']
+
+
+def test_a_search_is_fetched_once_for_every_user(app, client, aic_server):
+    before = upstream_stats(aic_server).get('search', 0)
+    client.post('/search', data={'search': 'Water Lilies'})
+
+    other = app.test_client()
+    register(other, 'bob')
+    response = other.post('/search', data={'search': ' water  lilies'})
+    assert response.status_code == 302
+
+    assert upstream_stats(aic_server)['search'] == before + 1
+    cache = app.extensions['services']['search_cache']
+    assert normalize_search_key('WATER LILIES', 1) in cache.memory
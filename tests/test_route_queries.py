@@ -0,0 +1,73 @@
+import ast
+import glob
+import io
+import os
+from conftest import ROOT, create_collection, normalize_query, unregistered_queries
+from helper_methods import open_db_connection
+from migrations import ROUTE_QUERIES, check_query_plans
+
+
+def strings_in_code():
+    # every string in the app's modules, with the strings that are split over several lines joined up, and an f-string's fields as '?'
+    strings = set()
+    for path in glob.glob(os.path.join(ROOT, '*.py')):
+        if os.path.basename(path) == 'migrations.py':
+            continue
+        with open(path) as file:
+            tree = ast.parse(file.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                strings.add(normalize_query(node.value))
+            elif isinstance(node, ast.JoinedStr):
+                strings.add(normalize_query(''.join(value.value if isinstance(value, ast.Constant) else '?' for value in node.values)))
+    return strings
+
+
+def test_every_route_query_is_run_by_the_code():
+    strings = strings_in_code()
+    assert [query for query in ROUTE_QUERIES if normalize_query(query) not in strings] == []
+
+
+def test_every_route_query_uses_an_index(conn):
+    assert check_query_plans(conn) == []
+
+
+def test_the_routes_only_run_registered_queries(app, client, executed_statements):
+    # a user's journey through every route, keeping few enough searches that the oldest are expired along the way
+    app.config['SEARCHES_PER_USER'] = 2
+    client.get('/')
+    client.get('/logout')
+    client.post('/login', data={'username': 'alice', 'password': 'password'})
+    client.get('/search')
+    for term in ('monet', 'water lilies', 'haystacks'):
+        location = client.post('/search', data={'search': term}).headers['Location']
+    search_id = int(location.split('search_id=')[1].split('&')[0])
+    etag = client.get(location).headers['ETag']
+    assert client.get(location, headers={'If-None-Match': etag}).status_code == 304
+    client.get(f'/search_results?search_id={search_id}&page_number=2')
+
+    collection_id = create_collection(app, client, 'Favourites')
+    client.post('/add_to_collection', data={'search_id': search_id, 'page_number': 1, 'collection-select': collection_id, 'whole-page': 'on'})
+    conn = open_db_connection(app.config['DB_PATH'])
+    artwork_id = conn.execute("SELECT artwork_id FROM artwork_searches WHERE search_id = ? AND current_page = 2", [search_id]).fetchone()['artwork_id']
+    conn.close()
+    client.post('/artwork_showpage', data={'add_to_collection': artwork_id, 'search_id': search_id, 'page_number': 2})
+    client.get(f'/artworks/{artwork_id}?search_id={search_id}&page_number=2')
+    client.get(f'/images/{artwork_id}/thumbnail')
+    client.get(f'/images/{artwork_id}/full')
+
+    client.get('/collections')
+    for query in ('', '?after=0', '?before=999999'):
+        assert client.get(f'/collections/{collection_id}{query}').status_code == 200
+    client.get(f'/collections/{collection_id}/artworks/{artwork_id}')
+    client.post('/collection_search', data={'collection-search': 'artwork'})
+    client.post('/collection_search', data={'collection-search': 'artwork', 'collection_id': collection_id})
+    for export_format in ('jsonl', 'csv', 'zip'):
+        exported = client.get(f'/collections/export?format={export_format}&collection_id={collection_id}').get_data()
+    client.post('/collections/import', data={'collections-file': (io.BytesIO(exported), 'collections.zip')}, content_type='multipart/form-data')
+    client.post('/collection_artwork_showpage', data={'collection_id': collection_id, 'artwork_id': artwork_id, 'remove-artwork-from-collection': 'on'})
+    client.post('/delete_collection', data={'collection-delete-select': collection_id})
+    client.get('/metrics')
+    client.get('/logout')
+
+    assert unregistered_queries(executed_statements) == []
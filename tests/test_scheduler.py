@@ -0,0 +1,78 @@
+import threading
+import time
+import pytest
+from aic_client import FairScheduler, UpstreamThrottled
+from conftest import wait_until
+
+
+def make_scheduler(requests_per_second=20, burst=1, interactive_wait=5, background_wait=5):
+    # each request is queued under the name of the thread that makes it, so a test can act as several users
+    return FairScheduler(
+        'test', requests_per_second, burst, {'interactive': interactive_wait, 'background': background_wait},
+        get_caller=lambda: (threading.current_thread().name, 'interactive')
+    )
+
+
+def queue_in_order(scheduler, requests):
+    # start a thread for each (user, priority), each one queued before the next starts, and return the order they were let through in
+    granted = []
+    threads = []
+    for number, (user, priority) in enumerate(requests):
+        def acquire(user=user, priority=priority):
+            scheduler.acquire(priority)
+            granted.append((user, priority))
+        thread = threading.Thread(target=acquire, name=user)
+        threads.append(thread)
+        thread.start()
+        wait_until(lambda: sum(scheduler.queue_depths().values()) + len(granted) == number + 1)
+    for thread in threads:
+        thread.join(10)
+    return granted
+
+
+def test_without_a_rate_limit_nothing_waits():
+    scheduler = make_scheduler(requests_per_second=0, burst=0)
+    for _ in range(100):
+        scheduler.acquire()
+    assert scheduler.queue_depths() == {'interactive': 0, 'background': 0}
+
+
+def test_a_burst_goes_straight_through():
+    scheduler = make_scheduler(requests_per_second=1, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        scheduler.acquire()
+    assert time.monotonic() - start < 0.5
+    assert scheduler.tokens < 1
+
+
+def test_users_take_turns():
+    scheduler = make_scheduler()
+    scheduler.acquire()
+    granted = queue_in_order(scheduler, [('alice', 'interactive')] * 3 + [('bob', 'interactive')])
+    # bob's one request does not wait behind all of alice's
+    assert [user for user, priority in granted] == ['alice', 'bob', 'alice', 'alice']
+
+
+def test_interactive_requests_go_before_background_work():
+    scheduler = make_scheduler()
+    scheduler.acquire()
+    granted = queue_in_order(scheduler, [('prefetch', 'background')] * 2 + [('alice', 'interactive')])
+    assert granted[0] == ('alice', 'interactive')
+
+
+def test_a_request_that_would_wait_too_long_is_shed():
+    scheduler = make_scheduler(requests_per_second=1, burst=1, interactive_wait=0.05)
+    scheduler.acquire()
+    with pytest.raises(UpstreamThrottled):
+        scheduler.acquire('interactive')
+    assert scheduler.stats['interactive_shed'] == 1
+    assert scheduler.queue_depths() == {'interactive': 0, 'background': 0}
+
+
+def test_back_off_holds_every_request():
+    scheduler = make_scheduler(requests_per_second=20, burst=10, interactive_wait=0.05)
+    scheduler.back_off(1)
+    with pytest.raises(UpstreamThrottled):
+        scheduler.acquire()
+    assert scheduler.stats['backed_off'] == 1
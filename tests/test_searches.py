@@ -0,0 +1,20 @@
+import helper_methods
+import mock_aic_server
+
+
+def test_a_search_with_no_results_is_only_fetched_once(client, monkeypatch):
+    search = mock_aic_server.search
+    monkeypatch.setattr(mock_aic_server, 'search', lambda query, page: (0, []) if query == 'nothing' else search(query, page))
+    fetches = []
+    fetch_search_page = helper_methods.fetch_search_page
+    monkeypatch.setattr(helper_methods, 'fetch_search_page', lambda *args: fetches.append(args) or fetch_search_page(*args))
+
+    location = client.post('/search', data={'search': 'nothing'}).headers['Location']
+    assert fetches == [('nothing', 1)]
+
+    # later views are served from the database until the search expires
+    for _ in range(2):
+        response = client.get(location)
+        assert response.status_code == 200
+        assert b'Artwork' not in response.data
+    assert len(fetches) == 1
@@ -0,0 +1,50 @@
+from conftest import register
+from helper_methods import open_db_connection
+
+
+def session_id(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie is not None else None
+
+
+def stored_session_ids(app):
+    conn = open_db_connection(app.config['DB_PATH'])
+    try:
+        return {row['id'] for row in conn.execute("SELECT id FROM sessions")}
+    finally:
+        conn.close()
+
+
+def test_a_session_id_from_before_login_does_not_work_after_it(app):
+    # an attacker's own session id, planted in the victim's browser
+    attacker = app.test_client()
+    register(attacker, 'mallory')
+    planted = session_id(attacker)
+
+    victim = app.test_client()
+    victim.set_cookie('session', planted)
+    register(victim, 'alice')
+    assert session_id(victim) != planted
+    assert planted not in stored_session_ids(app)
+    assert victim.get('/search').status_code == 200
+
+    # the planted id does not give the attacker the victim's session, or their own any more
+    attacker.set_cookie('session', planted)
+    assert attacker.get('/search').status_code == 302
+
+
+def test_logging_in_again_gets_a_new_session_id(app, client):
+    before = session_id(client)
+    client.get('/logout')
+    assert before not in stored_session_ids(app)
+
+    response = client.post('/login', data={'username': 'alice', 'password': 'password'})
+    assert response.status_code == 302
+    assert session_id(client) not in (None, before)
+    assert stored_session_ids(app) == {session_id(client)}
+
+
+def test_an_unchanged_session_keeps_its_id(client):
+    before = session_id(client)
+    client.get('/search')
+    assert session_id(client) == before
@@ -0,0 +1,148 @@
+import threading
+import time
+import pytest
+from conftest import wait_until
+from helper_methods import open_db_connection
+from single_flight import SingleFlight, delete_expired_leases
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # the followers are waiting on the leader's flight before it finishes
+    wait_until(lambda: flight.stats['coalesced'] == 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == ['result'] * 5
+    assert flight.flights == {}
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def work():
+        started.set()
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', work)
+        except ValueError as error:
+            errors.append(error)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    wait_until(lambda: flight.stats['coalesced'])
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+@pytest.fixture
+def processes(conn):
+    # two SingleFlights with their own connections to one database, as two worker processes would have
+    # each thread opens its own connection, as each request does in the app
+    db_path = conn.execute("PRAGMA database_list").fetchone()['file']
+
+    def connection_per_thread():
+        local = threading.local()
+
+        def get_connection():
+            if not hasattr(local, 'conn'):
+                local.conn = open_db_connection(db_path)
+            return local.conn
+        return get_connection
+
+    return [SingleFlight(connection_per_thread(), lease_seconds=30, poll_seconds=0.01) for _ in range(2)]
+
+
+def test_another_process_waits_for_the_lease_and_uses_the_stored_result(processes):
+    first, second = processes
+    stored = {}
+    started = threading.Event()
+    release = threading.Event()
+
+    def first_work():
+        started.set()
+        release.wait(5)
+        stored['key'] = 'from the first process'
+        return stored['key']
+
+    def second_work():
+        raise AssertionError("the work was already done by the first process")
+
+    leader = threading.Thread(target=lambda: first.do('key', first_work, lambda: stored.get('key')))
+    leader.start()
+    started.wait(5)
+
+    results = []
+    follower = threading.Thread(target=lambda: results.append(second.do('key', second_work, lambda: stored.get('key'))))
+    follower.start()
+    wait_until(lambda: second.stats['waited_for_lease'])
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert results == ['from the first process']
+    assert second.stats['found_after_lease'] == 1
+    assert first.stats['led'] == 1
+
+
+def test_an_expired_lease_is_taken_over(processes, conn):
+    first, second = processes
+    # a lease left behind by a process that died while holding it
+    conn.execute("INSERT INTO flight_leases (key, owner, expires_at) VALUES('key', 'dead', ?)", [time.time() - 1])
+    conn.commit()
+
+    assert second.do('key', lambda: 'done again', lambda: None) == 'done again'
+    assert second.stats['waited_for_lease'] == 0
+    assert conn.execute("SELECT count(*) FROM flight_leases").fetchone()[0] == 0
+
+
+def test_a_failed_leader_releases_its_lease(processes, conn):
+    first, second = processes
+
+    def work():
+        raise ValueError('upstream failed')
+
+    with pytest.raises(ValueError):
+        first.do('key', work, lambda: None)
+    assert conn.execute("SELECT count(*) FROM flight_leases").fetchone()[0] == 0
+    assert second.do('key', lambda: 'done', lambda: None) == 'done'
+
+
+def test_delete_expired_leases(conn):
+    now = time.time()
+    conn.executemany("INSERT INTO flight_leases (key, owner, expires_at) VALUES(?, 'owner', ?)", [('old', now - 1), ('current', now + 30)])
+    conn.commit()
+
+    assert delete_expired_leases(conn) == 1
+    assert [row['key'] for row in conn.execute("SELECT key FROM flight_leases")] == ['current']
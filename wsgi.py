@@ -0,0 +1,5 @@
+# The app, for servers that are given a module and a variable, such as "gunicorn --preload -w 4 wsgi:app", and for "flask run", which looks for this file.
+# Importing it creates the app, which migrates the database and warms the caches; app.py itself only defines create_app.
+from app import create_app
+
+app = create_app()